@@ -1,9 +1,17 @@
+import asyncio
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from app.auth.manager import auth_backend, fastapi_users
+from app.common.middleware import MetricsMiddleware
+from app.common.settings import settings
+from app.common.tracing import setup_tracing
+from app.images.events import StatusBroadcaster
+from app.images.inline import InlineEditPool
 from app.images.router import router as image_router
+from app.images.s3 import close_client
 from app.db import create_db_and_tables
 from app.users.schemas import UserCreate, UserRead, UserUpdate
 
@@ -11,10 +19,30 @@ from app.users.schemas import UserCreate, UserRead, UserUpdate
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_db_and_tables()
-    yield
+    app.state.edit_pool = None
+    if settings.INLINE_EDIT_MAX_BYTES:
+        app.state.edit_pool = InlineEditPool.from_settings()
+    app.state.broadcaster = StatusBroadcaster(settings.EVENTS_QUEUE_SIZE)
+    broadcaster_task = asyncio.create_task(app.state.broadcaster.run())
+    try:
+        yield
+    finally:
+        broadcaster_task.cancel()
+        if app.state.edit_pool is not None:
+            app.state.edit_pool.shutdown()
+        await close_client()
 
 
+setup_tracing("api")
+
 app = FastAPI(docs_url="/api/docs", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 app.include_router(
     fastapi_users.get_auth_router(auth_backend),
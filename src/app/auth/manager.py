@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Optional
 from uuid import UUID
 
 from fastapi import Depends, Request
@@ -10,21 +10,106 @@ from fastapi_users.authentication import (
 )
 from fastapi_users.db import SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 from app.users.models import User
 from app.auth.tasks import EmailTypeEnum, send_email_task
+from app.common.cache import ICache, MemoryCache, RedisCache
 from app.common.settings import settings
 from app.db import get_async_session
 
 
+# Left out of the cache, which may be a Redis shared with other services.
+_UNCACHED_COLUMNS = ("hashed_password",)
+
+
+def _dump_user(user: User) -> dict[str, Any]:
+    return {
+        column.key: getattr(user, column.key)
+        for column in User.__table__.columns
+        if column.key not in _UNCACHED_COLUMNS
+    }
+
+
+def _load_user(data: dict[str, Any]) -> User:
+    user = User(**data)
+    # Lets the session UPDATE or DELETE the row instead of inserting it.
+    make_transient_to_detached(user)
+    return user
+
+
+class CachedUserDatabase(SQLAlchemyUserDatabase):
+    """User database that serves lookups by id from ``cache``.
+
+    Every authenticated request looks the user up by id. Updates and
+    deletes drop the cached entry, which covers profile changes,
+    deactivation, verification and password resets.
+
+    Cached users do not carry the password hash, reading it raises.
+    Lookups by email, which logins use, always go to the database, and
+    ``use_cache`` turns the cache off for checks that need the hash.
+    """
+
+    def __init__(self, session: AsyncSession, cache: ICache) -> None:
+        super().__init__(session, User)
+        self.cache = cache
+        self.use_cache = True
+
+    async def get(self, id: UUID) -> User | None:
+        if not self.use_cache:
+            return await super().get(id)
+        if (data := await self.cache.get(str(id))) is not None:
+            return _load_user(data)
+        user = await super().get(id)
+        if user is not None:
+            await self.cache.set(str(id), _dump_user(user))
+        return user
+
+    async def update(self, user: User, update_dict: dict[str, Any]) -> User:
+        user = await super().update(user, update_dict)
+        await self.cache.delete(str(user.id))
+        return user
+
+    async def delete(self, user: User) -> None:
+        await super().delete(user)
+        await self.cache.delete(str(user.id))
+
+
+def get_user_cache() -> ICache | None:
+    if settings.USER_CACHE_MODE == "redis":
+        return RedisCache(
+            settings.CACHE_REDIS_URI, settings.USER_CACHE_TTL, "user:"
+        )
+    if settings.USER_CACHE_MODE == "memory":
+        return MemoryCache(
+            settings.USER_CACHE_TTL, settings.USER_CACHE_MAX_SIZE
+        )
+    return None
+
+
+user_cache = get_user_cache()
+
+
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
-    yield SQLAlchemyUserDatabase(session, User)
+    if user_cache is None:
+        yield SQLAlchemyUserDatabase(session, User)
+    else:
+        yield CachedUserDatabase(session, user_cache)
 
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, UUID]):
     reset_password_token_secret = settings.SECRET
     verification_token_secret = settings.SECRET
 
+    async def reset_password(
+        self, token: str, password: str, request: Optional[Request] = None
+    ) -> User:
+        # The token is checked against the password hash, which cached
+        # users do not carry. The user database lives for one request.
+        if isinstance(self.user_db, CachedUserDatabase):
+            self.user_db.use_cache = False
+        return await super().reset_password(token, password, request)
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
@@ -0,0 +1,119 @@
+"""Async key-value caches whose entries expire after a fixed TTL."""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Protocol
+
+import redis.asyncio as redis
+from kombu.utils.json import dumps, loads
+
+
+class ICache(Protocol):
+    async def get(self, key: str) -> Any | None: ...
+
+    async def set(
+        self, key: str, value: Any, ttl: float | None = None
+    ) -> None: ...
+
+    async def delete(self, key: str) -> None: ...
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class MemoryCache:
+    """Per-process LRU cache holding at most ``max_size`` entries."""
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(
+        self, key: str, value: Any, ttl: float | None = None
+    ) -> None:
+        expires_at = time.monotonic() + (ttl or self._ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+class RedisCache:
+    """Cache shared by every replica, values are stored as JSON.
+
+    Redis errors are treated as misses, so an outage only costs the
+    lookups the cache would have saved.
+    """
+
+    def __init__(self, url: str, ttl: int, prefix: str) -> None:
+        self._client = redis.from_url(url)
+        self._ttl = ttl
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Any | None:
+        try:
+            data = await self._client.get(self._prefix + key)
+        except redis.RedisError:
+            return None
+        return None if data is None else loads(data)
+
+    async def set(
+        self, key: str, value: Any, ttl: float | None = None
+    ) -> None:
+        try:
+            await self._client.set(
+                self._prefix + key, dumps(value), ex=int(ttl or self._ttl)
+            )
+        except redis.RedisError:
+            pass
+
+    async def delete(self, key: str) -> None:
+        # A failed delete leaves the entry stale until it expires.
+        try:
+            await self._client.delete(self._prefix + key)
+        except redis.RedisError:
+            pass
+
+
+class TieredCache:
+    """Reads the local cache first and fills it from the shared one."""
+
+    def __init__(self, local: ICache, shared: ICache) -> None:
+        self._local = local
+        self._shared = shared
+
+    async def get(self, key: str) -> Any | None:
+        value = await self._local.get(key)
+        if value is None:
+            value = await self._shared.get(key)
+            if value is not None:
+                await self._local.set(key, value)
+        return value
+
+    async def set(
+        self, key: str, value: Any, ttl: float | None = None
+    ) -> None:
+        await self._local.set(key, value, ttl)
+        await self._shared.set(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await self._local.delete(key)
+        await self._shared.delete(key)
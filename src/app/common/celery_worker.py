@@ -1,5 +1,7 @@
 from celery import Celery
 from app.common.settings import settings
+# Registers the signal handlers in every process that uses Celery.
+import app.common.task_signals  # noqa: F401
 
 celery = Celery(
     "tasks",
@@ -7,3 +9,9 @@ celery = Celery(
     backend=settings.CELERY_RESULT_BACKEND,
 )
 celery.autodiscover_tasks(["app.auth", "app.images"])
+celery.conf.beat_schedule = {
+    "delete-stale-uploads": {
+        "task": "app.images.tasks.delete_stale_uploads_task",
+        "schedule": settings.UPLOAD_GC_INTERVAL,
+    },
+}
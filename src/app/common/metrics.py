@@ -0,0 +1,82 @@
+"""Prometheus metrics of the process.
+
+The API serves them on ``/metrics`` and the job worker on
+WORKER_METRICS_PORT.
+"""
+from collections.abc import Callable, Iterator
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import Collector
+
+_DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+class CallbackCounter(Collector):
+    """A counter kept elsewhere, read when the metrics are collected."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float],
+        registry: CollectorRegistry = REGISTRY,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._callback = callback
+        registry.register(self)
+
+    def collect(self) -> Iterator[CounterMetricFamily]:
+        yield CounterMetricFamily(
+            self.name, self.documentation, value=self._callback()
+        )
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request.",
+    ("method", "route", "status"),
+    buckets=_DEFAULT_BUCKETS,
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing a database statement.",
+    ("statement",),
+    buckets=_DEFAULT_BUCKETS,
+)
+db_pool_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection.",
+    buckets=_DEFAULT_BUCKETS,
+)
+file_io_duration = Histogram(
+    "image_file_io_duration_seconds",
+    "Time spent reading or writing image files.",
+    ("backend", "operation"),
+    buckets=_DEFAULT_BUCKETS,
+)
+file_io_bytes = Counter(
+    "image_file_io_bytes",
+    "Bytes of image files read or written.",
+    ("backend", "operation"),
+)
+transfer_bytes = Counter(
+    "image_transfer_bytes",
+    "Bytes of images uploaded by or sent to clients.",
+    ("direction",),
+)
+task_queue_delay = Histogram(
+    "task_queue_delay_seconds",
+    "Time between queueing a task and a worker starting it.",
+    ("task",),
+    buckets=_DEFAULT_BUCKETS,
+)
+task_stage_duration = Histogram(
+    "task_stage_duration_seconds",
+    "Time spent in each stage of an image task.",
+    ("stage",),
+    buckets=_DEFAULT_BUCKETS,
+)
@@ -0,0 +1,52 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.common.metrics import http_request_duration
+from app.common.tracing import span
+
+
+class MetricsMiddleware:
+    """Times every request by route and continues the caller's trace.
+
+    A plain ASGI middleware, so streamed responses are not buffered.
+    Streams are timed until their last byte is sent.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        carrier = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+        start = time.perf_counter()
+        with span(scope["method"], carrier=carrier) as current:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # The router stores the matched route in the scope.
+                route = scope.get("route")
+                path = getattr(route, "path", "unmatched")
+                http_request_duration.labels(
+                    method=scope["method"], route=path, status=status_code
+                ).observe(time.perf_counter() - start)
+                if current is not None:
+                    current.update_name(f"{scope['method']} {path}")
+                    current.set_attribute(
+                        "http.response.status_code", status_code
+                    )
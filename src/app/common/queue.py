@@ -0,0 +1,177 @@
+"""Postgres-backed job queue, an alternative to the Celery broker.
+
+Jobs are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` so several
+workers can poll the same table without handing a job out twice. A
+claimed job stays locked for JOB_LOCK_SECONDS, extended while it runs,
+and is claimed again after that if the worker died before completing
+it, even once it has used up its attempts, so that it can be given up.
+Its attempt number identifies a claim: a worker whose lock ran out can
+no longer extend, complete or release the job.
+"""
+import datetime
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Protocol
+
+from kombu.utils.json import dumps, loads
+from sqlalchemy import (
+    BigInteger,
+    DateTime,
+    Identity,
+    delete,
+    func,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.common.settings import settings
+from app.common.tracing import inject
+from app.db import Base, after_commit
+
+
+class JobTable(Base):
+    __tablename__ = "job"
+
+    id_: Mapped[int] = mapped_column(
+        BigInteger, Identity(), primary_key=True
+    )
+    name: Mapped[str]
+    # Serialized like Celery messages so UUIDs and datetimes round-trip.
+    kwargs: Mapped[str]
+    attempts: Mapped[int] = mapped_column(default=0)
+    locked_until: Mapped[datetime.datetime | None] = mapped_column(
+        DateTime(timezone=True)
+    )
+    enqueued_at: Mapped[datetime.datetime | None] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    # Trace context of the request that queued the job.
+    headers: Mapped[str | None]
+
+
+@dataclass
+class Job:
+    id_: int
+    name: str
+    kwargs: dict[str, Any]
+    attempts: int
+    enqueued_at: datetime.datetime | None = None
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class IJobQueue(Protocol):
+    async def enqueue(
+        self, session: AsyncSession, name: str, kwargs: dict[str, Any]
+    ) -> None: ...
+
+    async def claim(self, session: AsyncSession, limit: int) -> list[Job]: ...
+
+    async def extend(self, session: AsyncSession, job: Job) -> bool: ...
+
+    async def complete(self, session: AsyncSession, job: Job) -> None: ...
+
+    async def release(self, session: AsyncSession, job: Job) -> None: ...
+
+
+class JobQueue:
+    async def enqueue(
+        self, session: AsyncSession, name: str, kwargs: dict[str, Any]
+    ) -> None:
+        session.add(
+            JobTable(name=name, kwargs=dumps(kwargs), headers=dumps(inject()))
+        )
+
+    async def claim(self, session: AsyncSession, limit: int) -> list[Job]:
+        lock = datetime.timedelta(seconds=settings.JOB_LOCK_SECONDS)
+        claimable = (
+            select(JobTable.id_)
+            .where(
+                or_(
+                    JobTable.locked_until.is_(None),
+                    JobTable.locked_until < func.now(),
+                ),
+            )
+            .order_by(JobTable.id_)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(JobTable)
+            .where(JobTable.id_.in_(claimable.scalar_subquery()))
+            .values(
+                attempts=JobTable.attempts + 1,
+                locked_until=func.now() + lock,
+            )
+            .returning(
+                JobTable.id_,
+                JobTable.name,
+                JobTable.kwargs,
+                JobTable.attempts,
+                JobTable.enqueued_at,
+                JobTable.headers,
+            )
+        )
+        rows = (await session.execute(statement)).all()
+        await session.commit()
+        return [
+            Job(
+                id_=row.id_,
+                name=row.name,
+                kwargs=loads(row.kwargs),
+                attempts=row.attempts,
+                enqueued_at=row.enqueued_at,
+                headers=loads(row.headers) if row.headers else {},
+            )
+            for row in rows
+        ]
+
+    async def extend(self, session: AsyncSession, job: Job) -> bool:
+        """Lock the job for another JOB_LOCK_SECONDS, False if the claim
+        was lost."""
+        lock = datetime.timedelta(seconds=settings.JOB_LOCK_SECONDS)
+        statement = (
+            update(JobTable)
+            .where(JobTable.id_ == job.id_, JobTable.attempts == job.attempts)
+            .values(locked_until=func.now() + lock)
+            .returning(JobTable.id_)
+        )
+        extended = (await session.execute(statement)).one_or_none()
+        await session.commit()
+        return extended is not None
+
+    async def complete(self, session: AsyncSession, job: Job) -> None:
+        statement = delete(JobTable).where(
+            JobTable.id_ == job.id_, JobTable.attempts == job.attempts
+        )
+        await session.execute(statement)
+        await session.commit()
+
+    async def release(self, session: AsyncSession, job: Job) -> None:
+        """Unlock the job without counting the attempt."""
+        statement = (
+            update(JobTable)
+            .where(JobTable.id_ == job.id_, JobTable.attempts == job.attempts)
+            .values(attempts=JobTable.attempts - 1, locked_until=None)
+        )
+        await session.execute(statement)
+        await session.commit()
+
+
+job_queue = JobQueue()
+
+
+async def dispatch(session: AsyncSession, task, **kwargs) -> None:
+    """Queue a task as part of the session's transaction.
+
+    With TASK_QUEUE set to "postgres" the job row is inserted in the same
+    transaction as the rows it refers to. Otherwise ``task.delay`` is
+    called after the commit, so workers never see uncommitted rows and
+    a rolled back request sends nothing.
+    """
+    if settings.TASK_QUEUE == "postgres":
+        await job_queue.enqueue(session, task.name, kwargs)
+    else:
+        after_commit(session, partial(task.delay, **kwargs))
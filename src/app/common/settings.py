@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from envparse import Env
 from pydantic import PostgresDsn
@@ -12,13 +13,134 @@ env.read_envfile(".env")
 class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_SECONDS: int = env.int("ACCESS_TOKEN_EXPIRE_SECONDS")
     SECRET: str = env.str("SECRET")
+    # "memory" is dropped on update only in the process that made the
+    # change. Other replicas keep serving the old user, deactivated or
+    # unverified ones included, for up to USER_CACHE_TTL seconds. Use
+    # "redis" when running more than one API process.
+    USER_CACHE_MODE: Literal["off", "memory", "redis"] = env.str(
+        "USER_CACHE_MODE", default="memory"
+    )
+    USER_CACHE_TTL: int = env.int("USER_CACHE_TTL", default=60)
+    USER_CACHE_MAX_SIZE: int = env.int("USER_CACHE_MAX_SIZE", default=10000)
 
     MAX_FILE_SIZE_MB: int = env.str("MAX_FILE_SIZE_MB")
     FILE_CHUNK_SIZE: int = env.str("FILE_CHUNK_SIZE", default=1024 * 1024 * 10)
+    UPLOAD_BATCH_MAX_FILES: int = env.int(
+        "UPLOAD_BATCH_MAX_FILES", default=100
+    )
+    UPLOAD_CONCURRENCY: int = env.int("UPLOAD_CONCURRENCY", default=8)
+    # Resumable uploads untouched for this long are deleted.
+    UPLOAD_EXPIRE_SECONDS: int = env.int(
+        "UPLOAD_EXPIRE_SECONDS", default=24 * 60 * 60
+    )
+    UPLOAD_GC_INTERVAL: int = env.int("UPLOAD_GC_INTERVAL", default=60 * 60)
+    FILE_RESPONSE_CHUNK_SIZE: int = env.int(
+        "FILE_RESPONSE_CHUNK_SIZE", default=64 * 1024
+    )
 
     IMAGE_DIR_PATH: Path = Path(env.str("IMAGE_DIR_PATH"))
+    IMAGE_PAGE_SIZE: int = env.int("IMAGE_PAGE_SIZE", default=50)
+    IMAGE_PAGE_MAX_SIZE: int = env.int("IMAGE_PAGE_MAX_SIZE", default=500)
+    IMAGE_STORAGE_MODE: Literal["flat", "cas"] = env.str(
+        "IMAGE_STORAGE_MODE", default="flat"
+    )
+    IMAGE_STORAGE_BACKEND: Literal["local", "s3"] = env.str(
+        "IMAGE_STORAGE_BACKEND", default="local"
+    )
+    # Leave the endpoint unset for AWS, point it at MinIO and the like.
+    S3_ENDPOINT_URL: str | None = env.str("S3_ENDPOINT_URL", default=None)
+    S3_REGION: str | None = env.str("S3_REGION", default=None)
+    S3_BUCKET: str = env.str("S3_BUCKET", default="images")
+    S3_ACCESS_KEY_ID: str | None = env.str("S3_ACCESS_KEY_ID", default=None)
+    S3_SECRET_ACCESS_KEY: str | None = env.str(
+        "S3_SECRET_ACCESS_KEY", default=None
+    )
+    S3_MAX_POOL_CONNECTIONS: int = env.int(
+        "S3_MAX_POOL_CONNECTIONS", default=32
+    )
+    # Objects larger than one part are sent and fetched in parts,
+    # S3_PART_CONCURRENCY of them at a time. S3 needs at least 5MB.
+    S3_PART_SIZE: int = env.int("S3_PART_SIZE", default=8 * 1024 * 1024)
+    S3_PART_CONCURRENCY: int = env.int("S3_PART_CONCURRENCY", default=4)
+    S3_PRESIGN_EXPIRE_SECONDS: int = env.int(
+        "S3_PRESIGN_EXPIRE_SECONDS", default=300
+    )
+    IMAGE_CACHE_MODE: Literal["off", "memory", "redis"] = env.str(
+        "IMAGE_CACHE_MODE", default="memory"
+    )
+    IMAGE_CACHE_TTL: int = env.int("IMAGE_CACHE_TTL", default=300)
+    IMAGE_CACHE_NEGATIVE_TTL: int = env.int(
+        "IMAGE_CACHE_NEGATIVE_TTL", default=30
+    )
+    IMAGE_CACHE_MAX_SIZE: int = env.int(
+        "IMAGE_CACHE_MAX_SIZE", default=10000
+    )
+    EDIT_MAX_OPERATIONS: int = env.int("EDIT_MAX_OPERATIONS", default=32)
+    EDIT_BATCH_MAX_IMAGES: int = env.int("EDIT_BATCH_MAX_IMAGES", default=100)
+    EDIT_BATCH_WORKERS: int = env.int("EDIT_BATCH_WORKERS", default=4)
+    # Edits of sources up to this size are rendered in the API process
+    # while the request waits, 0 sends every edit to the queue.
+    INLINE_EDIT_MAX_BYTES: int = env.int(
+        "INLINE_EDIT_MAX_BYTES", default=1024 * 1024
+    )
+    INLINE_EDIT_PROCESSES: int = env.int("INLINE_EDIT_PROCESSES", default=2)
+    INLINE_EDIT_MAX_PENDING: int = env.int(
+        "INLINE_EDIT_MAX_PENDING", default=4
+    )
+    INLINE_EDIT_TIMEOUT: float = env.float(
+        "INLINE_EDIT_TIMEOUT", default=10.0
+    )
+    # Images with more pixels are not decoded, whatever their file size.
+    IMAGE_MAX_PIXELS: int = env.int("IMAGE_MAX_PIXELS", default=40_000_000)
+    # Pixels a worker process decodes at once across its concurrent
+    # jobs, renders wait for room. 0 turns the limit off.
+    WORKER_PIXEL_BUDGET: int = env.int(
+        "WORKER_PIXEL_BUDGET", default=100_000_000
+    )
+    PNG_COMPRESS_LEVEL: int = env.int("PNG_COMPRESS_LEVEL", default=3)
+    JPEG_QUALITY: int = env.int("JPEG_QUALITY", default=85)
+    WEBP_QUALITY: int = env.int("WEBP_QUALITY", default=80)
+    JPEG_TRANSPOSE_MODE: Literal["pixel", "lossless", "exif"] = env.str(
+        "JPEG_TRANSPOSE_MODE", default="lossless"
+    )
+    JPEGTRAN_PATH: str = env.str("JPEGTRAN_PATH", default="jpegtran")
+    JPEGTRAN_TIMEOUT: float = env.float("JPEGTRAN_TIMEOUT", default=30.0)
+    VARIANT_WIDTHS: list[int] = env.list(
+        "VARIANT_WIDTHS", default=[128, 256, 512, 1024], subcast=int
+    )
+    VARIANT_FORMATS: list[str] = env.list("VARIANT_FORMATS", default=["webp"])
+    EDIT_CACHE_MAX_BYTES: int = env.int(
+        "EDIT_CACHE_MAX_BYTES", default=1024 * 1024 * 1024
+    )
+    TASK_QUEUE: Literal["celery", "postgres"] = env.str(
+        "TASK_QUEUE", default="celery"
+    )
+    JOB_LOCK_SECONDS: int = env.int("JOB_LOCK_SECONDS", default=300)
+    JOB_MAX_ATTEMPTS: int = env.int("JOB_MAX_ATTEMPTS", default=3)
+    JOB_POLL_INTERVAL: float = env.float("JOB_POLL_INTERVAL", default=1.0)
+    JOB_WORKER_CONCURRENCY: int = env.int(
+        "JOB_WORKER_CONCURRENCY", default=16
+    )
+    # 0 sizes the render process pool to the number of CPUs.
+    JOB_WORKER_PROCESSES: int = env.int("JOB_WORKER_PROCESSES", default=0)
     CELERY_BROKER_URI: str = env.str("CELERY_BROKER_URI")
     CELERY_RESULT_BACKEND: str = env.str("CELERY_RESULT_BACKEND")
+    EVENTS_REDIS_URI: str = env.str(
+        "EVENTS_REDIS_URI", default=env.str("CELERY_BROKER_URI")
+    )
+    CACHE_REDIS_URI: str = env.str(
+        "CACHE_REDIS_URI", default=env.str("CELERY_BROKER_URI")
+    )
+    EVENTS_QUEUE_SIZE: int = env.int("EVENTS_QUEUE_SIZE", default=100)
+    EVENTS_HEARTBEAT_SECONDS: int = env.int(
+        "EVENTS_HEARTBEAT_SECONDS", default=15
+    )
+    # Each Celery child process serves its metrics on this port plus its
+    # index, the job worker on this port. 0 turns the servers off.
+    WORKER_METRICS_PORT: int = env.int("WORKER_METRICS_PORT", default=9100)
+    OTEL_EXPORTER_OTLP_ENDPOINT: str | None = env.str(
+        "OTEL_EXPORTER_OTLP_ENDPOINT", default=None
+    )
     SMTP_HOST: str = env.str("SMTP_HOST")
     SMTP_PORT: int = env.int("SMTP_PORT")
     SMTP_USER: str = env.str("SMTP_USER")
@@ -28,6 +150,12 @@ class Settings(BaseSettings):
     DB_USER: str = env.str("DB_USER")
     DB_PASSWORD: str = env.str("DB_PASSWORD")
     DB_NAME: str = env.str("DB_NAME")
+    DB_POOL_SIZE: int = env.int("DB_POOL_SIZE", default=5)
+    DB_MAX_OVERFLOW: int = env.int("DB_MAX_OVERFLOW", default=10)
+    DB_POOL_RECYCLE: int = env.int("DB_POOL_RECYCLE", default=1800)
+    WORKER_DB_WARM_CONNECTIONS: int = env.int(
+        "WORKER_DB_WARM_CONNECTIONS", default=1
+    )
     ASYNC_DB_URI: str = str(
         PostgresDsn.build(
             scheme="postgresql+asyncpg",
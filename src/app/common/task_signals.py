@@ -0,0 +1,42 @@
+"""Celery signal handlers that time queued tasks and carry traces.
+
+Publishing stamps each message with the time it was queued and the
+current trace context. The worker records the queue delay when the task
+starts and runs the task in a span continuing the publisher's trace.
+"""
+import time
+from contextlib import ExitStack
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+
+from app.common.metrics import task_queue_delay
+from app.common.tracing import inject, span
+
+_task_spans: dict[str, ExitStack] = {}
+
+
+@before_task_publish.connect
+def stamp_task(headers: dict | None = None, **kwargs) -> None:
+    if headers is None:
+        return
+    headers["enqueued_at"] = time.time()
+    headers.update(inject())
+
+
+@task_prerun.connect
+def start_task(task_id: str, task, **kwargs) -> None:
+    request = vars(task.request)
+    if (enqueued_at := request.get("enqueued_at")) is not None:
+        task_queue_delay.labels(task.name).observe(
+            max(time.time() - enqueued_at, 0)
+        )
+    carrier = {k: v for k, v in request.items() if isinstance(v, str)}
+    stack = ExitStack()
+    stack.enter_context(span(task.name, carrier=carrier))
+    _task_spans[task_id] = stack
+
+
+@task_postrun.connect
+def end_task(task_id: str, **kwargs) -> None:
+    if (stack := _task_spans.pop(task_id, None)) is not None:
+        stack.close()
@@ -0,0 +1,62 @@
+"""Optional OpenTelemetry tracing.
+
+Spans are exported over OTLP when OTEL_EXPORTER_OTLP_ENDPOINT is set and
+the ``tracing`` extra is installed. Otherwise every helper here is a
+no-op. Task messages carry
+the trace context, so a worker span continues the request that queued it.
+"""
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from app.common.settings import settings
+
+try:
+    from opentelemetry import propagate, trace
+except ImportError:
+    trace = None
+
+_tracer = None
+
+
+def setup_tracing(service_name: str) -> None:
+    global _tracer
+    if trace is None or not settings.OTEL_EXPORTER_OTLP_ENDPOINT:
+        return
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name})
+    )
+    # The exporter reads the endpoint from the environment itself.
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("img_fastapi")
+
+
+@contextmanager
+def span(
+    name: str, carrier: dict[str, str] | None = None, **attributes: Any
+) -> Iterator[Any]:
+    """Run a block in a span, continuing the trace found in ``carrier``."""
+    if _tracer is None:
+        yield None
+        return
+    context = propagate.extract(carrier) if carrier is not None else None
+    with _tracer.start_as_current_span(
+        name, context=context, attributes=attributes
+    ) as current:
+        yield current
+
+
+def inject() -> dict[str, str]:
+    """Headers with the current trace context, to send with a task."""
+    carrier: dict[str, str] = {}
+    if _tracer is not None:
+        propagate.inject(carrier)
+    return carrier
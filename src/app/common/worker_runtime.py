@@ -0,0 +1,55 @@
+"""Event loop and connection pool shared by the tasks of a worker process.
+
+Celery runs task functions synchronously, so every async task body goes
+through ``run``. Reusing one loop per process keeps the asyncpg
+connections in the engine pool usable from one task to the next.
+"""
+import asyncio
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+from celery.signals import worker_process_init, worker_process_shutdown
+from celery.utils.log import current_process_index
+from prometheus_client import start_http_server
+
+from app.common.settings import settings
+from app.common.tracing import setup_tracing
+from app.db import engine, warm_engine
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def run(coro: Coroutine[Any, Any, T]) -> T:
+    return get_loop().run_until_complete(coro)
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs) -> None:
+    # Connections inherited over fork belong to the parent process.
+    engine.sync_engine.dispose(close=False)
+    connections = min(
+        settings.WORKER_DB_WARM_CONNECTIONS, settings.DB_POOL_SIZE
+    )
+    run(warm_engine(connections))
+    setup_tracing("worker")
+    if settings.WORKER_METRICS_PORT:
+        index = current_process_index(base=0) or 0
+        start_http_server(settings.WORKER_METRICS_PORT + index)
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs) -> None:
+    if _loop is None or _loop.is_closed():
+        return
+    run(engine.dispose())
+    _loop.close()
@@ -1,9 +1,12 @@
+import inspect
+import time
 from asyncio import current_task
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Callable
 
-from sqlalchemy.ext.declarative import declarative_base 
+from sqlalchemy import event
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_scoped_session,
@@ -11,6 +14,7 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 
+from app.common.metrics import db_pool_wait, db_query_duration
 from app.common.settings import settings
 
 
@@ -24,9 +28,38 @@ class Base(DeclarativeBase):
             setattr(self, k, kwargs[k])
 
 
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Records how long checkouts wait for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - start)
+
+
+engine = create_async_engine(
+    settings.ASYNC_DB_URI,
+    poolclass=TimedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, many):
+    context.query_started_at = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _observe_query(conn, cursor, statement, parameters, context, many):
+    db_query_duration.labels(statement.split(None, 1)[0].upper()).observe(
+        time.perf_counter() - context.query_started_at
+    )
 
 
-engine = create_async_engine(settings.ASYNC_DB_URI)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
 
@@ -40,17 +73,59 @@ session: async_sessionmaker[AsyncSession] = async_sessionmaker(
 )
 
 
+async def warm_engine(connections: int) -> None:
+    """Open ``connections`` pooled connections ahead of the first query."""
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(await engine.connect())
+    finally:
+        for connection in opened:
+            await connection.close()
+
+
+@asynccontextmanager
+async def new_session() -> AsyncGenerator[AsyncSession, None]:
+    """A session with a transaction of its own, for work done outside
+    the request or task that triggered it."""
+    async with async_session_maker() as s:
+        yield s
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], Any]) -> None:
+    """Run ``callback`` once the session's current transaction commits.
+
+    Work queued this way, like sending a Celery task, is dropped when the
+    transaction is rolled back instead.
+    """
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+async def commit(session: AsyncSession) -> None:
+    """Commit the session, then run the callbacks from ``after_commit``."""
+    await session.commit()
+    for callback in session.info.pop("after_commit", []):
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
+
+
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    """One session per request, committed once after the handler returns.
+
+    Repositories only add to the transaction, so a request checks out a
+    single connection and its writes land together or not at all.
+    """
     async with async_session_maker() as session:
         yield session
+        await commit(session)
+
+
+scoped_factory = async_scoped_session(session, scopefunc=current_task)
 
 
 @asynccontextmanager
 async def scoped_session():
-    scoped_factory = async_scoped_session(
-        session,
-        scopefunc=current_task,
-    )
     try:
         async with scoped_factory() as s:
             yield s
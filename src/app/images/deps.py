@@ -1,10 +1,74 @@
+from app.common.cache import (
+    CacheStats,
+    ICache,
+    MemoryCache,
+    RedisCache,
+    TieredCache,
+)
+from app.common.metrics import CallbackCounter
+from app.common.settings import settings
+from app.images.s3 import (
+    ContentAddressedS3ImageFileRepository,
+    S3ImageFileRepository,
+)
 from app.images.repositories import (
+    CachedImageRepository,
+    IImageFileRepository,
     IImageRepository,
+    IImageUploadRepository,
     ImageRepository,
+    ImageUploadRepository,
     ImageFileRepository,
+    ContentAddressedImageFileRepository,
+)
+
+
+def get_image_meta_cache() -> ICache | None:
+    if settings.IMAGE_CACHE_MODE == "off":
+        return None
+    cache = MemoryCache(
+        settings.IMAGE_CACHE_TTL, settings.IMAGE_CACHE_MAX_SIZE
+    )
+    if settings.IMAGE_CACHE_MODE == "redis":
+        shared = RedisCache(
+            settings.CACHE_REDIS_URI, settings.IMAGE_CACHE_TTL, "image:"
+        )
+        cache = TieredCache(cache, shared)
+    return cache
+
+
+image_meta_cache = get_image_meta_cache()
+image_meta_cache_stats = CacheStats()
+CallbackCounter(
+    "image_meta_cache_hits",
+    "Image metadata lookups answered by the cache.",
+    lambda: image_meta_cache_stats.hits,
+)
+CallbackCounter(
+    "image_meta_cache_misses",
+    "Image metadata lookups that went to the database.",
+    lambda: image_meta_cache_stats.misses,
 )
 
 
+def get_image_file_repository() -> IImageFileRepository:
+    if settings.IMAGE_STORAGE_BACKEND == "s3":
+        if settings.IMAGE_STORAGE_MODE == "cas":
+            return ContentAddressedS3ImageFileRepository()
+        return S3ImageFileRepository()
+    if settings.IMAGE_STORAGE_MODE == "cas":
+        return ContentAddressedImageFileRepository()
+    return ImageFileRepository()
+
+
 async def get_image_repository() -> IImageRepository:
-    file_repository = ImageFileRepository()
-    return ImageRepository(file_repository)
+    repository = ImageRepository(get_image_file_repository())
+    if image_meta_cache is None:
+        return repository
+    return CachedImageRepository(
+        repository, image_meta_cache, image_meta_cache_stats
+    )
+
+
+async def get_upload_repository() -> IImageUploadRepository:
+    return ImageUploadRepository(get_image_file_repository())
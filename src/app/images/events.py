@@ -0,0 +1,133 @@
+"""Image status notifications over Redis pub/sub.
+
+Workers publish one message per finished image on a single channel.
+Every API process holds one subscription to it and fans the events out
+to the server-sent event streams of the image owners.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from uuid import UUID
+
+import redis.asyncio as redis
+from fastapi import Request
+
+from app.common.settings import settings
+from app.images.models import Image, ImageStatusEnum, ImageStatusEvent
+
+CHANNEL = "image-status"
+
+logger = logging.getLogger(__name__)
+
+_client: redis.Redis | None = None
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.from_url(settings.EVENTS_REDIS_URI)
+    return _client
+
+
+def dump_event(event: ImageStatusEvent) -> str:
+    return json.dumps(
+        {
+            "image_id": str(event.image_id),
+            "owner_id": str(event.owner_id),
+            "status": event.status,
+        }
+    )
+
+
+def load_event(data: str | bytes) -> ImageStatusEvent:
+    event = json.loads(data)
+    return ImageStatusEvent(
+        image_id=UUID(event["image_id"]),
+        owner_id=UUID(event["owner_id"]),
+        status=ImageStatusEnum(event["status"]),
+    )
+
+
+async def publish_status(images: list[Image]) -> None:
+    """Announce the current status of ``images`` in one round trip.
+
+    Errors are swallowed: the change is already committed and clients
+    can still read the status with a GET.
+    """
+    if not images:
+        return
+    try:
+        async with _get_client().pipeline(transaction=False) as pipe:
+            for image in images:
+                event = ImageStatusEvent(
+                    image.id_, image.owner_id, image.status
+                )
+                pipe.publish(CHANNEL, dump_event(event))
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+class StatusBroadcaster:
+    """Fans events from the shared subscription out to local streams.
+
+    A slow subscriber whose queue is full misses events instead of
+    holding up everyone else.
+    """
+
+    def __init__(self, max_queued: int) -> None:
+        self._max_queued = max_queued
+        self._subscribers: dict[UUID, set[asyncio.Queue]] = defaultdict(set)
+
+    def receive(self, data: str | bytes) -> None:
+        """Deliver a message from the channel, skipping malformed ones."""
+        try:
+            event = load_event(data)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Skipping malformed %s message: %r", CHANNEL, data)
+            return
+        self.deliver(event)
+
+    def deliver(self, event: ImageStatusEvent) -> None:
+        for queue in self._subscribers.get(event.owner_id, ()):
+            if not queue.full():
+                queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(
+        self, owner_id: UUID
+    ) -> AsyncIterator[asyncio.Queue[ImageStatusEvent]]:
+        queue = asyncio.Queue(self._max_queued)
+        self._subscribers[owner_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[owner_id].discard(queue)
+            if not self._subscribers[owner_id]:
+                del self._subscribers[owner_id]
+
+    async def run(self) -> None:
+        """Read the channel until cancelled, reconnecting on errors."""
+        while True:
+            pubsub = _get_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CHANNEL)
+                async for message in pubsub.listen():
+                    self.receive(message["data"])
+            except redis.RedisError:
+                logger.exception("Reading %s failed, reconnecting", CHANNEL)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+def get_broadcaster(request: Request) -> StatusBroadcaster | None:
+    return getattr(request.app.state, "broadcaster", None)
+
+
+def format_sse(event: ImageStatusEvent) -> str:
+    data = json.dumps({"id": str(event.image_id), "status": event.status})
+    return f"event: status\ndata: {data}\n\n"
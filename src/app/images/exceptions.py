@@ -34,6 +34,13 @@ class ImageIsStillProcessingException(BaseException):
         return 'Image is still processing'
 
 
+@dataclass(eq=False)
+class ImageProcessingFailedException(BaseException):
+    @property
+    def message(self):
+        return 'Image could not be processed'
+
+
 @dataclass(eq=False)
 class InvalidFileException(BaseException):
     @property
@@ -46,3 +53,60 @@ class ImageTooBigException(BaseException):
     @property
     def message(self):
         return f'Image can not be larger than {settings.MAX_FILE_SIZE_MB}MB'
+
+
+@dataclass(eq=False)
+class ImageTooManyPixelsException(BaseException):
+    # Unknown when Pillow's own decompression bomb check refused it.
+    pixels: int | None = None
+
+    @property
+    def message(self):
+        message = (
+            f'Image can not have more than {settings.IMAGE_MAX_PIXELS} pixels'
+        )
+        if self.pixels is not None:
+            message += f', it has {self.pixels}'
+        return message
+
+
+@dataclass(eq=False)
+class InvalidCursorException(BaseException):
+    @property
+    def message(self):
+        return 'Invalid page cursor'
+
+
+@dataclass(eq=False)
+class TooManyFilesException(BaseException):
+    @property
+    def message(self):
+        return (
+            f'Can not upload more than {settings.UPLOAD_BATCH_MAX_FILES} '
+            'files at once'
+        )
+
+
+@dataclass(eq=False)
+class UploadNotFoundException(BaseException):
+    upload_id: UUID
+
+    @property
+    def message(self):
+        return f'Upload was not found: {self.upload_id}'
+
+
+@dataclass(eq=False)
+class UploadOffsetMismatchException(BaseException):
+    offset: int
+
+    @property
+    def message(self):
+        return f'Upload offset does not match, expected {self.offset}'
+
+
+@dataclass(eq=False)
+class UploadLengthExceededException(BaseException):
+    @property
+    def message(self):
+        return 'Upload data is longer than the declared length'
@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from fastapi import Request
+
+from app.common.settings import settings
+from app.images.models import EditOperation, EncodeOptions
+from app.images.tasks import _render_edit_timed, record_stages
+
+
+class InlineEditPool:
+    """Renders small edits off the event loop while the request waits.
+
+    At most ``max_pending`` renders are in flight. ``render`` returns None
+    instead of waiting when the pool is full, so the caller can hand the
+    edit to the queue. A render that breaks the pool or runs past
+    ``timeout`` raises and has the executor replaced by ``new_executor``,
+    so later renders do not fail the same way.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        max_pending: int,
+        timeout: float | None = None,
+        new_executor: Callable[[], Executor] | None = None,
+    ) -> None:
+        self._executor = executor
+        self._free_slots = max_pending
+        self._timeout = timeout
+        self._new_executor = new_executor
+
+    @classmethod
+    def from_settings(cls) -> "InlineEditPool":
+        def new_executor() -> Executor:
+            # Forking a process that runs an event loop and threads is
+            # unsafe.
+            return ProcessPoolExecutor(
+                settings.INLINE_EDIT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return cls(
+            new_executor(),
+            settings.INLINE_EDIT_MAX_PENDING,
+            settings.INLINE_EDIT_TIMEOUT,
+            new_executor,
+        )
+
+    def _replace_executor(self, executor: Executor) -> None:
+        # Renders that failed together replace the executor only once.
+        if self._new_executor is None or self._executor is not executor:
+            return
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+    async def render(
+        self,
+        source: bytes | Path,
+        operations: list[EditOperation],
+        encoding: EncodeOptions,
+    ) -> bytes | None:
+        if self._free_slots <= 0:
+            return None
+        self._free_slots -= 1
+        executor = self._executor
+        try:
+            edited, timings = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(
+                    executor, _render_edit_timed, source, operations, encoding
+                ),
+                self._timeout,
+            )
+        except (BrokenProcessPool, TimeoutError):
+            self._replace_executor(executor)
+            raise
+        finally:
+            self._free_slots += 1
+        record_stages(timings)
+        return edited
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_edit_pool(request: Request) -> InlineEditPool | None:
+    """The pool started by the app lifespan, if inline edits are on."""
+    return getattr(request.app.state, "edit_pool", None)
@@ -0,0 +1,159 @@
+import shutil
+import subprocess
+
+import PIL.Image
+
+from app.common.settings import settings
+from app.images.pipeline import compose_transposes
+
+Transpose = PIL.Image.Transpose
+
+_SOI = b"\xff\xd8"
+_APP0, _APP1, _SOS = 0xE0, 0xE1, 0xDA
+_EXIF_HEADER = b"Exif\x00\x00"
+_ORIENTATION_TAG = 0x0112
+_SHORT = 3
+
+# EXIF orientation value -> transpose a viewer applies to display the image.
+_ORIENTATION_TRANSPOSES = {
+    1: None,
+    2: Transpose.FLIP_LEFT_RIGHT,
+    3: Transpose.ROTATE_180,
+    4: Transpose.FLIP_TOP_BOTTOM,
+    5: Transpose.TRANSPOSE,
+    6: Transpose.ROTATE_270,
+    7: Transpose.TRANSVERSE,
+    8: Transpose.ROTATE_90,
+}
+_TRANSPOSE_ORIENTATIONS = {v: k for k, v in _ORIENTATION_TRANSPOSES.items()}
+
+# jpegtran rotates clockwise, PIL counter-clockwise.
+_JPEGTRAN_ARGS = {
+    Transpose.ROTATE_90: ["-rotate", "270"],
+    Transpose.ROTATE_180: ["-rotate", "180"],
+    Transpose.ROTATE_270: ["-rotate", "90"],
+    Transpose.FLIP_LEFT_RIGHT: ["-flip", "horizontal"],
+    Transpose.FLIP_TOP_BOTTOM: ["-flip", "vertical"],
+    Transpose.TRANSPOSE: ["-transpose"],
+    Transpose.TRANSVERSE: ["-transverse"],
+}
+
+
+def is_jpeg(data: bytes) -> bool:
+    return data[:3] == b"\xff\xd8\xff"
+
+
+def _iter_segments(data: bytes):
+    """Yield (marker, start, end) of each header segment before the scan."""
+    pos = len(_SOI)
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == _SOS:
+            return
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        yield marker, pos, end
+        pos = end
+
+
+def _find_orientation(data: bytes) -> tuple[int | None, str | None]:
+    """Locate the orientation value in the EXIF block.
+
+    Returns (offset, byteorder). The byteorder is None when the file has
+    no EXIF block and the offset is None when IFD0 has no orientation.
+    """
+    for marker, start, end in _iter_segments(data):
+        if marker != _APP1 or data[start + 4:start + 10] != _EXIF_HEADER:
+            continue
+        tiff = start + 10
+        byteorder = "little" if data[tiff:tiff + 2] == b"II" else "big"
+
+        def read(offset: int, size: int) -> int:
+            return int.from_bytes(
+                data[tiff + offset:tiff + offset + size], byteorder
+            )
+
+        ifd = read(4, 4)
+        for i in range(read(ifd, 2)):
+            entry = ifd + 2 + 12 * i
+            if tiff + entry + 12 > end:
+                break
+            tag, type_ = read(entry, 2), read(entry + 2, 2)
+            if tag == _ORIENTATION_TAG and type_ == _SHORT:
+                return tiff + entry + 8, byteorder
+        return None, byteorder
+    return None, None
+
+
+def get_orientation(data: bytes) -> int:
+    offset, byteorder = _find_orientation(data)
+    if offset is None:
+        return 1
+    return int.from_bytes(data[offset:offset + 2], byteorder)
+
+
+def _build_exif_segment(orientation: int) -> bytes:
+    payload = (
+        _EXIF_HEADER
+        + b"MM\x00\x2a"
+        + (8).to_bytes(4, "big")
+        + (1).to_bytes(2, "big")
+        + _ORIENTATION_TAG.to_bytes(2, "big")
+        + _SHORT.to_bytes(2, "big")
+        + (1).to_bytes(4, "big")
+        + orientation.to_bytes(2, "big")
+        + b"\x00\x00"
+        + (0).to_bytes(4, "big")
+    )
+    return b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def rotate_by_orientation(data: bytes, method: Transpose) -> bytes | None:
+    """Apply the transpose by rewriting the EXIF orientation only.
+
+    Pixel data is left untouched. Returns None when the file has an EXIF
+    block without an orientation entry, which would need a full rewrite.
+    """
+    offset, byteorder = _find_orientation(data)
+    if offset is None and byteorder is not None:
+        return None
+    current = 1
+    if offset is not None:
+        current = int.from_bytes(data[offset:offset + 2], byteorder)
+    if current not in _ORIENTATION_TRANSPOSES:
+        return None
+    orientation = _TRANSPOSE_ORIENTATIONS[
+        compose_transposes(_ORIENTATION_TRANSPOSES[current], method)
+    ]
+    if offset is not None:
+        value = orientation.to_bytes(2, byteorder)
+        return data[:offset] + value + data[offset + 2:]
+    insert_at = len(_SOI)
+    for marker, _, end in _iter_segments(data):
+        if marker == _APP0:
+            insert_at = end
+        break
+    segment = _build_exif_segment(orientation)
+    return data[:insert_at] + segment + data[insert_at:]
+
+
+def transpose_lossless(data: bytes, method: Transpose) -> bytes | None:
+    """Transpose DCT blocks with jpegtran, None if it is not possible.
+
+    ``-perfect`` makes jpegtran refuse images whose size is not a whole
+    number of MCUs instead of trimming the edge blocks.
+    """
+    jpegtran = shutil.which(settings.JPEGTRAN_PATH)
+    if jpegtran is None or get_orientation(data) != 1:
+        return None
+    try:
+        result = subprocess.run(
+            [jpegtran, "-perfect", "-copy", "all", *_JPEGTRAN_ARGS[method]],
+            input=data,
+            capture_output=True,
+            timeout=settings.JPEGTRAN_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
@@ -8,11 +8,50 @@ from uuid import UUID, uuid4
 class ImageStatusEnum(StrEnum):
     PROCESSING = auto()
     DONE = auto()
+    FAILED = auto()
 
 
 class ImageEditActionEnum(StrEnum):
     INVERT = auto()
     ROTATE90 = auto()
+    ROTATE = auto()
+    FLIP_HORIZONTAL = auto()
+    FLIP_VERTICAL = auto()
+    TRANSPOSE = auto()
+    TRANSVERSE = auto()
+    GRAYSCALE = auto()
+    CROP = auto()
+    RESIZE = auto()
+
+
+class ImageFormatEnum(StrEnum):
+    PNG = auto()
+    JPEG = auto()
+    WEBP = auto()
+
+    @property
+    def content_type(self) -> str:
+        return f"image/{self}"
+
+    @classmethod
+    def from_content_type(
+        cls, content_type: str | None
+    ) -> "ImageFormatEnum | None":
+        subtype = (content_type or "").partition("/")[2].lower()
+        if subtype == "jpg":
+            return cls.JPEG
+        return cls._value2member_map_.get(subtype)
+
+    @classmethod
+    def from_magic_bytes(cls, head: bytes) -> "ImageFormatEnum | None":
+        """Detect the format from the first 12 bytes of a file."""
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return cls.PNG
+        if head.startswith(b"\xff\xd8\xff"):
+            return cls.JPEG
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return cls.WEBP
+        return None
 
 
 class IImageFile(Protocol):
@@ -21,6 +60,8 @@ class IImageFile(Protocol):
 
     async def read(self, size: int = -1) -> bytes: ...
 
+    async def seek(self, offset: int) -> None: ...
+
 
 @dataclass
 class Image:
@@ -30,3 +71,82 @@ class Image:
     id_: UUID = field(default_factory=uuid4)
     created_at: datetime = field(default_factory=lambda: datetime.now(UTC))
     content_type: str = "image/png"
+    digest: str | None = None
+    size: int | None = None
+    # Read from the file header, as shown after the EXIF orientation.
+    width: int | None = None
+    height: int | None = None
+    exif: dict[str, str | int | float] | None = None
+
+
+@dataclass
+class ImageUpload:
+    """An upload sent in several parts, possibly over several requests."""
+
+    owner_id: UUID
+    title: str
+    length: int
+    offset: int = 0
+    id_: UUID = field(default_factory=uuid4)
+    updated_at: datetime = field(default_factory=lambda: datetime.now(UTC))
+    image_id: UUID | None = None
+
+
+@dataclass
+class EditResult:
+    source_digest: str
+    key: str
+    digest: str
+    size: int
+    width: int | None = None
+    height: int | None = None
+
+
+@dataclass
+class EditOperation:
+    action: ImageEditActionEnum
+    angle: int = 90
+    box: tuple[int, int, int, int] | None = None
+    width: int | None = None
+    height: int | None = None
+
+
+@dataclass
+class EncodeOptions:
+    format: ImageFormatEnum | None = None
+    quality: int | None = None
+    compress_level: int | None = None
+
+
+@dataclass
+class ImageCursor:
+    created_at: datetime
+    id_: UUID
+
+
+@dataclass
+class ImageFilter:
+    status: ImageStatusEnum | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+    format: ImageFormatEnum | None = None
+    min_width: int | None = None
+    max_width: int | None = None
+    min_height: int | None = None
+    max_height: int | None = None
+    min_size: int | None = None
+    max_size: int | None = None
+
+
+@dataclass
+class ImageBatchResult:
+    index: int
+    image_id: UUID | None = None
+    error: str | None = None
+
+
+@dataclass
+class ImageStatusEvent:
+    image_id: UUID
+    owner_id: UUID
+    status: ImageStatusEnum
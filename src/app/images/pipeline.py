@@ -0,0 +1,371 @@
+import io
+import json
+import math
+import numbers
+from dataclasses import asdict, replace
+from pathlib import Path
+
+import PIL.ExifTags
+import PIL.Image
+
+from app.common.settings import settings
+from app.images.exceptions import ImageTooManyPixelsException
+from app.images.models import (
+    EditOperation,
+    EncodeOptions,
+    Image,
+    ImageEditActionEnum,
+    ImageFormatEnum,
+)
+
+Transpose = PIL.Image.Transpose
+
+# EXIF orientations that swap the stored width and height on display.
+SWAPPED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Enough for the header of nearly any file, EXIF and ICC profile included.
+HEADER_MAX_BYTES = 256 * 1024
+
+# EXIF tags returned with an image's metadata.
+_EXIF_TAGS = {
+    tag: name
+    for tag, name in PIL.ExifTags.TAGS.items()
+    if name in (
+        "Make",
+        "Model",
+        "Software",
+        "Orientation",
+        "DateTime",
+        "DateTimeOriginal",
+        "ExposureTime",
+        "FNumber",
+        "ISOSpeedRatings",
+        "FocalLength",
+        "LensModel",
+    )
+}
+
+# Rotations and flips form the dihedral group of the square. Each element
+# is stored as (k, f): mirror left-right when f is set, then rotate k
+# quarter turns counter-clockwise.
+_TRANSPOSE_ELEMENTS: dict[Transpose, tuple[int, bool]] = {
+    Transpose.ROTATE_90: (1, False),
+    Transpose.ROTATE_180: (2, False),
+    Transpose.ROTATE_270: (3, False),
+    Transpose.FLIP_LEFT_RIGHT: (0, True),
+    Transpose.TRANSPOSE: (1, True),
+    Transpose.FLIP_TOP_BOTTOM: (2, True),
+    Transpose.TRANSVERSE: (3, True),
+}
+_ELEMENT_TRANSPOSES = {v: k for k, v in _TRANSPOSE_ELEMENTS.items()}
+
+_ACTION_TRANSPOSES = {
+    ImageEditActionEnum.FLIP_HORIZONTAL: Transpose.FLIP_LEFT_RIGHT,
+    ImageEditActionEnum.FLIP_VERTICAL: Transpose.FLIP_TOP_BOTTOM,
+    ImageEditActionEnum.TRANSPOSE: Transpose.TRANSPOSE,
+    ImageEditActionEnum.TRANSVERSE: Transpose.TRANSVERSE,
+}
+_TRANSPOSE_OPERATIONS = {
+    Transpose.ROTATE_90: EditOperation(ImageEditActionEnum.ROTATE, angle=90),
+    Transpose.ROTATE_180: EditOperation(ImageEditActionEnum.ROTATE, angle=180),
+    Transpose.ROTATE_270: EditOperation(ImageEditActionEnum.ROTATE, angle=270),
+    **{
+        method: EditOperation(action)
+        for action, method in _ACTION_TRANSPOSES.items()
+    },
+}
+
+
+def get_transpose(operation: EditOperation) -> Transpose | None:
+    """Return the PIL transpose for a rotation or flip, None otherwise."""
+    if operation.action == ImageEditActionEnum.ROTATE90:
+        return Transpose.ROTATE_90
+    if operation.action == ImageEditActionEnum.ROTATE:
+        return {
+            1: Transpose.ROTATE_90,
+            2: Transpose.ROTATE_180,
+            3: Transpose.ROTATE_270,
+        }.get(operation.angle // 90 % 4)
+    return _ACTION_TRANSPOSES.get(operation.action)
+
+
+def compose_transposes(
+    first: Transpose | None, second: Transpose | None
+) -> Transpose | None:
+    """Return the single transpose equal to applying first, then second."""
+    k1, f1 = _TRANSPOSE_ELEMENTS.get(first, (0, False))
+    k2, f2 = _TRANSPOSE_ELEMENTS.get(second, (0, False))
+    if f2:
+        element = ((k2 - k1) % 4, not f1)
+    else:
+        element = ((k1 + k2) % 4, f1)
+    return _ELEMENT_TRANSPOSES.get(element)
+
+
+def _is_transpose(operation: EditOperation) -> bool:
+    return (
+        operation.action == ImageEditActionEnum.ROTATE90
+        or operation.action == ImageEditActionEnum.ROTATE
+        or operation.action in _ACTION_TRANSPOSES
+    )
+
+
+def _merge(
+    first: EditOperation, second: EditOperation
+) -> list[EditOperation] | None:
+    """Fold two adjacent operations, None if they do not combine."""
+    if _is_transpose(first) and _is_transpose(second):
+        method = compose_transposes(
+            get_transpose(first), get_transpose(second)
+        )
+        return [] if method is None else [_TRANSPOSE_OPERATIONS[method]]
+    if first.action != second.action:
+        return None
+    if first.action == ImageEditActionEnum.INVERT:
+        return []
+    if first.action == ImageEditActionEnum.GRAYSCALE:
+        return [first]
+    if first.action == ImageEditActionEnum.CROP:
+        left, top, right, bottom = first.box
+        left2, top2, right2, bottom2 = second.box
+        if right2 > right - left or bottom2 > bottom - top:
+            # PIL pads crops that overflow the image, which a single
+            # crop of the original would not reproduce.
+            return None
+        box = (left + left2, top + top2, left + right2, top + bottom2)
+        return [replace(first, box=box)]
+    return None
+
+
+def normalize_operations(
+    operations: list[EditOperation],
+) -> list[EditOperation]:
+    """Fold operations that cancel out or combine into a single step.
+
+    Any run of rotations and flips becomes at most one transpose, pairs of
+    inversions disappear and nested crops collapse into one crop.
+    """
+    result: list[EditOperation] = []
+    for operation in operations:
+        if _is_transpose(operation):
+            method = get_transpose(operation)
+            if method is None:
+                continue
+            operation = _TRANSPOSE_OPERATIONS[method]
+        merged = _merge(result[-1], operation) if result else None
+        if merged is None:
+            result.append(operation)
+        else:
+            result[-1:] = merged
+    return result
+
+
+def get_resize_size(
+    size: tuple[int, int], width: int | None, height: int | None
+) -> tuple[int, int]:
+    if width is None:
+        width = max(round(size[0] * height / size[1]), 1)
+    elif height is None:
+        height = max(round(size[1] * width / size[0]), 1)
+    return width, height
+
+
+def get_sizes(
+    size: tuple[int, int], operations: list[EditOperation]
+) -> list[tuple[int, int]]:
+    """The size of the image before and after each operation, starting
+    from ``size``, the source as displayed."""
+    sizes = [size]
+    for operation in operations:
+        width, height = sizes[-1]
+        if (method := get_transpose(operation)) is not None:
+            if _TRANSPOSE_ELEMENTS[method][0] % 2:
+                width, height = height, width
+        elif operation.action == ImageEditActionEnum.CROP:
+            left, top, right, bottom = operation.box
+            width, height = right - left, bottom - top
+        elif operation.action == ImageEditActionEnum.RESIZE:
+            width, height = get_resize_size(
+                (width, height), operation.width, operation.height
+            )
+        sizes.append((width, height))
+    return sizes
+
+
+def check_pipeline_pixels(
+    size: tuple[int, int], operations: list[EditOperation]
+) -> int:
+    """The most pixels the pipeline holds at once, raising
+    ImageTooManyPixelsException when any step has more than
+    IMAGE_MAX_PIXELS."""
+    pixels = max(
+        width * height for width, height in get_sizes(size, operations)
+    )
+    if pixels > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooManyPixelsException(pixels)
+    return pixels
+
+
+def dump_operations(operations: list[EditOperation]) -> list[dict]:
+    return [asdict(operation) for operation in operations]
+
+
+def load_operations(data: list[dict]) -> list[EditOperation]:
+    operations = []
+    for item in data:
+        operation = EditOperation(**item)
+        operation.action = ImageEditActionEnum(operation.action)
+        if operation.box is not None:
+            operation.box = tuple(operation.box)
+        operations.append(operation)
+    return operations
+
+
+def load_encoding(data: dict | None) -> EncodeOptions:
+    if data is None:
+        # Messages queued before output options were always PNG.
+        return EncodeOptions(format=ImageFormatEnum.PNG)
+    options = EncodeOptions(**data)
+    options.format = ImageFormatEnum(options.format)
+    return options
+
+
+def get_edit_key(
+    operations: list[EditOperation], encoding: EncodeOptions
+) -> str:
+    """Cache key of an already normalized pipeline and its encoding."""
+    return json.dumps(
+        {"operations": dump_operations(operations), **asdict(encoding)},
+        separators=(",", ":"),
+    )
+
+
+def _check_pixels(width: int, height: int) -> None:
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooManyPixelsException(width * height)
+
+
+def open_image(source: bytes | Path) -> PIL.Image.Image:
+    """Open ``source`` without decoding it and check its pixel count.
+
+    Pillow reads a path as it decodes, instead of the caller holding a
+    copy of the whole file in memory.
+    """
+    try:
+        image = PIL.Image.open(
+            io.BytesIO(source) if isinstance(source, bytes) else source
+        )
+    except PIL.Image.DecompressionBombError:
+        raise ImageTooManyPixelsException()
+    try:
+        _check_pixels(image.width, image.height)
+    except ImageTooManyPixelsException:
+        image.close()
+        raise
+    return image
+
+
+def get_pixel_count(source: bytes | Path) -> int:
+    with open_image(source) as image:
+        return image.width * image.height
+
+
+def _read_exif(image: PIL.Image.Image) -> dict[str, str | int | float]:
+    # Only EXIF found in the header: asking Pillow for a PNG's EXIF may
+    # decode the whole image to look for it after the pixel data.
+    if not (data := image.info.get("exif")):
+        return {}
+    exif = PIL.Image.Exif()
+    exif.load(data)
+    tags = {**exif, **exif.get_ifd(PIL.ExifTags.IFD.Exif)}
+    values = {}
+    for tag, value in tags.items():
+        if (name := _EXIF_TAGS.get(tag)) is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip("\x00 ")
+        elif isinstance(value, numbers.Rational) and not isinstance(
+            value, int
+        ):
+            value = float(value)
+        elif not isinstance(value, int):
+            continue
+        if isinstance(value, float) and not math.isfinite(value):
+            continue
+        values[name] = value
+    return values
+
+
+def _read_webp_size(head: bytes) -> tuple[int, int] | None:
+    """The canvas size from the first chunk of a WebP file."""
+    if ImageFormatEnum.from_magic_bytes(head) != ImageFormatEnum.WEBP:
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8X" and len(head) >= 30:
+        return (
+            int.from_bytes(head[24:27], "little") + 1,
+            int.from_bytes(head[27:30], "little") + 1,
+        )
+    if chunk == b"VP8 " and len(head) >= 30:
+        return (
+            int.from_bytes(head[26:28], "little") & 0x3FFF,
+            int.from_bytes(head[28:30], "little") & 0x3FFF,
+        )
+    if chunk == b"VP8L" and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, (bits >> 14 & 0x3FFF) + 1
+    return None
+
+
+def read_metadata(image: Image, head: bytes) -> bool:
+    """Set the dimensions and EXIF of ``image`` from ``head``, the start
+    of its file, without decoding any pixels.
+
+    Returns False when ``head`` ends before the header does or is not an
+    image Pillow can read. Images with more than IMAGE_MAX_PIXELS pixels
+    raise ImageTooManyPixelsException.
+    """
+    try:
+        opened = open_image(head)
+    except (OSError, SyntaxError, ValueError):
+        # Pillow needs a whole WebP file to open it.
+        if (size := _read_webp_size(head)) is None:
+            return False
+        _check_pixels(*size)
+        image.width, image.height = size
+        return True
+    with opened:
+        try:
+            exif = _read_exif(opened)
+        except (OSError, SyntaxError, ValueError):
+            exif = {}
+        width, height = opened.size
+    if exif.get("Orientation") in SWAPPED_ORIENTATIONS:
+        width, height = height, width
+    image.width, image.height = width, height
+    image.exif = exif or None
+    return True
+
+
+def encode_image(image: PIL.Image.Image, encoding: EncodeOptions) -> bytes:
+    imgByteArr = io.BytesIO()
+    if encoding.format == ImageFormatEnum.JPEG:
+        if image.mode not in ("L", "RGB", "CMYK"):
+            image = image.convert("RGB")
+        image.save(
+            imgByteArr,
+            format="JPEG",
+            quality=encoding.quality or settings.JPEG_QUALITY,
+        )
+    elif encoding.format == ImageFormatEnum.WEBP:
+        image.save(
+            imgByteArr,
+            format="WEBP",
+            quality=encoding.quality or settings.WEBP_QUALITY,
+        )
+    else:
+        compress_level = encoding.compress_level
+        if compress_level is None:
+            compress_level = settings.PNG_COMPRESS_LEVEL
+        image.save(imgByteArr, format="PNG", compress_level=compress_level)
+    return imgByteArr.getvalue()
@@ -0,0 +1,76 @@
+"""Pixel operations done with lookup tables.
+
+Pillow runs a table over every band of an image in one pass in C, so an
+operation costs one new image instead of a split, a merge and a copy
+per band. Alpha bands get the identity table and are left as they are,
+palette images get a new palette and keep their pixels.
+"""
+import PIL.Image
+
+# Modes with more than 8 bits per value. Pillow only applies linear
+# transforms to them, and 16 bit values wrap around instead of clamping.
+_WIDE_MODES = ("I;16", "I")
+_WIDE_MAX = 65535
+
+
+def _curve(scale: float, offset: float, maximum: int) -> list[int]:
+    return [
+        min(max(round(value * scale + offset * maximum), 0), maximum)
+        for value in range(maximum + 1)
+    ]
+
+
+def linear(
+    image: PIL.Image.Image, scale: float, offset: float
+) -> PIL.Image.Image:
+    """Map every color value ``v`` to ``v * scale + offset``, clamped.
+
+    ``offset`` is a fraction of the largest value of the mode, so the
+    same arguments brighten or invert 8 and 16 bit images alike.
+    """
+    if image.mode in ("P", "PA"):
+        return _linear_palette(image, scale, offset)
+    if image.mode in _WIDE_MODES:
+        return _linear_wide(image, scale, offset)
+    curve = _curve(scale, offset, 255)
+    identity = list(range(256))
+    table = []
+    for band in image.getbands():
+        table += identity if band == "A" else curve
+    return image.point(table)
+
+
+def _linear_wide(
+    image: PIL.Image.Image, scale: float, offset: float
+) -> PIL.Image.Image:
+    low = offset * _WIDE_MAX
+    high = scale * _WIDE_MAX + low
+    in_range = 0 <= min(low, high) and max(low, high) <= _WIDE_MAX
+    if image.mode == "I" or in_range:
+        return image.point(lambda value: value * scale + low)
+    # Converting back from 32 bit values clamps them.
+    return (
+        image.convert("I")
+        .point(lambda value: value * scale + low)
+        .convert(image.mode)
+    )
+
+
+def _linear_palette(
+    image: PIL.Image.Image, scale: float, offset: float
+) -> PIL.Image.Image:
+    edited = image.copy()
+    if image.palette is None:
+        return edited
+    mode = image.palette.mode
+    curve = _curve(scale, offset, 255)
+    palette = [
+        value if mode[i % len(mode)] == "A" else curve[value]
+        for i, value in enumerate(image.getpalette(mode))
+    ]
+    edited.putpalette(palette, mode)
+    return edited
+
+
+def invert(image: PIL.Image.Image) -> PIL.Image.Image:
+    return linear(image, -1, 1)
@@ -1,17 +1,48 @@
-from typing import Protocol
+from collections import Counter
+from typing import AsyncIterator, Protocol
 from pathlib import Path
 from dataclasses import dataclass, asdict
+from functools import partial
+import asyncio
 import datetime
-from uuid import UUID
+import hashlib
+import os
+import time
+from uuid import UUID, uuid4
+from contextlib import asynccontextmanager
 
 import aiofiles
-from sqlalchemy import ForeignKey, select, update, DateTime
+import aiofiles.os
+from sqlalchemy import (
+    BigInteger,
+    ForeignKey,
+    Index,
+    JSON,
+    String,
+    select,
+    update,
+    delete,
+    func,
+    tuple_,
+    DateTime,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.images.models import Image, ImageStatusEnum, IImageFile
+from app.images.models import (
+    EditResult,
+    Image,
+    ImageCursor,
+    ImageFilter,
+    ImageStatusEnum,
+    ImageUpload,
+    IImageFile,
+)
+from app.common.cache import CacheStats, ICache
+from app.common.metrics import file_io_bytes, file_io_duration
 from app.common.settings import settings
-from app.db import Base
+from app.db import Base, after_commit, new_session
 
 
 class IImageFileRepository(Protocol):
@@ -19,8 +50,48 @@ class IImageFileRepository(Protocol):
 
     async def save_bytes(self, image: Image, image_bytes: bytes) -> None: ...
 
+    async def save_stream(
+        self, image: Image, chunks: AsyncIterator[bytes]
+    ) -> None: ...
+
     async def get(self, image: Image) -> bytes: ...
 
+    async def get_size(self, image: Image) -> int: ...
+
+    def get_path(self, image: Image) -> Path: ...
+
+    def get_local_path(self, image: Image) -> Path | None: ...
+
+    async def get_download_url(
+        self, path: Path, media_type: str
+    ) -> str | None: ...
+
+    def get_variant_path(self, image: Image, name: str) -> Path: ...
+
+    async def has_variant(self, image: Image, name: str) -> bool: ...
+
+    async def save_variant(
+        self, image: Image, name: str, image_bytes: bytes
+    ) -> None: ...
+
+    async def has_blob(self, digest: str) -> bool: ...
+
+    async def delete_blob(self, digest: str) -> None: ...
+
+    def get_upload_path(self, upload_id: UUID) -> Path: ...
+
+    async def create_upload(self, upload: ImageUpload) -> None: ...
+
+    async def write_upload(
+        self, upload_id: UUID, offset: int, chunks: AsyncIterator[bytes]
+    ) -> int: ...
+
+    async def read_upload(self, upload_id: UUID, size: int) -> bytes: ...
+
+    async def finalize_upload(self, upload_id: UUID, image: Image) -> None: ...
+
+    async def delete_upload(self, upload_id: UUID) -> None: ...
+
 
 class IImageRepository(Protocol):
     file_repository: IImageFileRepository
@@ -29,21 +100,89 @@ class IImageRepository(Protocol):
         self, session: AsyncSession, image: Image
     ) -> None: ...
 
+    async def create_meta_many(
+        self, session: AsyncSession, images: list[Image]
+    ) -> None: ...
+
     async def get_meta_list(
-        self, session: AsyncSession, owner_id: UUID
+        self,
+        session: AsyncSession,
+        owner_id: UUID,
+        limit: int | None = None,
+        after: ImageCursor | None = None,
+        filters: ImageFilter | None = None,
     ) -> list[Image]: ...
 
     async def get_meta(
         self, session: AsyncSession, id_: UUID
     ) -> Image | None: ...
 
+    async def get_meta_many(
+        self, session: AsyncSession, ids: list[UUID]
+    ) -> list[Image]: ...
+
     async def update_status(
-        self, session: AsyncSession, id_: UUID, status: ImageStatusEnum
+        self,
+        session: AsyncSession,
+        id_: UUID,
+        status: ImageStatusEnum,
+        digest: str | None = None,
+        size: int | None = None,
+    ) -> None: ...
+
+    async def update_status_many(
+        self,
+        session: AsyncSession,
+        images: list[Image],
+        status: ImageStatusEnum,
+    ) -> None: ...
+
+    async def get_edit_result(
+        self, session: AsyncSession, source_digest: str, key: str
+    ) -> EditResult | None: ...
+
+    async def put_edit_result(
+        self, session: AsyncSession, result: EditResult, max_bytes: int
     ) -> None: ...
 
 
+class IImageUploadRepository(Protocol):
+    file_repository: IImageFileRepository
+
+    async def create(
+        self, session: AsyncSession, upload: ImageUpload
+    ) -> None: ...
+
+    async def get(
+        self, session: AsyncSession, id_: UUID
+    ) -> ImageUpload | None: ...
+
+    async def advance(
+        self, session: AsyncSession, id_: UUID, offset: int, written: int
+    ) -> bool: ...
+
+    async def delete(self, session: AsyncSession, id_: UUID) -> None: ...
+
+    async def delete_stale(
+        self, session: AsyncSession, before: datetime.datetime
+    ) -> list[UUID]: ...
+
+
+class BlobTable(Base):
+    __tablename__ = "image_blob"
+
+    digest: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int]
+    ref_count: Mapped[int] = mapped_column(default=0)
+
+
 class ImageTable(Base):
     __tablename__ = "image"
+    __table_args__ = (
+        Index("ix_image_owner_id_created_at", "owner_id", "created_at", "id_"),
+        Index("ix_image_owner_id_width_height", "owner_id", "width", "height"),
+        Index("ix_image_owner_id_size", "owner_id", "size"),
+    )
 
     id_: Mapped[UUID] = mapped_column(primary_key=True)
     owner_id: Mapped[UUID] = mapped_column(
@@ -54,27 +193,389 @@ class ImageTable(Base):
     created_at: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True)
     )
+    content_type: Mapped[str] = mapped_column(default="image/png")
+    digest: Mapped[str | None] = mapped_column(
+        ForeignKey("image_blob.digest"), index=True
+    )
+    size: Mapped[int | None] = mapped_column(BigInteger)
+    width: Mapped[int | None]
+    height: Mapped[int | None]
+    exif: Mapped[dict | None] = mapped_column(JSON)
+
+
+class EditResultTable(Base):
+    __tablename__ = "image_edit_result"
+
+    source_digest: Mapped[str] = mapped_column(String(64), primary_key=True)
+    key: Mapped[str] = mapped_column(primary_key=True)
+    digest: Mapped[str] = mapped_column(ForeignKey("image_blob.digest"))
+    size: Mapped[int]
+    width: Mapped[int | None]
+    height: Mapped[int | None]
+    last_used_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), index=True
+    )
+
+
+class UploadTable(Base):
+    __tablename__ = "image_upload"
+
+    id_: Mapped[UUID] = mapped_column(primary_key=True)
+    owner_id: Mapped[UUID] = mapped_column(
+        ForeignKey("user_.id", ondelete="CASCADE"),
+    )
+    title: Mapped[str]
+    length: Mapped[int] = mapped_column(BigInteger)
+    offset: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), index=True
+    )
+
+
+async def _iter_file(image_file: IImageFile) -> AsyncIterator[bytes]:
+    while chunk := await image_file.read(settings.FILE_CHUNK_SIZE):
+        yield chunk
+
+
+async def _iter_bytes(image_bytes: bytes) -> AsyncIterator[bytes]:
+    yield image_bytes
+
+
+@asynccontextmanager
+async def _temp_file(directory: Path) -> AsyncIterator[Path]:
+    """Yield a hidden temporary path in ``directory``.
+
+    The file is removed on exit unless it has been renamed away.
+    """
+    await aiofiles.os.makedirs(directory, exist_ok=True)
+    tmp_path = directory / f".{uuid4()}.tmp"
+    try:
+        yield tmp_path
+    finally:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+
+
+def _record_io(operation: str, seconds: float, size: int) -> None:
+    file_io_duration.labels("local", operation).observe(seconds)
+    file_io_bytes.labels("local", operation).inc(size)
+
+
+async def _write_chunks(path: Path, chunks: AsyncIterator[bytes]) -> None:
+    # Only the writes are timed, not the wait for the next chunk.
+    seconds = size = 0
+    async with aiofiles.open(path, "wb") as f:
+        async for chunk in chunks:
+            start = time.perf_counter()
+            await f.write(chunk)
+            seconds += time.perf_counter() - start
+            size += len(chunk)
+    _record_io("write", seconds, size)
+
+
+async def _write_atomic(path: Path, chunks: AsyncIterator[bytes]) -> None:
+    async with _temp_file(path.parent) as tmp_path:
+        await _write_chunks(tmp_path, chunks)
+        await aiofiles.os.replace(tmp_path, path)
+
+
+def _preallocate(path: Path, length: int) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, length)
+        except (AttributeError, OSError):
+            # Not every platform and file system can reserve blocks.
+            os.ftruncate(fd, length)
+    finally:
+        os.close(fd)
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _hash_path(path: Path) -> tuple[str, int]:
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+        return digest, f.tell()
 
 
 class ImageFileRepository:
-    def _get_path(self, image: Image) -> Path:
+    def get_path(self, image: Image) -> Path:
         return settings.IMAGE_DIR_PATH / str(image.id_)
 
+    def get_local_path(self, image: Image) -> Path | None:
+        return self.get_path(image)
+
+    async def has_blob(self, digest: str) -> bool:
+        # Files are stored per image, never as shared blobs.
+        return False
+
+    async def delete_blob(self, digest: str) -> None:
+        pass
+
+    async def get_download_url(
+        self, path: Path, media_type: str
+    ) -> str | None:
+        # Local files are served by the app itself.
+        return None
+
     async def save(self, image: Image, image_file: IImageFile) -> None:
-        path = self._get_path(image)
+        path = self.get_path(image)
+        size = 0
+        start = time.perf_counter()
         async with aiofiles.open(path, "wb") as f:
-            while chunk := await image_file.read(settings.FILE_CHUNK_SIZE):
+            async for chunk in _iter_file(image_file):
+                size += len(chunk)
                 await f.write(chunk)
+        _record_io("write", time.perf_counter() - start, size)
+        image.size = size
 
     async def save_bytes(self, image: Image, image_bytes: bytes) -> None:
-        path = self._get_path(image)
+        path = self.get_path(image)
+        start = time.perf_counter()
         async with aiofiles.open(path, "wb") as f:
             await f.write(image_bytes)
+        _record_io("write", time.perf_counter() - start, len(image_bytes))
+        image.size = len(image_bytes)
+
+    async def save_stream(
+        self, image: Image, chunks: AsyncIterator[bytes]
+    ) -> None:
+        """Write the chunks straight to the image path as they arrive.
+
+        Nothing is left behind when ``chunks`` raises part way through.
+        """
+        size = 0
+
+        async def counted() -> AsyncIterator[bytes]:
+            nonlocal size
+            async for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        await _write_atomic(self.get_path(image), counted())
+        image.size = size
 
     async def get(self, image: Image) -> bytes:
-        path = self._get_path(image)
+        path = self.get_path(image)
+        start = time.perf_counter()
         async with aiofiles.open(path, "rb") as f:
-            return await f.read()
+            image_bytes = await f.read()
+        _record_io("read", time.perf_counter() - start, len(image_bytes))
+        return image_bytes
+
+    async def get_size(self, image: Image) -> int:
+        return await aiofiles.os.path.getsize(self.get_path(image))
+
+    def get_variant_path(self, image: Image, name: str) -> Path:
+        path = self.get_path(image)
+        return path.with_name(f"{path.name}.{name}")
+
+    async def has_variant(self, image: Image, name: str) -> bool:
+        return await aiofiles.os.path.exists(
+            self.get_variant_path(image, name)
+        )
+
+    async def save_variant(
+        self, image: Image, name: str, image_bytes: bytes
+    ) -> None:
+        path = self.get_variant_path(image, name)
+        await _write_atomic(path, _iter_bytes(image_bytes))
+
+    def get_upload_path(self, upload_id: UUID) -> Path:
+        return settings.IMAGE_DIR_PATH / "uploads" / str(upload_id)
+
+    async def create_upload(self, upload: ImageUpload) -> None:
+        """Reserve the declared length, so parts never grow the file."""
+        path = self.get_upload_path(upload.id_)
+        await aiofiles.os.makedirs(path.parent, exist_ok=True)
+        await asyncio.to_thread(_preallocate, path, upload.length)
+
+    async def write_upload(
+        self, upload_id: UUID, offset: int, chunks: AsyncIterator[bytes]
+    ) -> int:
+        """Write the chunks in place from ``offset``.
+
+        Parts can arrive in separate requests without rewriting or
+        concatenating what is already stored. Returns the bytes written.
+        """
+        path = self.get_upload_path(upload_id)
+        fd = await asyncio.to_thread(os.open, path, os.O_WRONLY)
+        written = 0
+        seconds = 0
+        try:
+            async for chunk in chunks:
+                start = time.perf_counter()
+                await asyncio.to_thread(
+                    _pwrite_all, fd, chunk, offset + written
+                )
+                seconds += time.perf_counter() - start
+                written += len(chunk)
+        finally:
+            os.close(fd)
+            _record_io("write", seconds, written)
+        return written
+
+    async def read_upload(self, upload_id: UUID, size: int) -> bytes:
+        async with aiofiles.open(self.get_upload_path(upload_id), "rb") as f:
+            return await f.read(size)
+
+    async def finalize_upload(self, upload_id: UUID, image: Image) -> None:
+        """Move the finished upload into place without copying it."""
+        path = self.get_upload_path(upload_id)
+        image.size = await aiofiles.os.path.getsize(path)
+        await aiofiles.os.replace(path, self.get_path(image))
+
+    async def delete_upload(self, upload_id: UUID) -> None:
+        path = self.get_upload_path(upload_id)
+        if await aiofiles.os.path.exists(path):
+            await aiofiles.os.remove(path)
+
+
+class ContentAddressedImageFileRepository(ImageFileRepository):
+    """Stores each distinct file once, under the hash of its content.
+
+    Blobs live in ``blobs/<d[:2]>/<d[2:4]>/<digest>`` so that no single
+    directory grows too large. Uploading bytes that are already stored
+    only sets ``image.digest`` and does not touch the disk.
+    """
+
+    def _get_blob_path(self, digest: str) -> Path:
+        shard = Path(digest[:2], digest[2:4])
+        return settings.IMAGE_DIR_PATH / "blobs" / shard / digest
+
+    def get_path(self, image: Image) -> Path:
+        if image.digest is None:
+            return super().get_path(image)
+        return self._get_blob_path(image.digest)
+
+    async def _hash_file(self, image_file: IImageFile) -> tuple[str, int]:
+        hasher = hashlib.sha256()
+        size = 0
+        async for chunk in _iter_file(image_file):
+            size += len(chunk)
+            await asyncio.to_thread(hasher.update, chunk)
+        return hasher.hexdigest(), size
+
+    async def save(self, image: Image, image_file: IImageFile) -> None:
+        digest, size = await self._hash_file(image_file)
+        path = self._get_blob_path(digest)
+        if not await aiofiles.os.path.exists(path):
+            await image_file.seek(0)
+            await _write_atomic(path, _iter_file(image_file))
+        image.digest, image.size = digest, size
+
+    async def save_bytes(self, image: Image, image_bytes: bytes) -> None:
+        digest = await asyncio.to_thread(
+            lambda: hashlib.sha256(image_bytes).hexdigest()
+        )
+        path = self._get_blob_path(digest)
+        if not await aiofiles.os.path.exists(path):
+            await _write_atomic(path, _iter_bytes(image_bytes))
+        image.digest, image.size = digest, len(image_bytes)
+
+    async def save_stream(
+        self, image: Image, chunks: AsyncIterator[bytes]
+    ) -> None:
+        """Hash the chunks while writing them, then move the file into place.
+
+        The upload is read and written once. A duplicate blob is dropped.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+
+        async def hashed() -> AsyncIterator[bytes]:
+            nonlocal size
+            async for chunk in chunks:
+                hasher.update(chunk)
+                size += len(chunk)
+                yield chunk
+
+        async with _temp_file(settings.IMAGE_DIR_PATH / "blobs") as tmp_path:
+            await _write_chunks(tmp_path, hashed())
+            digest = hasher.hexdigest()
+            path = self._get_blob_path(digest)
+            if not await aiofiles.os.path.exists(path):
+                await aiofiles.os.makedirs(path.parent, exist_ok=True)
+                await aiofiles.os.replace(tmp_path, path)
+        image.digest, image.size = digest, size
+
+    async def finalize_upload(self, upload_id: UUID, image: Image) -> None:
+        """Hash the finished upload and rename it to its blob path."""
+        path = self.get_upload_path(upload_id)
+        digest, size = await asyncio.to_thread(_hash_path, path)
+        blob_path = self._get_blob_path(digest)
+        if await aiofiles.os.path.exists(blob_path):
+            await aiofiles.os.remove(path)
+        else:
+            await aiofiles.os.makedirs(blob_path.parent, exist_ok=True)
+            await aiofiles.os.replace(path, blob_path)
+        image.digest, image.size = digest, size
+
+    async def has_blob(self, digest: str) -> bool:
+        return await aiofiles.os.path.exists(self._get_blob_path(digest))
+
+    async def delete_blob(self, digest: str) -> None:
+        path = self._get_blob_path(digest)
+        variants = await asyncio.to_thread(
+            lambda: list(path.parent.glob(f"{digest}.*"))
+        )
+        for file_path in [path, *variants]:
+            if await aiofiles.os.path.exists(file_path):
+                await aiofiles.os.remove(file_path)
+
+
+_IMAGE_COLUMNS = (
+    ImageTable.id_,
+    ImageTable.owner_id,
+    ImageTable.title,
+    ImageTable.status,
+    ImageTable.created_at,
+    ImageTable.content_type,
+    ImageTable.digest,
+    ImageTable.size,
+    ImageTable.width,
+    ImageTable.height,
+    ImageTable.exif,
+)
+
+
+def _get_filter_clauses(filters: ImageFilter) -> list:
+    clauses = []
+    if filters.status is not None:
+        clauses.append(ImageTable.status == filters.status)
+    if filters.created_after is not None:
+        clauses.append(ImageTable.created_at >= filters.created_after)
+    if filters.created_before is not None:
+        clauses.append(ImageTable.created_at < filters.created_before)
+    if filters.format is not None:
+        clauses.append(ImageTable.content_type == filters.format.content_type)
+    for column, low, high in (
+        (ImageTable.width, filters.min_width, filters.max_width),
+        (ImageTable.height, filters.min_height, filters.max_height),
+        (ImageTable.size, filters.min_size, filters.max_size),
+    ):
+        if low is not None:
+            clauses.append(column >= low)
+        if high is not None:
+            clauses.append(column <= high)
+    return clauses
+
+
+def _insert(session: AsyncSession, table):
+    """An INSERT with ON CONFLICT support for the session's database.
+
+    Postgres in production, SQLite when the benchmarks run locally.
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
 
 
 @dataclass
@@ -88,19 +589,135 @@ class ImageRepository:
             owner_id=image_rep.owner_id,
             status=image_rep.status,
             created_at=image_rep.created_at,
+            content_type=image_rep.content_type,
+            digest=image_rep.digest,
+            size=image_rep.size,
+            width=image_rep.width,
+            height=image_rep.height,
+            exif=image_rep.exif,
         )
 
+    async def _add_blob_ref(
+        self, session: AsyncSession, digest: str, size: int | None
+    ) -> None:
+        if size is None:
+            # The blob is already referenced by an existing image.
+            statement = (
+                update(BlobTable)
+                .where(BlobTable.digest == digest)
+                .values(ref_count=BlobTable.ref_count + 1)
+            )
+            await session.execute(statement)
+            return
+        statement = (
+            _insert(session, BlobTable)
+            .values(digest=digest, size=size, ref_count=1)
+            .on_conflict_do_update(
+                index_elements=[BlobTable.digest],
+                set_={"ref_count": BlobTable.ref_count + 1},
+            )
+            .returning(BlobTable.ref_count)
+        )
+        ref_count = (await session.execute(statement)).scalar_one()
+        await self._check_blob(digest, ref_count, 1)
+
+    async def _check_blob(
+        self, digest: str, ref_count: int, added: int
+    ) -> None:
+        """Make sure a blob no other image holds on to still has its file.
+
+        The file may have been reused while ``_collect_blob`` was deleting
+        it. That keeps the row locked until the file is gone, so once the
+        reference is taken the file is either there to stay or gone.
+        """
+        if ref_count > added:
+            return
+        if not await self.file_repository.has_blob(digest):
+            raise FileNotFoundError(f"Blob {digest} was deleted meanwhile")
+
+    async def _add_blob_refs(
+        self, session: AsyncSession, images: list[Image]
+    ) -> None:
+        blobs: dict[str, dict] = {}
+        for image in images:
+            if image.digest is None:
+                continue
+            blob = blobs.setdefault(
+                image.digest,
+                {"digest": image.digest, "size": image.size, "ref_count": 0},
+            )
+            blob["ref_count"] += 1
+        new_blobs = []
+        for blob in blobs.values():
+            if blob["size"] is not None:
+                new_blobs.append(blob)
+                continue
+            # The blob is already referenced by an existing image.
+            statement = (
+                update(BlobTable)
+                .where(BlobTable.digest == blob["digest"])
+                .values(ref_count=BlobTable.ref_count + blob["ref_count"])
+            )
+            await session.execute(statement)
+        if not new_blobs:
+            return
+        statement = _insert(session, BlobTable).values(new_blobs)
+        statement = statement.on_conflict_do_update(
+            index_elements=[BlobTable.digest],
+            set_={
+                "ref_count": BlobTable.ref_count
+                + statement.excluded.ref_count
+            },
+        ).returning(BlobTable.digest, BlobTable.ref_count)
+        for digest, ref_count in (await session.execute(statement)).all():
+            await self._check_blob(
+                digest, ref_count, blobs[digest]["ref_count"]
+            )
+
     async def create_meta(self, session: AsyncSession, image: Image) -> None:
+        if image.digest is not None:
+            await self._add_blob_ref(session, image.digest, image.size)
         image_rep = ImageTable(**asdict(image))
         session.add(image_rep)
-        await session.commit()
+
+    async def create_meta_many(
+        self, session: AsyncSession, images: list[Image]
+    ) -> None:
+        if not images:
+            return
+        await self._add_blob_refs(session, images)
+        columns = ImageTable.__table__.columns.keys()
+        rows = [
+            {k: v for k, v in asdict(image).items() if k in columns}
+            for image in images
+        ]
+        await session.execute(_insert(session, ImageTable), rows)
 
     async def get_meta_list(
-        self, session: AsyncSession, owner_id: UUID
+        self,
+        session: AsyncSession,
+        owner_id: UUID,
+        limit: int | None = None,
+        after: ImageCursor | None = None,
+        filters: ImageFilter | None = None,
     ) -> list[Image]:
-        statement = select(ImageTable).where(ImageTable.owner_id == owner_id)
-        images_rep = (await session.execute(statement)).scalars()
-        return [self._table_to_model(i) for i in images_rep]
+        # Plain column select: rows are mapped straight to Image without
+        # building ORM entities or touching the identity map.
+        statement = (
+            select(*_IMAGE_COLUMNS)
+            .where(ImageTable.owner_id == owner_id)
+            .order_by(ImageTable.created_at.desc(), ImageTable.id_.desc())
+            .limit(limit)
+        )
+        if after is not None:
+            statement = statement.where(
+                tuple_(ImageTable.created_at, ImageTable.id_)
+                < tuple_(after.created_at, after.id_)
+            )
+        if filters is not None:
+            statement = statement.where(*_get_filter_clauses(filters))
+        rows = (await session.execute(statement)).all()
+        return [Image(**row._asdict()) for row in rows]
 
     async def get_meta(self, session: AsyncSession, id_: UUID) -> Image | None:
         image_rep = await session.get(ImageTable, id_)
@@ -109,13 +726,366 @@ class ImageRepository:
         image = self._table_to_model(image_rep)
         return image
 
+    async def get_meta_many(
+        self, session: AsyncSession, ids: list[UUID]
+    ) -> list[Image]:
+        if not ids:
+            return []
+        statement = select(*_IMAGE_COLUMNS).where(ImageTable.id_.in_(ids))
+        rows = (await session.execute(statement)).all()
+        return [Image(**row._asdict()) for row in rows]
+
     async def update_status(
-        self, session: AsyncSession, id_: UUID, status: ImageStatusEnum
+        self,
+        session: AsyncSession,
+        id_: UUID,
+        status: ImageStatusEnum,
+        digest: str | None = None,
+        size: int | None = None,
     ) -> None:
+        values = {"status": status}
+        if digest is not None:
+            await self._add_blob_ref(session, digest, size)
+            values["digest"] = digest
         statement = (
             update(ImageTable)
             .where(ImageTable.id_ == id_)
-            .values(status=status)
+            .values(**values)
+        )
+        await session.execute(statement)
+
+    async def update_status_many(
+        self,
+        session: AsyncSession,
+        images: list[Image],
+        status: ImageStatusEnum,
+    ) -> None:
+        """Set the status, digest and file metadata of every image in one
+        statement."""
+        if not images:
+            return
+        await self._add_blob_refs(session, images)
+        rows = [
+            {
+                "id_": image.id_,
+                "status": status,
+                "digest": image.digest,
+                "size": image.size,
+                "width": image.width,
+                "height": image.height,
+                "exif": image.exif,
+            }
+            for image in images
+        ]
+        # ORM bulk UPDATE by primary key, sent as a single executemany.
+        await session.execute(update(ImageTable), rows)
+
+    async def get_edit_result(
+        self, session: AsyncSession, source_digest: str, key: str
+    ) -> EditResult | None:
+        statement = (
+            update(EditResultTable)
+            .where(
+                EditResultTable.source_digest == source_digest,
+                EditResultTable.key == key,
+            )
+            .values(last_used_at=func.now())
+            .returning(
+                EditResultTable.digest,
+                EditResultTable.size,
+                EditResultTable.width,
+                EditResultTable.height,
+            )
+        )
+        row = (await session.execute(statement)).one_or_none()
+        if row is None:
+            return None
+        return EditResult(
+            source_digest=source_digest,
+            key=key,
+            digest=row.digest,
+            size=row.size,
+            width=row.width,
+            height=row.height,
+        )
+
+    async def _release_blobs(
+        self, session: AsyncSession, digests: list[str]
+    ) -> list[str]:
+        """Drop references and return the blobs left without any.
+
+        Their rows stay until ``_collect_blob`` deletes them with the file.
+        """
+        for digest, count in Counter(digests).items():
+            statement = (
+                update(BlobTable)
+                .where(BlobTable.digest == digest)
+                .values(ref_count=BlobTable.ref_count - count)
+            )
+            await session.execute(statement)
+        statement = select(BlobTable.digest).where(
+            BlobTable.digest.in_(digests), BlobTable.ref_count <= 0
+        )
+        return list((await session.execute(statement)).scalars())
+
+    async def _collect_blob(self, digest: str) -> None:
+        """Delete a blob and its file unless it was referenced again.
+
+        The row is deleted first and stays locked until the file is gone,
+        so an image taking a new reference meanwhile waits for this and
+        then finds the file missing, see ``_check_blob``.
+        """
+        async with new_session() as session:
+            statement = (
+                delete(BlobTable)
+                .where(BlobTable.digest == digest, BlobTable.ref_count <= 0)
+                .returning(BlobTable.digest)
+            )
+            if (await session.execute(statement)).one_or_none() is None:
+                return
+            await self.file_repository.delete_blob(digest)
+            await session.commit()
+
+    async def _evict_edit_results(
+        self, session: AsyncSession, max_bytes: int
+    ) -> list[str]:
+        ranked = select(
+            EditResultTable.source_digest,
+            EditResultTable.key,
+            func.sum(EditResultTable.size)
+            .over(order_by=EditResultTable.last_used_at.desc())
+            .label("total_size"),
+        ).subquery()
+        stale = select(ranked.c.source_digest, ranked.c.key).where(
+            ranked.c.total_size > max_bytes
+        )
+        key = tuple_(EditResultTable.source_digest, EditResultTable.key)
+        statement = (
+            delete(EditResultTable)
+            .where(key.in_(stale))
+            .returning(EditResultTable.digest)
+            .execution_options(synchronize_session=False)
+        )
+        evicted = list((await session.execute(statement)).scalars())
+        if not evicted:
+            return []
+        return await self._release_blobs(session, evicted)
+
+    async def put_edit_result(
+        self, session: AsyncSession, result: EditResult, max_bytes: int
+    ) -> None:
+        statement = (
+            _insert(session, EditResultTable)
+            .values(
+                source_digest=result.source_digest,
+                key=result.key,
+                digest=result.digest,
+                size=result.size,
+                width=result.width,
+                height=result.height,
+                last_used_at=func.now(),
+            )
+            .on_conflict_do_nothing()
+            .returning(EditResultTable.digest)
+        )
+        if (await session.execute(statement)).one_or_none() is not None:
+            await self._add_blob_ref(session, result.digest, result.size)
+        freed = await self._evict_edit_results(session, max_bytes)
+        for digest in freed:
+            after_commit(session, partial(self._collect_blob, digest))
+
+
+# Cached in place of an Image for ids that do not exist.
+_MISSING = "missing"
+
+
+@dataclass
+class CachedImageRepository:
+    """Read-through metadata cache in front of another repository.
+
+    Only DONE images are cached, because their metadata never changes
+    and a worker in another process can not invalidate our local cache.
+    Missing ids are cached for IMAGE_CACHE_NEGATIVE_TTL seconds.
+    """
+
+    repository: IImageRepository
+    cache: ICache
+    stats: CacheStats
+
+    @property
+    def file_repository(self) -> IImageFileRepository:
+        return self.repository.file_repository
+
+    async def _get_cached(self, id_: UUID) -> Image | str | None:
+        data = await self.cache.get(str(id_))
+        if data is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        if data == _MISSING:
+            return _MISSING
+        return Image(**{**data, "status": ImageStatusEnum(data["status"])})
+
+    async def _put(self, image: Image) -> None:
+        if image.status == ImageStatusEnum.DONE:
+            await self.cache.set(str(image.id_), asdict(image))
+
+    async def get_meta(self, session: AsyncSession, id_: UUID) -> Image | None:
+        cached = await self._get_cached(id_)
+        if cached == _MISSING:
+            return None
+        if cached is not None:
+            return cached
+        image = await self.repository.get_meta(session, id_)
+        if image is None:
+            await self.cache.set(
+                str(id_), _MISSING, settings.IMAGE_CACHE_NEGATIVE_TTL
+            )
+        else:
+            await self._put(image)
+        return image
+
+    async def get_meta_many(
+        self, session: AsyncSession, ids: list[UUID]
+    ) -> list[Image]:
+        images, missed = [], []
+        for id_ in ids:
+            cached = await self._get_cached(id_)
+            if cached is None:
+                missed.append(id_)
+            elif cached != _MISSING:
+                images.append(cached)
+        if missed:
+            loaded = await self.repository.get_meta_many(session, missed)
+            for image in loaded:
+                await self._put(image)
+            images.extend(loaded)
+        return images
+
+    async def create_meta(self, session: AsyncSession, image: Image) -> None:
+        await self.repository.create_meta(session, image)
+        await self.cache.delete(str(image.id_))
+
+    async def create_meta_many(
+        self, session: AsyncSession, images: list[Image]
+    ) -> None:
+        await self.repository.create_meta_many(session, images)
+        for image in images:
+            await self.cache.delete(str(image.id_))
+
+    async def get_meta_list(
+        self,
+        session: AsyncSession,
+        owner_id: UUID,
+        limit: int | None = None,
+        after: ImageCursor | None = None,
+        filters: ImageFilter | None = None,
+    ) -> list[Image]:
+        return await self.repository.get_meta_list(
+            session, owner_id, limit, after, filters
         )
+
+    async def update_status(
+        self,
+        session: AsyncSession,
+        id_: UUID,
+        status: ImageStatusEnum,
+        digest: str | None = None,
+        size: int | None = None,
+    ) -> None:
+        await self.repository.update_status(
+            session, id_, status, digest, size
+        )
+        await self.cache.delete(str(id_))
+
+    async def update_status_many(
+        self,
+        session: AsyncSession,
+        images: list[Image],
+        status: ImageStatusEnum,
+    ) -> None:
+        await self.repository.update_status_many(session, images, status)
+        for image in images:
+            await self.cache.delete(str(image.id_))
+
+    async def get_edit_result(
+        self, session: AsyncSession, source_digest: str, key: str
+    ) -> EditResult | None:
+        return await self.repository.get_edit_result(
+            session, source_digest, key
+        )
+
+    async def put_edit_result(
+        self, session: AsyncSession, result: EditResult, max_bytes: int
+    ) -> None:
+        await self.repository.put_edit_result(session, result, max_bytes)
+
+
+@dataclass
+class ImageUploadRepository:
+    file_repository: IImageFileRepository
+
+    def _table_to_model(self, upload_rep: UploadTable) -> ImageUpload:
+        return ImageUpload(
+            id_=upload_rep.id_,
+            owner_id=upload_rep.owner_id,
+            title=upload_rep.title,
+            length=upload_rep.length,
+            offset=upload_rep.offset,
+            updated_at=upload_rep.updated_at,
+        )
+
+    async def create(
+        self, session: AsyncSession, upload: ImageUpload
+    ) -> None:
+        session.add(
+            UploadTable(
+                id_=upload.id_,
+                owner_id=upload.owner_id,
+                title=upload.title,
+                length=upload.length,
+                offset=upload.offset,
+                updated_at=upload.updated_at,
+            )
+        )
+
+    async def get(
+        self, session: AsyncSession, id_: UUID
+    ) -> ImageUpload | None:
+        upload_rep = await session.get(UploadTable, id_)
+        if upload_rep is None:
+            return None
+        return self._table_to_model(upload_rep)
+
+    async def advance(
+        self, session: AsyncSession, id_: UUID, offset: int, written: int
+    ) -> bool:
+        """Move the offset forward if no other request got there first."""
+        statement = (
+            update(UploadTable)
+            .where(UploadTable.id_ == id_, UploadTable.offset == offset)
+            .values(offset=offset + written, updated_at=func.now())
+        )
+        result = await session.execute(statement)
+        return result.rowcount == 1
+
+    async def delete(self, session: AsyncSession, id_: UUID) -> None:
+        statement = delete(UploadTable).where(UploadTable.id_ == id_)
         await session.execute(statement)
-        await session.commit()
+
+    async def delete_stale(
+        self, session: AsyncSession, before: datetime.datetime
+    ) -> list[UUID]:
+        """Delete uploads untouched since ``before`` and, once that is
+        committed, their files."""
+        statement = (
+            delete(UploadTable)
+            .where(UploadTable.updated_at < before)
+            .returning(UploadTable.id_)
+        )
+        ids = list((await session.scalars(statement)).all())
+        for id_ in ids:
+            after_commit(
+                session, partial(self.file_repository.delete_upload, id_)
+            )
+        return ids
@@ -0,0 +1,179 @@
+import os
+import stat
+from email.utils import parsedate_to_datetime
+
+import anyio
+import anyio.to_thread
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from app.common.metrics import transfer_bytes
+from app.common.settings import settings
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single ``bytes=`` range into an inclusive (start, end).
+
+    Returns ``None`` when the header should be ignored (unknown unit or
+    several ranges) and raises ``ValueError`` when it is unsatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError(header)
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        raise ValueError(header)
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+class ImageFileResponse(FileResponse):
+    """File-backed response with conditional and partial GET support.
+
+    The body is never loaded into memory: it is handed to the server via
+    the zero-copy ASGI extensions when they are available, otherwise it
+    is streamed from disk in ``chunk_size`` pieces.
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        media_type: str | None = None,
+        etag: str | None = None,
+        chunk_size: int | None = None,
+    ) -> None:
+        super().__init__(path, media_type=media_type)
+        self.chunk_size = chunk_size or settings.FILE_RESPONSE_CHUNK_SIZE
+        self.etag = f'"{etag}"' if etag else None
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        if self.etag is not None:
+            self.headers.setdefault("etag", self.etag)
+        super().set_stat_headers(stat_result)
+        self.headers.setdefault("accept-ranges", "bytes")
+
+    def _is_not_modified(
+        self, request_headers: Headers, stat_result: os.stat_result
+    ) -> bool:
+        if if_none_match := request_headers.get("if-none-match"):
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            etag = self.headers["etag"]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        if if_modified_since := request_headers.get("if-modified-since"):
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(stat_result.st_mtime) <= since
+        return False
+
+    def _get_range(
+        self, request_headers: Headers, size: int
+    ) -> tuple[int, int] | None:
+        range_header = request_headers.get("range")
+        if not range_header:
+            return None
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range not in (
+            self.headers["etag"],
+            self.headers["last-modified"],
+        ):
+            return None
+        return parse_range(range_header, size)
+
+    async def _send_headers(self, send: Send, status_code: int) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": self.raw_headers,
+            }
+        )
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            raise RuntimeError(f"File at path {self.path} does not exist.")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+        self.set_stat_headers(stat_result)
+        request_headers = Headers(scope=scope)
+        size = stat_result.st_size
+
+        if self._is_not_modified(request_headers, stat_result):
+            del self.headers["content-length"]
+            await self._send_headers(send, 304)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        try:
+            byte_range = self._get_range(request_headers, size)
+        except ValueError:
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            await self._send_headers(send, 416)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        start, end = byte_range or (0, size - 1)
+        count = end - start + 1 if size else 0
+        status_code = self.status_code
+        if byte_range is not None:
+            status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(count)
+        await self._send_headers(send, status_code)
+
+        extensions = scope.get("extensions", {})
+        if scope["method"].upper() == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        transfer_bytes.labels("download").inc(count)
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file.fileno(),
+                        "offset": start,
+                        "count": count,
+                    }
+                )
+        elif byte_range is None and "http.response.pathsend" in extensions:
+            await send(
+                {"type": "http.response.pathsend", "path": str(self.path)}
+            )
+        else:
+            await self._send_file(send, start, count)
+
+    async def _send_file(self, send: Send, start: int, count: int) -> None:
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    }
+                )
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
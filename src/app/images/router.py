@@ -1,28 +1,66 @@
-import io
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    status,
+)
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
 
 from app.auth.manager import current_active_verified_user
 from app.db import get_async_session
-from app.images.deps import get_image_repository
+from app.images.deps import get_image_repository, get_upload_repository
 from app.images.services import (
     get_image_meta,
-    get_image_file,
+    get_image_path,
+    get_image_variant_path,
+    get_image_list,
     create_image,
+    create_images,
+    ingest_image,
+    create_upload,
+    get_upload,
+    write_upload,
     edit_image,
+    edit_images,
+    stream_image_events,
 )
 from app.images.exceptions import (
     ImageNotFoundException,
     UserIsNotOwnerException,
     ImageIsStillProcessingException,
+    ImageProcessingFailedException,
+    ImageTooManyPixelsException,
     InvalidFileException,
-    ImageTooBigException
+    ImageTooBigException,
+    InvalidCursorException,
+    TooManyFilesException,
+    UploadLengthExceededException,
+    UploadNotFoundException,
+    UploadOffsetMismatchException,
+)
+from app.images.events import get_broadcaster
+from app.images.inline import get_edit_pool
+from app.images.models import Image, ImageFormatEnum
+from app.images.responses import ImageFileResponse
+from app.images.schemas import (
+    ImageBatchCreateSchema,
+    ImageBatchEditSchema,
+    ImageBatchResultSchema,
+    ImageCreateSchema,
+    ImageReadSchema,
+    ImageEditSchema,
+    ImageListQuerySchema,
+    ImagePageSchema,
+    ImageUploadCreateSchema,
+    ImageUploadSchema,
 )
-from app.images.models import Image
-from app.images.schemas import ImageCreateSchema, ImageReadSchema, ImageEditSchema
 from app.users.models import User
 
 
@@ -68,41 +106,262 @@ async def create_image_handle(
             title=schema.title,
             owner_id=user.id,
         )
-    except (InvalidFileException, ImageTooBigException) as e:
+    except (
+        InvalidFileException,
+        ImageTooBigException,
+        ImageTooManyPixelsException,
+    ) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
         )
     return {"image_id": image_id}
 
 
+@router.post("/image/raw")
+async def create_image_raw_handler(
+    request: Request,
+    title: str,
+    image_repository=Depends(get_image_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+):
+    """Upload an image sent as the raw request body, not as a form."""
+    content_length = request.headers.get("content-length", "")
+    try:
+        image_id = await ingest_image(
+            repository=image_repository,
+            session=session,
+            chunks=request.stream(),
+            title=title,
+            owner_id=user.id,
+            content_length=(
+                int(content_length) if content_length.isdigit() else None
+            ),
+        )
+    except (
+        InvalidFileException,
+        ImageTooBigException,
+        ImageTooManyPixelsException,
+    ) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
+        )
+    return {"image_id": image_id}
+
+
+async def _receive_until_disconnect(request: Request):
+    """The request body, ending quietly if the client goes away."""
+    try:
+        async for chunk in request.stream():
+            yield chunk
+    except ClientDisconnect:
+        return
+
+
+@router.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload_handler(
+    schema: ImageUploadCreateSchema,
+    upload_repository=Depends(get_upload_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+) -> ImageUploadSchema:
+    """Start a resumable upload of ``length`` bytes.
+
+    Send the bytes with PATCH requests carrying an Upload-Offset header.
+    After a failure, GET the upload to learn where to resume.
+    """
+    try:
+        upload = await create_upload(
+            repository=upload_repository,
+            session=session,
+            title=schema.title,
+            length=schema.length,
+            owner_id=user.id,
+        )
+    except ImageTooBigException as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
+        )
+    return upload
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_handler(
+    upload_id: UUID,
+    upload_repository=Depends(get_upload_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+) -> ImageUploadSchema:
+    try:
+        upload = await get_upload(
+            repository=upload_repository,
+            session=session,
+            upload_id=upload_id,
+            owner_id=user.id,
+        )
+    except UploadNotFoundException as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=e.message
+        )
+    except UserIsNotOwnerException as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail=e.message
+        )
+    return upload
+
+
+@router.patch("/uploads/{upload_id}")
+async def write_upload_handler(
+    request: Request,
+    upload_id: UUID,
+    upload_offset: int = Header(ge=0),
+    image_repository=Depends(get_image_repository),
+    upload_repository=Depends(get_upload_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+) -> ImageUploadSchema:
+    try:
+        upload = await write_upload(
+            repository=image_repository,
+            upload_repository=upload_repository,
+            session=session,
+            upload_id=upload_id,
+            owner_id=user.id,
+            offset=upload_offset,
+            chunks=_receive_until_disconnect(request),
+        )
+    except UploadNotFoundException as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=e.message
+        )
+    except UserIsNotOwnerException as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail=e.message
+        )
+    except UploadOffsetMismatchException as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=e.message
+        )
+    except (
+        InvalidFileException,
+        ImageTooManyPixelsException,
+        UploadLengthExceededException,
+    ) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
+        )
+    return upload
+
+
+@router.post("/images")
+async def create_images_handler(
+    schema: ImageBatchCreateSchema = Depends(),
+    image_repository=Depends(get_image_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+) -> list[ImageBatchResultSchema]:
+    try:
+        results = await create_images(
+            repository=image_repository,
+            session=session,
+            files=schema.files,
+            titles=schema.get_titles(),
+            owner_id=user.id,
+        )
+    except TooManyFilesException as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
+        )
+    return results
+
+
 @router.get("/image/{image_id}")
 async def get_image_handler(
+    w: int | None = Query(default=None, gt=0),
+    format: ImageFormatEnum | None = None,
     image=Depends(valid_image_id),
     image_repository=Depends(get_image_repository),
-) -> StreamingResponse:
+) -> Response:
     try:
-        image_bytes = await get_image_file(
-            image_repository.file_repository, image
-        )
-    except ImageIsStillProcessingException as e:
+        if w is None and format is None:
+            path = await get_image_path(
+                image_repository.file_repository, image
+            )
+            media_type = image.content_type
+        else:
+            path, format = await get_image_variant_path(
+                image_repository.file_repository, image, w, format
+            )
+            media_type = format.content_type
+    except (
+        ImageIsStillProcessingException,
+        ImageProcessingFailedException,
+        ImageTooManyPixelsException,
+    ) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
         )
-    return StreamingResponse(
-        io.BytesIO(image_bytes), media_type=image.content_type
+    url = await image_repository.file_repository.get_download_url(
+        path, media_type
     )
+    if url is not None:
+        # Object storage serves the bytes, ranges and caching itself.
+        return RedirectResponse(
+            url, status_code=status.HTTP_307_TEMPORARY_REDIRECT
+        )
+    # Content-addressed files are named after their digest.
+    etag = path.name if image.digest is not None else None
+    return ImageFileResponse(path, media_type=media_type, etag=etag)
 
 
 @router.get("/images")
 async def get_images_handler(
+    query: ImageListQuerySchema = Depends(),
+    image_repository=Depends(get_image_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+) -> ImagePageSchema:
+    try:
+        image_list, next_cursor = await get_image_list(
+            repository=image_repository,
+            session=session,
+            owner_id=user.id,
+            limit=query.limit,
+            cursor=query.cursor,
+            filters=query.get_filters(),
+        )
+    except InvalidCursorException as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
+        )
+    return ImagePageSchema(items=image_list, next_cursor=next_cursor)
+
+
+@router.get("/images/events")
+async def image_events_handler(
+    image_id: list[UUID] = Query(default=[]),
     image_repository=Depends(get_image_repository),
+    broadcaster=Depends(get_broadcaster),
     session: AsyncSession = Depends(get_async_session),
     user: User = Depends(current_active_verified_user),
-) -> list[ImageReadSchema]:
-    image_list = await image_repository.get_meta_list(
-        session=session, owner_id=user.id
+) -> StreamingResponse:
+    if broadcaster is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Status events are not available",
+        )
+    events = stream_image_events(
+        repository=image_repository,
+        session=session,
+        broadcaster=broadcaster,
+        owner_id=user.id,
+        image_ids=image_id,
+    )
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return image_list
 
 
 @router.post("/image/{image_id}/edit")
@@ -110,18 +369,48 @@ async def edit_image_handler(
     schema: ImageEditSchema,
     image: Image = Depends(valid_image_id),
     image_repository=Depends(get_image_repository),
+    edit_pool=Depends(get_edit_pool),
     session: AsyncSession = Depends(get_async_session),
     user: User = Depends(current_active_verified_user),
 ) -> ImageReadSchema:
-    new_image_meta = await edit_image(
+    try:
+        new_image_meta = await edit_image(
+            repository=image_repository,
+            session=session,
+            image=image,
+            owner_id=user.id,
+            new_title=schema.title,
+            operations=schema.get_operations(),
+            encoding=schema.output.to_model(),
+            edit_pool=edit_pool,
+        )
+    except (
+        ImageProcessingFailedException,
+        ImageTooManyPixelsException,
+    ) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=e.message
+        )
+    return new_image_meta
+
+
+@router.post("/images/edit")
+async def edit_images_handler(
+    schema: ImageBatchEditSchema,
+    image_repository=Depends(get_image_repository),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_verified_user),
+) -> list[ImageBatchResultSchema]:
+    results = await edit_images(
         repository=image_repository,
         session=session,
-        id_=image.id_,
+        image_ids=schema.image_ids,
         owner_id=user.id,
+        operations=schema.get_operations(),
+        encoding=schema.output.to_model(),
         new_title=schema.title,
-        action=schema.action,
     )
-    return new_image_meta
+    return results
 
 
 @router.get("/task-test")
@@ -0,0 +1,464 @@
+"""Image storage in an S3-compatible object store.
+
+Selected with IMAGE_STORAGE_BACKEND="s3" and needs the ``s3`` extra,
+which installs aiobotocore. Every repository in a process shares one client,
+and through it one pool of up to S3_MAX_POOL_CONNECTIONS connections.
+Clients download files with presigned URLs instead of through the app.
+"""
+import asyncio
+import hashlib
+import time
+from collections.abc import AsyncIterator
+from pathlib import Path
+from uuid import UUID, uuid4
+
+from app.common.metrics import file_io_bytes, file_io_duration
+from app.common.settings import settings
+from app.images.models import IImageFile, Image, ImageUpload
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+    from botocore.exceptions import ClientError
+except ImportError:
+    get_session = None
+
+    class ClientError(Exception):
+        def __init__(self, error_response: dict, operation_name: str):
+            super().__init__(error_response, operation_name)
+            self.response = error_response
+
+
+_client = None
+_client_context = None
+
+
+async def get_client():
+    global _client, _client_context
+    if _client is not None:
+        return _client
+    if get_session is None:
+        raise RuntimeError(
+            'IMAGE_STORAGE_BACKEND="s3" needs the s3 extra (aiobotocore)'
+        )
+    context = get_session().create_client(
+        "s3",
+        endpoint_url=settings.S3_ENDPOINT_URL,
+        region_name=settings.S3_REGION,
+        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+        config=AioConfig(
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS
+        ),
+    )
+    client = await context.__aenter__()
+    if _client is not None:
+        # Another request created the client while we were connecting.
+        await context.__aexit__(None, None, None)
+    else:
+        _client, _client_context = client, context
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _client_context
+    if _client_context is not None:
+        await _client_context.__aexit__(None, None, None)
+    _client = _client_context = None
+
+
+def _is_not_found(error: ClientError) -> bool:
+    code = error.response.get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+def _record_io(operation: str, seconds: float, size: int) -> None:
+    file_io_duration.labels("s3", operation).observe(seconds)
+    file_io_bytes.labels("s3", operation).inc(size)
+
+
+async def _iter_file(image_file: IImageFile) -> AsyncIterator[bytes]:
+    while chunk := await image_file.read(settings.FILE_CHUNK_SIZE):
+        yield chunk
+
+
+async def _iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+class S3ImageFileRepository:
+    """Stores images as objects named after their id.
+
+    Paths returned by this repository are object keys. Resumable uploads
+    keep each part in its own object until the last one arrives.
+    """
+
+    @property
+    def bucket(self) -> str:
+        return settings.S3_BUCKET
+
+    def get_path(self, image: Image) -> Path:
+        return Path(str(image.id_))
+
+    def get_local_path(self, image: Image) -> Path | None:
+        # Objects have to be downloaded before they can be decoded.
+        return None
+
+    async def has_blob(self, digest: str) -> bool:
+        # Objects are stored per image, never as shared blobs.
+        return False
+
+    async def delete_blob(self, digest: str) -> None:
+        pass
+
+    def get_variant_path(self, image: Image, name: str) -> Path:
+        return Path(f"{self.get_path(image)}.{name}")
+
+    async def get_download_url(
+        self, path: Path, media_type: str
+    ) -> str | None:
+        client = await get_client()
+        return await client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": str(path),
+                "ResponseContentType": media_type,
+            },
+            ExpiresIn=settings.S3_PRESIGN_EXPIRE_SECONDS,
+        )
+
+    async def _exists(self, key: str) -> bool:
+        client = await get_client()
+        try:
+            await client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    async def _get_range(self, key: str, start: int, end: int) -> dict:
+        client = await get_client()
+        return await client.get_object(
+            Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}"
+        )
+
+    async def _read_body(self, response: dict) -> bytes:
+        async with response["Body"] as body:
+            return await body.read()
+
+    async def _get_object(self, key: str) -> bytes:
+        """Fetch an object, in concurrent ranged GETs if it is large."""
+        start = time.perf_counter()
+        data = await self._get_parts(key)
+        _record_io("read", time.perf_counter() - start, len(data))
+        return data
+
+    async def _get_parts(self, key: str) -> bytes:
+        part_size = settings.S3_PART_SIZE
+        response = await self._get_range(key, 0, part_size - 1)
+        first = await self._read_body(response)
+        content_range = response.get("ContentRange")
+        if content_range is None:
+            # The whole object came back, the store ignored the range.
+            return first
+        size = int(content_range.rpartition("/")[2])
+        if size <= part_size:
+            return first
+        semaphore = asyncio.Semaphore(settings.S3_PART_CONCURRENCY)
+
+        async def get_part(start: int) -> bytes:
+            end = min(start + part_size, size) - 1
+            async with semaphore:
+                return await self._read_body(
+                    await self._get_range(key, start, end)
+                )
+
+        parts = await asyncio.gather(
+            *(get_part(start) for start in range(part_size, size, part_size))
+        )
+        return b"".join([first, *parts])
+
+    async def _put_object(
+        self, key: str, chunks: AsyncIterator[bytes]
+    ) -> int:
+        # Includes any wait for a streamed body, which overlaps the parts.
+        start = time.perf_counter()
+        size = await self._put_parts(key, chunks)
+        _record_io("write", time.perf_counter() - start, size)
+        return size
+
+    async def _put_parts(
+        self, key: str, chunks: AsyncIterator[bytes]
+    ) -> int:
+        """Upload the chunks as one object and return its size.
+
+        Anything larger than S3_PART_SIZE becomes a multipart upload whose
+        parts are sent while later chunks are still arriving. A failed
+        upload is aborted, so no parts are left behind.
+        """
+        client = await get_client()
+        part_size = settings.S3_PART_SIZE
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        parts_sent = 0
+        pending: set[asyncio.Task] = set()
+        etags: dict[int, str] = {}
+
+        async def upload_part(number: int, data: bytes) -> None:
+            response = await client.upload_part(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=data,
+            )
+            etags[number] = response["ETag"]
+
+        async def send(data: bytes) -> None:
+            nonlocal upload_id, parts_sent
+            if upload_id is None:
+                response = await client.create_multipart_upload(
+                    Bucket=self.bucket, Key=key
+                )
+                upload_id = response["UploadId"]
+            if len(pending) >= settings.S3_PART_CONCURRENCY:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                pending.difference_update(done)
+                for task in done:
+                    task.result()
+            parts_sent += 1
+            pending.add(asyncio.create_task(upload_part(parts_sent, data)))
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                while len(buffer) >= part_size:
+                    await send(bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+            if upload_id is None:
+                await client.put_object(
+                    Bucket=self.bucket, Key=key, Body=bytes(buffer)
+                )
+                return size
+            if buffer:
+                await send(bytes(buffer))
+            await asyncio.gather(*pending)
+            await client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": number, "ETag": etags[number]}
+                        for number in sorted(etags)
+                    ]
+                },
+            )
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            if upload_id is not None:
+                await client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+            raise
+        return size
+
+    async def _list(self, prefix: str) -> AsyncIterator[dict]:
+        client = await get_client()
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix}
+        while True:
+            response = await client.list_objects_v2(**kwargs)
+            for item in response.get("Contents", []):
+                yield item
+            if not response.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    async def _delete_prefix(self, prefix: str) -> None:
+        client = await get_client()
+        keys = [item["Key"] async for item in self._list(prefix)]
+        # One request deletes at most 1000 objects.
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": key} for key in keys[start:start + 1000]]
+            await client.delete_objects(
+                Bucket=self.bucket, Delete={"Objects": objects}
+            )
+
+    async def save(self, image: Image, image_file: IImageFile) -> None:
+        image.size = await self._put_object(
+            str(self.get_path(image)), _iter_file(image_file)
+        )
+
+    async def save_bytes(self, image: Image, image_bytes: bytes) -> None:
+        image.size = await self._put_object(
+            str(self.get_path(image)), _iter_bytes(image_bytes)
+        )
+
+    async def save_stream(
+        self, image: Image, chunks: AsyncIterator[bytes]
+    ) -> None:
+        image.size = await self._put_object(str(self.get_path(image)), chunks)
+
+    async def get(self, image: Image) -> bytes:
+        return await self._get_object(str(self.get_path(image)))
+
+    async def get_size(self, image: Image) -> int:
+        client = await get_client()
+        response = await client.head_object(
+            Bucket=self.bucket, Key=str(self.get_path(image))
+        )
+        return response["ContentLength"]
+
+    async def has_variant(self, image: Image, name: str) -> bool:
+        return await self._exists(str(self.get_variant_path(image, name)))
+
+    async def save_variant(
+        self, image: Image, name: str, image_bytes: bytes
+    ) -> None:
+        await self._put_object(
+            str(self.get_variant_path(image, name)), _iter_bytes(image_bytes)
+        )
+
+    def get_upload_path(self, upload_id: UUID) -> Path:
+        return Path("uploads", str(upload_id))
+
+    def _get_upload_part_key(self, upload_id: UUID, offset: int) -> str:
+        # Zero padded, so listing the prefix returns parts in order. The
+        # suffix keeps a retried write from replacing a committed part.
+        path = self.get_upload_path(upload_id)
+        return f"{path}/{offset:015d}-{uuid4().hex}"
+
+    async def create_upload(self, upload: ImageUpload) -> None:
+        pass
+
+    async def write_upload(
+        self, upload_id: UUID, offset: int, chunks: AsyncIterator[bytes]
+    ) -> int:
+        return await self._put_object(
+            self._get_upload_part_key(upload_id, offset), chunks
+        )
+
+    async def _iter_upload(
+        self, upload_id: UUID, limit: int | None = None
+    ) -> AsyncIterator[bytes]:
+        """The upload's bytes in order, read part by part.
+
+        A part can overlap the next one when a write was retried, the
+        bytes of the overlap are only sent once.
+        """
+        position = 0
+        prefix = f"{self.get_upload_path(upload_id)}/"
+        async for item in self._list(prefix):
+            name = item["Key"].rpartition("/")[2]
+            offset = int(name.partition("-")[0])
+            if offset > position:
+                raise ValueError(f"Upload {upload_id} has a gap at {position}")
+            end = offset + item["Size"]
+            if limit is not None:
+                end = min(end, limit)
+            if end <= position:
+                continue
+            response = await self._get_range(
+                item["Key"], position - offset, end - offset - 1
+            )
+            yield await self._read_body(response)
+            position = end
+            if position == limit:
+                return
+
+    async def read_upload(self, upload_id: UUID, size: int) -> bytes:
+        return b"".join([c async for c in self._iter_upload(upload_id, size)])
+
+    async def finalize_upload(self, upload_id: UUID, image: Image) -> None:
+        """Copy the parts into one object and delete them."""
+        await self.save_stream(image, self._iter_upload(upload_id))
+        await self.delete_upload(upload_id)
+
+    async def delete_upload(self, upload_id: UUID) -> None:
+        await self._delete_prefix(f"{self.get_upload_path(upload_id)}/")
+
+
+class ContentAddressedS3ImageFileRepository(S3ImageFileRepository):
+    """Stores each distinct file once, under the hash of its content.
+
+    Uses the same key layout as the local content-addressed repository.
+    A streamed file is uploaded to a temporary key while it is hashed and
+    then copied inside the store, unless the blob already exists.
+    """
+
+    def _get_blob_key(self, digest: str) -> str:
+        return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def get_path(self, image: Image) -> Path:
+        if image.digest is None:
+            return super().get_path(image)
+        return Path(self._get_blob_key(image.digest))
+
+    async def _save_known(
+        self, image: Image, digest: str, size: int, chunks
+    ) -> None:
+        key = self._get_blob_key(digest)
+        if not await self._exists(key):
+            await self._put_object(key, chunks)
+        image.digest, image.size = digest, size
+
+    async def save(self, image: Image, image_file: IImageFile) -> None:
+        hasher = hashlib.sha256()
+        size = 0
+        async for chunk in _iter_file(image_file):
+            size += len(chunk)
+            await asyncio.to_thread(hasher.update, chunk)
+        await image_file.seek(0)
+        await self._save_known(
+            image, hasher.hexdigest(), size, _iter_file(image_file)
+        )
+
+    async def save_bytes(self, image: Image, image_bytes: bytes) -> None:
+        digest = await asyncio.to_thread(
+            lambda: hashlib.sha256(image_bytes).hexdigest()
+        )
+        await self._save_known(
+            image, digest, len(image_bytes), _iter_bytes(image_bytes)
+        )
+
+    async def save_stream(
+        self, image: Image, chunks: AsyncIterator[bytes]
+    ) -> None:
+        hasher = hashlib.sha256()
+
+        async def hashed() -> AsyncIterator[bytes]:
+            async for chunk in chunks:
+                hasher.update(chunk)
+                yield chunk
+
+        client = await get_client()
+        tmp_key = f"tmp/{uuid4()}"
+        try:
+            size = await self._put_object(tmp_key, hashed())
+            digest = hasher.hexdigest()
+            key = self._get_blob_key(digest)
+            if not await self._exists(key):
+                await client.copy_object(
+                    Bucket=self.bucket,
+                    Key=key,
+                    CopySource={"Bucket": self.bucket, "Key": tmp_key},
+                )
+        finally:
+            await client.delete_object(Bucket=self.bucket, Key=tmp_key)
+        image.digest, image.size = digest, size
+
+    async def has_blob(self, digest: str) -> bool:
+        return await self._exists(self._get_blob_key(digest))
+
+    async def delete_blob(self, digest: str) -> None:
+        key = self._get_blob_key(digest)
+        client = await get_client()
+        await client.delete_object(Bucket=self.bucket, Key=key)
+        await self._delete_prefix(f"{key}.")
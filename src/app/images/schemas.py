@@ -1,10 +1,18 @@
 from datetime import datetime
 from uuid import UUID
 
-from fastapi import File, UploadFile
-from pydantic import BaseModel, Field
+from fastapi import File, Form, UploadFile
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
-from app.images.models import ImageStatusEnum, ImageEditActionEnum
+from app.common.settings import settings
+from app.images.models import (
+    EditOperation,
+    EncodeOptions,
+    ImageStatusEnum,
+    ImageEditActionEnum,
+    ImageFilter,
+    ImageFormatEnum,
+)
 
 
 class BaseImage(BaseModel):
@@ -15,11 +23,170 @@ class ImageCreateSchema(BaseImage):
     file: UploadFile = File(...)
 
 
+class ImageBatchCreateSchema(BaseModel):
+    files: list[UploadFile] = File(...)
+    titles: list[str] = Form(default=[])
+
+    def get_titles(self) -> list[str]:
+        """Titles by position, falling back to the uploaded file name."""
+        return [
+            self.titles[i] if i < len(self.titles) else file.filename or ""
+            for i, file in enumerate(self.files)
+        ]
+
+
+class ImageBatchResultSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    index: int
+    image_id: UUID | None
+    error: str | None
+
+
 class ImageReadSchema(BaseImage):
+    model_config = ConfigDict(from_attributes=True)
+
     id: UUID = Field(validation_alias="id_")
     status: ImageStatusEnum
     created_at: datetime
+    content_type: str
+    size: int | None = None
+    width: int | None = None
+    height: int | None = None
+    exif: dict[str, str | int | float] | None = None
+
+
+class ImageUploadCreateSchema(BaseImage):
+    length: int = Field(gt=0)
+
+
+class ImageUploadSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: UUID = Field(validation_alias="id_")
+    length: int
+    offset: int
+    image_id: UUID | None
+
+
+class ImagePageSchema(BaseModel):
+    items: list[ImageReadSchema]
+    next_cursor: str | None
+
 
+class ImageListQuerySchema(BaseModel):
+    limit: int = Field(
+        default=settings.IMAGE_PAGE_SIZE,
+        ge=1,
+        le=settings.IMAGE_PAGE_MAX_SIZE,
+    )
+    cursor: str | None = None
+    status: ImageStatusEnum | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+    format: ImageFormatEnum | None = None
+    min_width: int | None = Field(default=None, ge=0)
+    max_width: int | None = Field(default=None, ge=0)
+    min_height: int | None = Field(default=None, ge=0)
+    max_height: int | None = Field(default=None, ge=0)
+    min_size: int | None = Field(default=None, ge=0)
+    max_size: int | None = Field(default=None, ge=0)
 
-class ImageEditSchema(BaseImage):
+    def get_filters(self) -> ImageFilter:
+        return ImageFilter(
+            status=self.status,
+            created_after=self.created_after,
+            created_before=self.created_before,
+            format=self.format,
+            min_width=self.min_width,
+            max_width=self.max_width,
+            min_height=self.min_height,
+            max_height=self.max_height,
+            min_size=self.min_size,
+            max_size=self.max_size,
+        )
+
+
+class ImageEditOperationSchema(BaseModel):
     action: ImageEditActionEnum
+    angle: int = Field(default=90, multiple_of=90)
+    box: tuple[int, int, int, int] | None = None
+    width: int | None = Field(
+        default=None, gt=0, le=settings.IMAGE_MAX_PIXELS
+    )
+    height: int | None = Field(
+        default=None, gt=0, le=settings.IMAGE_MAX_PIXELS
+    )
+
+    @model_validator(mode="after")
+    def check_params(self) -> "ImageEditOperationSchema":
+        if self.action == ImageEditActionEnum.CROP:
+            if self.box is None:
+                raise ValueError("crop requires a box")
+            left, top, right, bottom = self.box
+            if (
+                left < 0
+                or top < 0
+                or right <= left
+                or bottom <= top
+                or max(right, bottom) > settings.IMAGE_MAX_PIXELS
+            ):
+                raise ValueError("crop box is empty or out of bounds")
+            if (right - left) * (bottom - top) > settings.IMAGE_MAX_PIXELS:
+                raise ValueError(
+                    "crop box can not have more than "
+                    f"{settings.IMAGE_MAX_PIXELS} pixels"
+                )
+        if self.action == ImageEditActionEnum.RESIZE:
+            if self.width is None and self.height is None:
+                raise ValueError("resize requires a width or a height")
+            if (self.width or 1) * (self.height or 1) > (
+                settings.IMAGE_MAX_PIXELS
+            ):
+                raise ValueError(
+                    "resize can not have more than "
+                    f"{settings.IMAGE_MAX_PIXELS} pixels"
+                )
+        return self
+
+    def to_model(self) -> EditOperation:
+        return EditOperation(**self.model_dump())
+
+
+class ImageEncodeSchema(BaseModel):
+    format: ImageFormatEnum | None = None
+    quality: int | None = Field(default=None, ge=1, le=100)
+    compress_level: int | None = Field(default=None, ge=0, le=9)
+
+    def to_model(self) -> EncodeOptions:
+        return EncodeOptions(**self.model_dump())
+
+
+class ImagePipelineSchema(BaseModel):
+    action: ImageEditActionEnum | None = None
+    operations: list[ImageEditOperationSchema] = Field(
+        default_factory=list, max_length=settings.EDIT_MAX_OPERATIONS
+    )
+    output: ImageEncodeSchema = Field(default_factory=ImageEncodeSchema)
+
+    @model_validator(mode="after")
+    def check_operations(self) -> "ImagePipelineSchema":
+        if (self.action is None) == (not self.operations):
+            raise ValueError("pass either an action or a list of operations")
+        if self.action is not None:
+            self.operations = [ImageEditOperationSchema(action=self.action)]
+        return self
+
+    def get_operations(self) -> list[EditOperation]:
+        return [operation.to_model() for operation in self.operations]
+
+
+class ImageEditSchema(BaseImage, ImagePipelineSchema):
+    pass
+
+
+class ImageBatchEditSchema(ImagePipelineSchema):
+    image_ids: list[UUID] = Field(
+        min_length=1, max_length=settings.EDIT_BATCH_MAX_IMAGES
+    )
+    title: str | None = None
@@ -1,23 +1,77 @@
+import asyncio
+import base64
+import binascii
+import logging
+from collections.abc import AsyncIterator
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, replace
+from datetime import datetime
+from pathlib import Path
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.common.metrics import transfer_bytes
+from app.common.queue import dispatch
 from app.common.settings import settings
 from app.images.models import (
-    ImageEditActionEnum,
+    EditOperation,
+    EditResult,
+    EncodeOptions,
     Image,
+    ImageBatchResult,
+    ImageCursor,
+    ImageFilter,
+    ImageFormatEnum,
     ImageStatusEnum,
+    ImageStatusEvent,
+    ImageUpload,
     IImageFile,
 )
-from app.images.repositories import IImageRepository, IImageFileRepository
+from app.images.events import StatusBroadcaster, format_sse
+from app.images.inline import InlineEditPool
+from app.images.pipeline import (
+    HEADER_MAX_BYTES,
+    check_pipeline_pixels,
+    dump_operations,
+    get_edit_key,
+    normalize_operations,
+    read_metadata,
+)
+from app.images.repositories import (
+    IImageRepository,
+    IImageFileRepository,
+    IImageUploadRepository,
+)
 from app.images.exceptions import (
     ImageNotFoundException,
     UserIsNotOwnerException,
     ImageIsStillProcessingException,
+    ImageProcessingFailedException,
     InvalidFileException,
-    ImageTooBigException
+    ImageTooBigException,
+    ImageTooManyPixelsException,
+    InvalidCursorException,
+    TooManyFilesException,
+    UploadLengthExceededException,
+    UploadNotFoundException,
+    UploadOffsetMismatchException,
+)
+from app.images.tasks import (
+    edit_image_task,
+    edit_images_task,
+    generate_variants_task,
 )
-from app.images.tasks import edit_image_task
+from app.images.variants import (
+    get_variant_name,
+    pick_variant_width,
+    render_variant,
+)
+
+
+logger = logging.getLogger(__name__)
+
+_MAGIC_BYTES_SIZE = 12
 
 
 async def get_image_meta(
@@ -34,23 +88,90 @@ async def get_image_meta(
     return image
 
 
+def encode_cursor(image: Image) -> str:
+    raw = f"{image.created_at.isoformat()}|{image.id_}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> ImageCursor:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, _, id_ = raw.partition("|")
+        return ImageCursor(
+            created_at=datetime.fromisoformat(created_at), id_=UUID(id_)
+        )
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorException()
+
+
+async def get_image_list(
+    repository: IImageRepository,
+    session: AsyncSession,
+    owner_id: UUID,
+    limit: int,
+    cursor: str | None = None,
+    filters: ImageFilter | None = None,
+) -> tuple[list[Image], str | None]:
+    after = decode_cursor(cursor) if cursor else None
+    images = await repository.get_meta_list(
+        session, owner_id, limit=limit + 1, after=after, filters=filters
+    )
+    if len(images) <= limit:
+        return images, None
+    images = images[:limit]
+    return images, encode_cursor(images[-1])
+
+
+def _check_done(image: Image) -> None:
+    if image.status == ImageStatusEnum.PROCESSING:
+        raise ImageIsStillProcessingException()
+    if image.status == ImageStatusEnum.FAILED:
+        raise ImageProcessingFailedException()
+
+
 async def get_image_file(
     repository: IImageFileRepository,
     image: Image,
 ) -> bytes:
-    if image.status == ImageStatusEnum.PROCESSING:
-        raise ImageIsStillProcessingException()
+    _check_done(image)
     image_bytes = await repository.get(image)
     return image_bytes
 
 
-async def create_image(
-    repository: IImageRepository,
-    session: AsyncSession,
-    file: IImageFile,
-    title: str,
-    owner_id: UUID,
-) -> UUID:
+async def get_image_path(
+    repository: IImageFileRepository,
+    image: Image,
+) -> Path:
+    _check_done(image)
+    return repository.get_path(image)
+
+
+async def get_image_variant_path(
+    repository: IImageFileRepository,
+    image: Image,
+    width: int | None,
+    format: ImageFormatEnum | None,
+) -> tuple[Path, ImageFormatEnum]:
+    _check_done(image)
+    format = (
+        format
+        or ImageFormatEnum.from_content_type(image.content_type)
+        or ImageFormatEnum.WEBP
+    )
+    width = pick_variant_width(width)
+    name = get_variant_name(width, format)
+    if not await repository.has_variant(image, name):
+        source = repository.get_local_path(image)
+        if source is None:
+            source = await repository.get(image)
+        variant_bytes = await asyncio.to_thread(
+            render_variant, source, width, format
+        )
+        await repository.save_variant(image, name, variant_bytes)
+    return repository.get_variant_path(image, name), format
+
+
+def _validate_file(file: IImageFile | None) -> None:
     if (
         not file or
         not file.size or
@@ -60,27 +181,503 @@ async def create_image(
         raise InvalidFileException()
     if file.size / (1024 * 1024) > settings.MAX_FILE_SIZE_MB:
         raise ImageTooBigException()
-    image = Image(title=title, owner_id=owner_id, status=ImageStatusEnum.DONE)
-    await repository.create_meta(session, image)
+
+
+async def create_image(
+    repository: IImageRepository,
+    session: AsyncSession,
+    file: IImageFile,
+    title: str,
+    owner_id: UUID,
+) -> UUID:
+    _validate_file(file)
+    transfer_bytes.labels("upload").inc(file.size)
+    image = Image(
+        title=title,
+        owner_id=owner_id,
+        status=ImageStatusEnum.DONE,
+        content_type=file.content_type,
+    )
+    await _read_file_metadata(image, file)
     await repository.file_repository.save(image, file)
+    await repository.create_meta(session, image)
+    await dispatch(session, generate_variants_task, image_id=image.id_)
     return image.id_
 
 
+async def _read_file_metadata(image: Image, file: IImageFile) -> None:
+    head = await file.read(HEADER_MAX_BYTES)
+    await file.seek(0)
+    read_metadata(image, head)
+
+
+async def _sniff_and_limit(
+    image: Image, chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    """Pass chunks through, checking the real format and the size.
+
+    The format comes from the magic bytes at the start of the body and
+    sets ``image.content_type``, the dimensions and EXIF from the header
+    within its first HEADER_MAX_BYTES. Errors are raised as soon as the
+    body is known to be invalid, which aborts the write that consumes
+    them.
+    """
+    max_size = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    head = b""
+    header = bytearray()
+    has_metadata = False
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        transfer_bytes.labels("upload").inc(len(chunk))
+        if size > max_size:
+            raise ImageTooBigException()
+        if not has_metadata and len(header) < HEADER_MAX_BYTES:
+            header += chunk[: HEADER_MAX_BYTES - len(header)]
+            has_metadata = read_metadata(image, bytes(header))
+        if head is None:
+            yield chunk
+            continue
+        head += chunk
+        if len(head) < _MAGIC_BYTES_SIZE:
+            continue
+        _set_sniffed_format(image, head)
+        yield head
+        head = None
+    if head is not None:
+        # The whole body fits in the sniffing buffer.
+        _set_sniffed_format(image, head)
+        yield head
+
+
+def _set_sniffed_format(image: Image, head: bytes) -> None:
+    format = ImageFormatEnum.from_magic_bytes(head)
+    if format is None:
+        raise InvalidFileException()
+    image.content_type = format.content_type
+
+
+async def ingest_image(
+    repository: IImageRepository,
+    session: AsyncSession,
+    chunks: AsyncIterator[bytes],
+    title: str,
+    owner_id: UUID,
+    content_length: int | None = None,
+) -> UUID:
+    """Store an image streamed as a raw request body.
+
+    The body is written once, straight to storage, without trusting the
+    client's content type or size.
+    """
+    max_size = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    if content_length is not None and content_length > max_size:
+        raise ImageTooBigException()
+    image = Image(title=title, owner_id=owner_id)
+    await repository.file_repository.save_stream(
+        image, _sniff_and_limit(image, chunks)
+    )
+    await repository.create_meta(session, image)
+    await dispatch(session, generate_variants_task, image_id=image.id_)
+    return image.id_
+
+
+async def create_upload(
+    repository: IImageUploadRepository,
+    session: AsyncSession,
+    title: str,
+    length: int,
+    owner_id: UUID,
+) -> ImageUpload:
+    if length > settings.MAX_FILE_SIZE_MB * 1024 * 1024:
+        raise ImageTooBigException()
+    upload = ImageUpload(owner_id=owner_id, title=title, length=length)
+    await repository.file_repository.create_upload(upload)
+    await repository.create(session, upload)
+    return upload
+
+
+async def get_upload(
+    repository: IImageUploadRepository,
+    session: AsyncSession,
+    upload_id: UUID,
+    owner_id: UUID,
+) -> ImageUpload:
+    upload = await repository.get(session, upload_id)
+    if upload is None:
+        raise UploadNotFoundException(upload_id)
+    if upload.owner_id != owner_id:
+        raise UserIsNotOwnerException()
+    return upload
+
+
+async def _limit_upload(
+    upload: ImageUpload, chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    remaining = upload.length - upload.offset
+    async for chunk in chunks:
+        remaining -= len(chunk)
+        transfer_bytes.labels("upload").inc(len(chunk))
+        if remaining < 0:
+            raise UploadLengthExceededException()
+        yield chunk
+
+
+async def write_upload(
+    repository: IImageRepository,
+    upload_repository: IImageUploadRepository,
+    session: AsyncSession,
+    upload_id: UUID,
+    owner_id: UUID,
+    offset: int,
+    chunks: AsyncIterator[bytes],
+) -> ImageUpload:
+    """Write the next part of an upload, starting at ``offset``.
+
+    A part cut short by a dropped connection still counts up to the last
+    byte received, so the client resumes from the offset it reads back.
+    The upload becomes an image when its last byte arrives.
+    """
+    upload = await get_upload(upload_repository, session, upload_id, owner_id)
+    if offset != upload.offset:
+        raise UploadOffsetMismatchException(upload.offset)
+    # Do not hold a pooled connection while the body streams in.
+    await session.close()
+    file_repository = upload_repository.file_repository
+    written = await file_repository.write_upload(
+        upload.id_, offset, _limit_upload(upload, chunks)
+    )
+    upload.offset += written
+    image = Image(title=upload.title, owner_id=owner_id)
+    head_size = min(_MAGIC_BYTES_SIZE, upload.length)
+    if offset < head_size <= upload.offset:
+        # Rejects a file that is not an image before the rest is sent.
+        head = await file_repository.read_upload(upload.id_, head_size)
+        _set_sniffed_format(image, head)
+    if not await upload_repository.advance(
+        session, upload.id_, offset, written
+    ):
+        # Another request for the same upload finished first.
+        current = await get_upload(
+            upload_repository, session, upload_id, owner_id
+        )
+        raise UploadOffsetMismatchException(current.offset)
+    if upload.offset < upload.length:
+        return upload
+    head = await file_repository.read_upload(
+        upload.id_, min(HEADER_MAX_BYTES, upload.length)
+    )
+    if offset >= head_size:
+        _set_sniffed_format(image, head)
+    read_metadata(image, head)
+    await file_repository.finalize_upload(upload.id_, image)
+    await repository.create_meta(session, image)
+    await upload_repository.delete(session, upload.id_)
+    await dispatch(session, generate_variants_task, image_id=image.id_)
+    upload.image_id = image.id_
+    return upload
+
+
+async def create_images(
+    repository: IImageRepository,
+    session: AsyncSession,
+    files: list[IImageFile],
+    titles: list[str],
+    owner_id: UUID,
+) -> list[ImageBatchResult]:
+    """Store a batch of uploads, reporting failures per item.
+
+    Valid files are written concurrently, at most UPLOAD_CONCURRENCY at a
+    time, and their metadata is inserted with one bulk statement.
+    """
+    if len(files) > settings.UPLOAD_BATCH_MAX_FILES:
+        raise TooManyFilesException()
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+
+    async def save(file: IImageFile, title: str) -> Image:
+        _validate_file(file)
+        transfer_bytes.labels("upload").inc(file.size)
+        image = Image(
+            title=title,
+            owner_id=owner_id,
+            status=ImageStatusEnum.DONE,
+            content_type=file.content_type,
+        )
+        async with semaphore:
+            await _read_file_metadata(image, file)
+            await repository.file_repository.save(image, file)
+        return image
+
+    outcomes = await asyncio.gather(
+        *(save(file, title) for file, title in zip(files, titles)),
+        return_exceptions=True,
+    )
+    images = [o for o in outcomes if isinstance(o, Image)]
+    await repository.create_meta_many(session, images)
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Image):
+            await dispatch(
+                session, generate_variants_task, image_id=outcome.id_
+            )
+            results.append(ImageBatchResult(index, image_id=outcome.id_))
+        elif isinstance(
+            outcome,
+            (
+                InvalidFileException,
+                ImageTooBigException,
+                ImageTooManyPixelsException,
+            ),
+        ):
+            results.append(ImageBatchResult(index, error=outcome.message))
+        elif isinstance(outcome, Exception):
+            # Raising would leave the files saved for the others orphaned.
+            if not isinstance(outcome, OSError):
+                logger.error("Saving file %s failed", index, exc_info=outcome)
+            results.append(
+                ImageBatchResult(index, error="File could not be saved")
+            )
+        else:
+            raise outcome
+    return results
+
+
+async def _plan_edit(
+    repository: IImageRepository,
+    session: AsyncSession,
+    image: Image,
+    owner_id: UUID,
+    new_title: str,
+    operations: list[EditOperation],
+    encoding: EncodeOptions | None,
+) -> tuple[Image, EncodeOptions]:
+    """Build the edited image, already DONE when no render is needed.
+
+    Pipelines that would make an image over IMAGE_MAX_PIXELS raise
+    ImageTooManyPixelsException before anything is queued.
+    """
+    if image.width is not None and image.height is not None:
+        check_pipeline_pixels((image.width, image.height), operations)
+    source_format = ImageFormatEnum.from_content_type(image.content_type)
+    encoding = replace(encoding or EncodeOptions())
+    encoding.format = encoding.format or source_format or ImageFormatEnum.PNG
+    new_image = Image(
+        title=new_title,
+        owner_id=owner_id,
+        status=ImageStatusEnum.PROCESSING,
+        content_type=encoding.format.content_type,
+    )
+    is_identity = not operations and encoding == EncodeOptions(source_format)
+    if image.digest is not None and is_identity:
+        new_image.status = ImageStatusEnum.DONE
+        new_image.digest, new_image.size = image.digest, image.size
+        new_image.width, new_image.height = image.width, image.height
+        new_image.exif = image.exif
+    elif image.digest is not None and settings.EDIT_CACHE_MAX_BYTES:
+        result = await repository.get_edit_result(
+            session, image.digest, get_edit_key(operations, encoding)
+        )
+        if result is not None:
+            new_image.status = ImageStatusEnum.DONE
+            new_image.digest, new_image.size = result.digest, result.size
+            new_image.width, new_image.height = result.width, result.height
+    return new_image, encoding
+
+
+async def stream_image_events(
+    repository: IImageRepository,
+    session: AsyncSession,
+    broadcaster: StatusBroadcaster,
+    owner_id: UUID,
+    image_ids: list[UUID],
+) -> AsyncIterator[str]:
+    """Server-sent events with status changes of the owner's images.
+
+    The current status of ``image_ids`` is sent right after subscribing,
+    so a change that lands before the stream opens is not missed.
+    """
+    async with broadcaster.subscribe(owner_id) as queue:
+        if image_ids:
+            images = await repository.get_meta_many(session, image_ids)
+            # Do not hold a pooled connection for the life of the stream.
+            await session.close()
+            for image in images:
+                if image.owner_id != owner_id:
+                    continue
+                yield format_sse(
+                    ImageStatusEvent(image.id_, owner_id, image.status)
+                )
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(), settings.EVENTS_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream.
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+
+
+async def _render_inline(
+    file_repository: IImageFileRepository,
+    edit_pool: InlineEditPool,
+    image: Image,
+    new_image: Image,
+    operations: list[EditOperation],
+    encoding: EncodeOptions,
+) -> bool:
+    """Render a small edit in the request, False if it was not rendered.
+
+    Sources that can not be decoded mark ``new_image`` FAILED right away,
+    a queued job would only fail the same way.
+    """
+    if image.status != ImageStatusEnum.DONE:
+        return False
+    if await file_repository.get_size(image) > settings.INLINE_EDIT_MAX_BYTES:
+        return False
+    source = file_repository.get_local_path(image)
+    if source is None:
+        source = await file_repository.get(image)
+    try:
+        edited = await edit_pool.render(source, operations, encoding)
+    except (BrokenProcessPool, TimeoutError):
+        # The pool failed, not the edit, so the worker can still do it.
+        return False
+    except (OSError, SyntaxError, ValueError):
+        new_image.status = ImageStatusEnum.FAILED
+        return False
+    if edited is None:
+        return False
+    read_metadata(new_image, edited)
+    await file_repository.save_bytes(new_image, edited)
+    new_image.status = ImageStatusEnum.DONE
+    return True
+
+
 async def edit_image(
     repository: IImageRepository,
     session: AsyncSession,
-    id_: UUID,
+    image: Image,
     owner_id: UUID,
     new_title: str,
-    action: ImageEditActionEnum,
+    operations: list[EditOperation],
+    encoding: EncodeOptions | None = None,
+    edit_pool: InlineEditPool | None = None,
 ) -> Image:
-    new_image = Image(
-        title=new_title, owner_id=owner_id, status=ImageStatusEnum.PROCESSING
+    """Create the edited image, rendering it right away when it is small
+    and ``edit_pool`` has room, otherwise queueing it for the worker."""
+    if image.status == ImageStatusEnum.FAILED:
+        raise ImageProcessingFailedException()
+    operations = normalize_operations(operations)
+    new_image, encoding = await _plan_edit(
+        repository, session, image, owner_id, new_title, operations, encoding
     )
-    await repository.create_meta(session, new_image)
-    edit_image_task.delay(
-        orig_id=id_,
-        new_id=new_image.id_,
-        action=action,
+    rendered = (
+        new_image.status == ImageStatusEnum.PROCESSING
+        and edit_pool is not None
+        and await _render_inline(
+            repository.file_repository,
+            edit_pool,
+            image,
+            new_image,
+            operations,
+            encoding,
+        )
     )
+    await repository.create_meta(session, new_image)
+    if rendered:
+        if image.digest is not None and settings.EDIT_CACHE_MAX_BYTES:
+            result = EditResult(
+                source_digest=image.digest,
+                key=get_edit_key(operations, encoding),
+                digest=new_image.digest,
+                size=new_image.size,
+                width=new_image.width,
+                height=new_image.height,
+            )
+            await repository.put_edit_result(
+                session, result, settings.EDIT_CACHE_MAX_BYTES
+            )
+        await dispatch(
+            session, generate_variants_task, image_id=new_image.id_
+        )
+    elif new_image.status == ImageStatusEnum.PROCESSING:
+        await dispatch(
+            session,
+            edit_image_task,
+            orig_id=image.id_,
+            new_id=new_image.id_,
+            operations=dump_operations(operations),
+            encoding=asdict(encoding),
+        )
     return new_image
+
+
+async def edit_images(
+    repository: IImageRepository,
+    session: AsyncSession,
+    image_ids: list[UUID],
+    owner_id: UUID,
+    operations: list[EditOperation],
+    encoding: EncodeOptions | None = None,
+    new_title: str | None = None,
+) -> list[ImageBatchResult]:
+    """Apply one pipeline to several images, reporting failures per item.
+
+    Sources are loaded with one query, the new rows are inserted with one
+    bulk statement and every render is sent to the worker as one task.
+    """
+    operations = normalize_operations(operations)
+    sources = {
+        image.id_: image
+        for image in await repository.get_meta_many(session, image_ids)
+    }
+    results, new_images, pending = [], [], []
+    for index, image_id in enumerate(image_ids):
+        image = sources.get(image_id)
+        if image is None:
+            error = ImageNotFoundException(image_id)
+        elif image.owner_id != owner_id:
+            error = UserIsNotOwnerException()
+        elif image.status == ImageStatusEnum.PROCESSING:
+            error = ImageIsStillProcessingException()
+        elif image.status == ImageStatusEnum.FAILED:
+            error = ImageProcessingFailedException()
+        else:
+            error = None
+        if error is not None:
+            results.append(ImageBatchResult(index, error=error.message))
+            continue
+        try:
+            new_image, image_encoding = await _plan_edit(
+                repository,
+                session,
+                image,
+                owner_id,
+                new_title or image.title,
+                operations,
+                encoding,
+            )
+        except ImageTooManyPixelsException as e:
+            results.append(ImageBatchResult(index, error=e.message))
+            continue
+        new_images.append(new_image)
+        if new_image.status == ImageStatusEnum.PROCESSING:
+            pending.append(
+                {
+                    "orig_id": image.id_,
+                    "new_id": new_image.id_,
+                    "encoding": asdict(image_encoding),
+                }
+            )
+        results.append(ImageBatchResult(index, image_id=new_image.id_))
+    await repository.create_meta_many(session, new_images)
+    if pending:
+        await dispatch(
+            session,
+            edit_images_task,
+            items=pending,
+            operations=dump_operations(operations),
+        )
+    return results
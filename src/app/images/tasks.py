@@ -1,14 +1,147 @@
-import io
 import asyncio
+import time
+from collections.abc import Awaitable
+from contextlib import asynccontextmanager, contextmanager
+from datetime import UTC, datetime, timedelta
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
 from uuid import UUID
 
 import PIL.Image
 import PIL.ImageOps
 
 from app.common.celery_worker import celery
-from app.images.models import ImageEditActionEnum, ImageStatusEnum
-from app.images.deps import get_image_repository
-from app.db import scoped_session
+from app.common.metrics import task_stage_duration
+from app.common.queue import dispatch
+from app.common.worker_runtime import run
+from app.common.settings import settings
+from app.common.tracing import span
+from app.images.models import (
+    EditOperation,
+    EditResult,
+    EncodeOptions,
+    Image,
+    ImageEditActionEnum,
+    ImageFormatEnum,
+    ImageStatusEnum,
+)
+from app.images.pipeline import (
+    check_pipeline_pixels,
+    encode_image,
+    get_edit_key,
+    get_pixel_count,
+    get_resize_size,
+    get_transpose,
+    load_encoding,
+    load_operations,
+    normalize_operations,
+    open_image,
+    read_metadata,
+)
+from app.images.deps import get_image_repository, get_upload_repository
+from app.images.events import publish_status
+from app.images import jpeg, pixels
+from app.images.variants import (
+    get_oriented_size,
+    get_variant_formats,
+    get_variant_name,
+    render_variant,
+)
+from app.db import commit, scoped_session
+
+
+@contextmanager
+def _stage(name: str):
+    with span(name), task_stage_duration.labels(name).time():
+        yield
+
+
+def record_stages(timings: dict[str, float]) -> None:
+    for stage, seconds in timings.items():
+        task_stage_duration.labels(stage).observe(seconds)
+
+
+class PixelBudget:
+    """Admits renders while the pixels they decode fit in ``capacity``.
+
+    A render larger than the whole budget waits until it can run alone.
+    Reservations belong to the running event loop, a new loop starts
+    with an empty budget.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._used = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._condition: asyncio.Condition | None = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self._used = 0
+        return self._condition
+
+    @asynccontextmanager
+    async def reserve(self, pixels: int):
+        if not self.capacity:
+            yield
+            return
+        pixels = min(pixels, self.capacity)
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(
+                lambda: self._used + pixels <= self.capacity
+            )
+            self._used += pixels
+        try:
+            yield
+        finally:
+            async with condition:
+                self._used -= pixels
+                condition.notify_all()
+
+
+pixel_budget = PixelBudget(settings.WORKER_PIXEL_BUDGET)
+
+
+async def _read_source(file_repository, image: Image) -> bytes | Path:
+    """The path of a local file, which is decoded from disk, or its bytes."""
+    if (path := file_repository.get_local_path(image)) is not None:
+        return path
+    with _stage("read"):
+        return await file_repository.get(image)
+
+
+def _get_source_size(source: bytes | Path) -> tuple[int, int]:
+    with open_image(source) as image:
+        return get_oriented_size(image)
+
+
+async def _render(
+    executor: Executor | None,
+    source: bytes | Path,
+    operations: list[EditOperation],
+    encoding: EncodeOptions,
+) -> bytes:
+    """Render on ``executor``, recording the stages in this process.
+
+    The size is read from the header first and followed through the
+    pipeline, so a render with a step over IMAGE_MAX_PIXELS is rejected
+    and the rest wait for room in the worker's pixel budget for their
+    largest step before they are decoded.
+    """
+    size = await asyncio.to_thread(_get_source_size, source)
+    pixels = check_pipeline_pixels(size, operations)
+    async with pixel_budget.reserve(pixels):
+        with span("render"):
+            loop = asyncio.get_running_loop()
+            edited, timings = await loop.run_in_executor(
+                executor, _render_edit_timed, source, operations, encoding
+            )
+    record_stages(timings)
+    return edited
 
 
 @celery.task
@@ -16,51 +149,369 @@ def test_task(arg):
     print("in task", arg)
 
 
+async def _fail_on_error(
+    edit: Awaitable[None], image_ids: list[UUID]
+) -> None:
+    """Mark what ``edit`` left PROCESSING FAILED if it raises.
+
+    Celery does not retry a task, so its first failure is final.
+    """
+    try:
+        await edit
+    except BaseException:
+        await _fail_edits(image_ids)
+        raise
+
+
 @celery.task
 def edit_image_task(*args, **kwargs):
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(_edit_image(*args, **kwargs))
+    run(_fail_on_error(_edit_image(*args, **kwargs), [kwargs["new_id"]]))
 
 
 async def _edit_image(
     orig_id: UUID,
     new_id: UUID,
-    action: ImageEditActionEnum,
+    operations: list[dict] | None = None,
+    encoding: dict | None = None,
+    action: ImageEditActionEnum | None = None,
+    executor: Executor | None = None,
 ):
+    if action is not None:
+        # Messages queued before edit pipelines carried a single action.
+        operations = [{"action": action}]
+    operations = normalize_operations(load_operations(operations))
+    encoding = load_encoding(encoding)
     repository = await get_image_repository()
     async with scoped_session() as session:
         orig_image = await repository.get_meta(session, orig_id)
         new_image = await repository.get_meta(session, new_id)
+    if new_image is None or new_image.status != ImageStatusEnum.PROCESSING:
+        # Finished by an earlier attempt whose job was not deleted.
+        return
 
-    orig_image_bytes = await repository.file_repository.get(orig_image)
-    pil_image = PIL.Image.open(io.BytesIO(orig_image_bytes))
-    if action == ImageEditActionEnum.INVERT:
-        edited_image = _invert_image(pil_image)
-    else:
-        edited_image = _rotate_image(pil_image, 90)
-    imgByteArr = io.BytesIO()
-    edited_image.save(imgByteArr, format="PNG")
-    await repository.file_repository.save_bytes(
-        new_image, imgByteArr.getvalue()
-    )
+    source = await _read_source(repository.file_repository, orig_image)
+    edited_image_bytes = await _render(executor, source, operations, encoding)
+    read_metadata(new_image, edited_image_bytes)
+    with _stage("write"):
+        await repository.file_repository.save_bytes(
+            new_image, edited_image_bytes
+        )
+    async with scoped_session() as session:
+        await repository.update_status_many(
+            session, [new_image], ImageStatusEnum.DONE
+        )
+        if orig_image.digest is not None and settings.EDIT_CACHE_MAX_BYTES:
+            result = EditResult(
+                source_digest=orig_image.digest,
+                key=get_edit_key(operations, encoding),
+                digest=new_image.digest,
+                size=new_image.size,
+                width=new_image.width,
+                height=new_image.height,
+            )
+            await repository.put_edit_result(
+                session, result, settings.EDIT_CACHE_MAX_BYTES
+            )
+        await dispatch(session, generate_variants_task, image_id=new_id)
+        await commit(session)
+    new_image.status = ImageStatusEnum.DONE
+    await publish_status([new_image])
+
+
+@celery.task
+def edit_images_task(*args, **kwargs):
+    new_ids = [item["new_id"] for item in kwargs["items"]]
+    run(_fail_on_error(_edit_images(*args, **kwargs), new_ids))
+
+
+async def _edit_images(
+    items: list[dict],
+    operations: list[dict],
+    executor: Executor | None = None,
+):
+    """Render a batch of edits that share one pipeline.
+
+    Each item holds ``orig_id``, ``new_id`` and the ``encoding`` for that
+    source. Metadata is read with one query, renders run on ``executor``
+    or on EDIT_BATCH_WORKERS threads and finished rows are flipped to
+    DONE with one bulk update. Failed items are left PROCESSING and the
+    first error is raised once the rest of the batch is saved. Items
+    that are no longer PROCESSING are skipped, so a retry only renders
+    the ones that failed.
+    """
+    operations = normalize_operations(load_operations(operations))
+    repository = await get_image_repository()
+    file_repository = repository.file_repository
+    ids = [item["orig_id"] for item in items]
+    ids += [item["new_id"] for item in items]
+    async with scoped_session() as session:
+        images = {
+            image.id_: image
+            for image in await repository.get_meta_many(session, ids)
+        }
+    # Bounds the number of decoded images held in memory at once.
+    semaphore = asyncio.Semaphore(settings.EDIT_BATCH_WORKERS)
+
+    async def edit(item: dict) -> tuple[Image, Image, EncodeOptions] | None:
+        orig_image = images.get(UUID(str(item["orig_id"])))
+        new_image = images.get(UUID(str(item["new_id"])))
+        if orig_image is None or new_image is None:
+            return None
+        if new_image.status != ImageStatusEnum.PROCESSING:
+            return None
+        encoding = load_encoding(item["encoding"])
+        async with semaphore:
+            source = await _read_source(file_repository, orig_image)
+            edited_image_bytes = await _render(
+                executor, source, operations, encoding
+            )
+            read_metadata(new_image, edited_image_bytes)
+            with _stage("write"):
+                await file_repository.save_bytes(
+                    new_image, edited_image_bytes
+                )
+        return orig_image, new_image, encoding
+
+    own_executor = None
+    if executor is None:
+        executor = own_executor = ThreadPoolExecutor(
+            settings.EDIT_BATCH_WORKERS
+        )
+    try:
+        outcomes = await asyncio.gather(
+            *(edit(item) for item in items), return_exceptions=True
+        )
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+    edited = [o for o in outcomes if isinstance(o, tuple)]
+    new_images = [new_image for _, new_image, _ in edited]
     async with scoped_session() as session:
-        await repository.update_status(
-            session, id_=new_id, status=ImageStatusEnum.DONE
+        await repository.update_status_many(
+            session, new_images, ImageStatusEnum.DONE
         )
+        if settings.EDIT_CACHE_MAX_BYTES:
+            for orig_image, new_image, encoding in edited:
+                if orig_image.digest is None:
+                    continue
+                result = EditResult(
+                    source_digest=orig_image.digest,
+                    key=get_edit_key(operations, encoding),
+                    digest=new_image.digest,
+                    size=new_image.size,
+                    width=new_image.width,
+                    height=new_image.height,
+                )
+                await repository.put_edit_result(
+                    session, result, settings.EDIT_CACHE_MAX_BYTES
+                )
+        for new_image in new_images:
+            await dispatch(
+                session, generate_variants_task, image_id=new_image.id_
+            )
+        await commit(session)
+    for new_image in new_images:
+        new_image.status = ImageStatusEnum.DONE
+    await publish_status(new_images)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+
+@celery.task
+def generate_variants_task(*args, **kwargs):
+    run(_generate_variants(*args, **kwargs))
+
+
+async def _generate_variants(
+    image_id: UUID, executor: Executor | None = None
+):
+    repository = await get_image_repository()
+    async with scoped_session() as session:
+        image = await repository.get_meta(session, image_id)
+    if image is None or image.status != ImageStatusEnum.DONE:
+        return
+    source = pixels = None
+    file_repository = repository.file_repository
+    for format in get_variant_formats(image.content_type):
+        for width in settings.VARIANT_WIDTHS:
+            name = get_variant_name(width, format)
+            if await file_repository.has_variant(image, name):
+                continue
+            if source is None:
+                source = await _read_source(file_repository, image)
+                pixels = await asyncio.to_thread(get_pixel_count, source)
+            async with pixel_budget.reserve(pixels):
+                loop = asyncio.get_running_loop()
+                variant_bytes = await loop.run_in_executor(
+                    executor, render_variant, source, width, format
+                )
+            await file_repository.save_variant(image, name, variant_bytes)
+
+
+@celery.task
+def delete_stale_uploads_task(*args, **kwargs):
+    run(_delete_stale_uploads(*args, **kwargs))
+
+
+async def _fail_edits(image_ids: list[UUID]) -> None:
+    """Mark edits FAILED once their job has run out of attempts."""
+    # Ids from task kwargs arrive as strings.
+    image_ids = [UUID(str(id_)) for id_ in image_ids]
+    repository = await get_image_repository()
+    async with scoped_session() as session:
+        images = [
+            image
+            for image in await repository.get_meta_many(session, image_ids)
+            if image.status == ImageStatusEnum.PROCESSING
+        ]
+        await repository.update_status_many(
+            session, images, ImageStatusEnum.FAILED
+        )
+        await commit(session)
+    for image in images:
+        image.status = ImageStatusEnum.FAILED
+    await publish_status(images)
+
+
+async def _delete_stale_uploads() -> None:
+    repository = await get_upload_repository()
+    before = datetime.now(UTC) - timedelta(
+        seconds=settings.UPLOAD_EXPIRE_SECONDS
+    )
+    async with scoped_session() as session:
+        await repository.delete_stale(session, before)
+        await commit(session)
+
+
+class _StageTimer:
+    def __init__(self) -> None:
+        self.timings: dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.timings[stage] = now - self._last
+        self._last = now
+
+
+def _render_edit(
+    source: bytes | Path,
+    operations: list[EditOperation],
+    encoding: EncodeOptions,
+) -> bytes:
+    return _render_edit_timed(source, operations, encoding)[0]
+
+
+def _render_edit_timed(
+    source: bytes | Path,
+    operations: list[EditOperation],
+    encoding: EncodeOptions,
+) -> tuple[bytes, dict[str, float]]:
+    """Decode once, apply every operation in memory and encode once.
+
+    Also returns the seconds spent per stage, because a render in a
+    process pool can not update the caller's metrics.
+    """
+    timer = _StageTimer()
+    if (edited := _transpose_jpeg(source, operations, encoding)):
+        timer.lap("transform")
+        return edited, timer.timings
+    edited_image = open_image(source)
+    if (size := _get_draft_size(edited_image, operations)) is not None:
+        # JPEG decodes at 1/2, 1/4 or 1/8 scale when that still covers
+        # the size the image is resized to.
+        edited_image.draft(None, size)
+    edited_image.load()
+    timer.lap("decode")
+    PIL.ImageOps.exif_transpose(edited_image, in_place=True)
+    for operation in operations:
+        edited_image = _apply_operation(edited_image, operation)
+    timer.lap("transform")
+    edited = encode_image(edited_image, encoding)
+    timer.lap("encode")
+    return edited, timer.timings
+
+
+def _get_draft_size(
+    image: PIL.Image.Image, operations: list[EditOperation]
+) -> tuple[int, int] | None:
+    """The smallest size to decode at, when the pipeline starts with a
+    resize."""
+    if not operations or operations[0].action != ImageEditActionEnum.RESIZE:
+        return None
+    resize = operations[0]
+    # The resize applies after the EXIF orientation, which can swap the
+    # sides, so both sides have to cover the longer target side.
+    width, height = get_resize_size(
+        get_oriented_size(image), resize.width, resize.height
+    )
+    side = max(width, height)
+    return side, side
+
+
+def _transpose_jpeg(
+    source: bytes | Path,
+    operations: list[EditOperation],
+    encoding: EncodeOptions,
+) -> bytes | None:
+    """Rotate or flip a JPEG without decoding it, when that is possible."""
+    if (
+        settings.JPEG_TRANSPOSE_MODE == "pixel"
+        or len(operations) != 1
+        or encoding.format != ImageFormatEnum.JPEG
+        or encoding.quality is not None
+    ):
+        return None
+    method = get_transpose(operations[0])
+    if method is None:
+        return None
+    image_bytes = source if isinstance(source, bytes) else source.read_bytes()
+    if not jpeg.is_jpeg(image_bytes):
+        return None
+    if settings.JPEG_TRANSPOSE_MODE == "exif":
+        if (edited := jpeg.rotate_by_orientation(image_bytes, method)):
+            return edited
+    return jpeg.transpose_lossless(image_bytes, method)
+
+
+def _apply_operation(
+    image: PIL.Image.Image, operation: EditOperation
+) -> PIL.Image.Image:
+    if (method := get_transpose(operation)) is not None:
+        return image.transpose(method=method)
+    if operation.action == ImageEditActionEnum.INVERT:
+        return _invert_image(image)
+    if operation.action == ImageEditActionEnum.GRAYSCALE:
+        return _grayscale_image(image)
+    if operation.action == ImageEditActionEnum.CROP:
+        return image.crop(operation.box)
+    if operation.action == ImageEditActionEnum.RESIZE:
+        return _resize_image(image, operation.width, operation.height)
+    return image
 
 
 def _rotate_image(image: PIL.Image.Image, angle: int) -> PIL.Image.Image:
-    return image.transpose(method=PIL.Image.Transpose.ROTATE_90)
+    method = get_transpose(
+        EditOperation(ImageEditActionEnum.ROTATE, angle=angle)
+    )
+    if method is None:
+        return image
+    return image.transpose(method=method)
+
+
+def _grayscale_image(image: PIL.Image.Image) -> PIL.Image.Image:
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        return image.convert("LA")
+    return image.convert("L")
+
+
+def _resize_image(
+    image: PIL.Image.Image, width: int | None, height: int | None
+) -> PIL.Image.Image:
+    size = get_resize_size(image.size, width, height)
+    return image.resize(size, PIL.Image.Resampling.LANCZOS)
 
 
 def _invert_image(image: PIL.Image.Image) -> PIL.Image.Image:
-    if image.mode == "RGBA":
-        r, g, b, a = image.split()
-        rgb_image = PIL.Image.merge("RGB", (r, g, b))
-        inverted_image = PIL.ImageOps.invert(rgb_image)
-        r2, g2, b2 = inverted_image.split()
-        final_transparent_image = PIL.Image.merge("RGBA", (r2, g2, b2, a))
-        return final_transparent_image
-    else:
-        inverted_image = PIL.ImageOps.invert(image)
-        return inverted_image
+    return pixels.invert(image)
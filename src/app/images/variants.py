@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import PIL.Image
+import PIL.ImageOps
+
+from app.common.settings import settings
+from app.images.models import EncodeOptions, ImageFormatEnum
+from app.images.pipeline import (
+    SWAPPED_ORIENTATIONS,
+    encode_image,
+    open_image,
+)
+
+
+def get_variant_name(width: int | None, format: ImageFormatEnum) -> str:
+    return f"w{width}.{format}" if width else f"full.{format}"
+
+
+def pick_variant_width(width: int | None) -> int | None:
+    """Return the smallest configured width that is at least ``width``.
+
+    None means the original size: either no width was asked for or it is
+    larger than every precomputed variant.
+    """
+    if width is None:
+        return None
+    for variant_width in sorted(settings.VARIANT_WIDTHS):
+        if variant_width >= width:
+            return variant_width
+    return None
+
+
+def get_variant_formats(content_type: str | None) -> list[ImageFormatEnum]:
+    formats = [ImageFormatEnum(format) for format in settings.VARIANT_FORMATS]
+    source_format = ImageFormatEnum.from_content_type(content_type)
+    if source_format is not None and source_format not in formats:
+        formats.append(source_format)
+    return formats
+
+
+def get_oriented_size(image: PIL.Image.Image) -> tuple[int, int]:
+    """The size of ``image`` once its EXIF orientation is applied."""
+    width, height = image.size
+    if image.getexif().get(0x0112) in SWAPPED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def render_variant(
+    source: bytes | Path, width: int | None, format: ImageFormatEnum
+) -> bytes:
+    image = open_image(source)
+    if width is not None:
+        shown_width, shown_height = get_oriented_size(image)
+        height = max(round(shown_height * width / shown_width), 1)
+        size = (width, height)
+        if (shown_width, shown_height) != image.size:
+            size = (height, width)
+        # thumbnail() lets the JPEG decoder downscale while decoding.
+        image.thumbnail(size, PIL.Image.Resampling.LANCZOS)
+    PIL.ImageOps.exif_transpose(image, in_place=True)
+    return encode_image(image, EncodeOptions(format))
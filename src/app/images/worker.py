@@ -0,0 +1,214 @@
+"""Async job runner used instead of Celery when TASK_QUEUE="postgres".
+
+Start it with ``python -m app.images.worker``. One event loop drives up
+to JOB_WORKER_CONCURRENCY jobs at a time, so file and database I/O
+overlap, while decoding and encoding go to a pool of
+JOB_WORKER_PROCESSES processes.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from prometheus_client import start_http_server
+
+from app.common.metrics import task_queue_delay
+from app.common.queue import IJobQueue, Job, job_queue
+from app.common.settings import settings
+from app.common.tracing import setup_tracing, span
+from app.db import engine, scoped_session, warm_engine
+from app.images.exceptions import ImageTooManyPixelsException
+from app.images.s3 import close_client
+from app.images.tasks import (
+    _delete_stale_uploads,
+    _edit_image,
+    _edit_images,
+    _fail_edits,
+    _generate_variants,
+    edit_image_task,
+    edit_images_task,
+    generate_variants_task,
+)
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {
+    edit_image_task.name: _edit_image,
+    edit_images_task.name: _edit_images,
+    generate_variants_task.name: _generate_variants,
+}
+
+# The images a job leaves PROCESSING when it runs out of attempts.
+PENDING_IMAGES = {
+    edit_image_task.name: lambda kwargs: [kwargs["new_id"]],
+    edit_images_task.name: lambda kwargs: [
+        item["new_id"] for item in kwargs["items"]
+    ],
+}
+
+
+class RespawningExecutor(Executor):
+    """A process pool that is replaced once it breaks.
+
+    A process that dies, killed for running out of memory say, breaks
+    the whole pool and every later submit would fail.
+    """
+
+    def __init__(self, new_executor: Callable[[], Executor]) -> None:
+        self._new_executor = new_executor
+        self._executor = new_executor()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Jobs that fail together replace the pool only once.
+            if self._executor is executor:
+                logger.warning("Render processes died, starting new ones")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+async def _keep_locked(queue: IJobQueue, job: Job) -> None:
+    """Extend the job's lock while it runs, so no other worker claims it."""
+    while True:
+        await asyncio.sleep(settings.JOB_LOCK_SECONDS / 3)
+        try:
+            async with scoped_session() as session:
+                if not await queue.extend(session, job):
+                    logger.warning("Lost the claim on job %s", job.id_)
+                    return
+        except Exception:
+            logger.exception("Extending the lock of job %s failed", job.id_)
+
+
+async def _give_up(job: Job) -> None:
+    logger.error("Giving up on job %s: %s %s", job.id_, job.name, job.kwargs)
+    if job.name in PENDING_IMAGES:
+        await _fail_edits(PENDING_IMAGES[job.name](job.kwargs))
+
+
+async def run_job(queue: IJobQueue, job: Job, executor: Executor) -> None:
+    """Run a job and delete it.
+
+    Failed jobs are retried by a later claim. After JOB_MAX_ATTEMPTS, or
+    when the worker running the last attempt died, the job is deleted
+    and the images it was rendering are marked FAILED. So are those of
+    an image too large to render, which would fail every attempt. A job
+    whose render processes died is put back without counting the
+    attempt, since the death may well be another job's doing.
+    """
+    handler = HANDLERS[job.name]
+    if job.attempts > settings.JOB_MAX_ATTEMPTS:
+        await _give_up(job)
+        async with scoped_session() as session:
+            await queue.complete(session, job)
+        return
+    if job.enqueued_at is not None and job.attempts == 1:
+        task_queue_delay.labels(job.name).observe(
+            max(time.time() - job.enqueued_at.timestamp(), 0)
+        )
+    heartbeat = asyncio.create_task(_keep_locked(queue, job))
+    try:
+        with span(job.name, carrier=job.headers):
+            await handler(**job.kwargs, executor=executor)
+    except BrokenProcessPool:
+        logger.warning("Render processes died during job %s", job.id_)
+        async with scoped_session() as session:
+            await queue.release(session, job)
+        return
+    except ImageTooManyPixelsException as e:
+        logger.error("Job %s failed: %s", job.id_, e.message)
+        await _give_up(job)
+    except Exception:
+        logger.exception("Job %s failed (attempt %s)", job.id_, job.attempts)
+        if job.attempts < settings.JOB_MAX_ATTEMPTS:
+            return
+        await _give_up(job)
+    finally:
+        heartbeat.cancel()
+    async with scoped_session() as session:
+        await queue.complete(session, job)
+
+
+async def run_worker(
+    queue: IJobQueue,
+    executor: Executor,
+    concurrency: int,
+    stop: asyncio.Event,
+) -> None:
+    running: set[asyncio.Task] = set()
+    while not stop.is_set():
+        if len(running) >= concurrency:
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        async with scoped_session() as session:
+            jobs = await queue.claim(session, concurrency - len(running))
+        if not jobs:
+            try:
+                await asyncio.wait_for(
+                    stop.wait(), settings.JOB_POLL_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            continue
+        for job in jobs:
+            task = asyncio.create_task(run_job(queue, job, executor))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    if running:
+        await asyncio.wait(running)
+
+
+async def collect_uploads(stop: asyncio.Event) -> None:
+    """Delete stale uploads, which Celery beat does in the other mode."""
+    while not stop.is_set():
+        try:
+            await _delete_stale_uploads()
+        except Exception:
+            logger.exception("Deleting stale uploads failed")
+        try:
+            await asyncio.wait_for(stop.wait(), settings.UPLOAD_GC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    concurrency = settings.JOB_WORKER_CONCURRENCY
+    setup_tracing("worker")
+    if settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT)
+    await warm_engine(min(concurrency, settings.DB_POOL_SIZE))
+    processes = settings.JOB_WORKER_PROCESSES or os.cpu_count()
+    try:
+        # Forking a process that runs an event loop and threads is unsafe.
+        with RespawningExecutor(
+            lambda: ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        ) as executor:
+            collector = asyncio.create_task(collect_uploads(stop))
+            await run_worker(job_queue, executor, concurrency, stop)
+            await collector
+    finally:
+        await close_client()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""Run the benchmarks or compare two reports.
+
+    python -m benchmarks run [--suite micro|load|all] [--quick]
+        [--output report.json] [--baseline benchmarks/baseline.json]
+    python -m benchmarks compare baseline.json report.json
+
+Both commands exit with status 1 when a metric is more than
+``--tolerance`` worse than in the baseline.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.report import (
+    compare,
+    format_report,
+    load_report,
+    new_report,
+    save_report,
+)
+
+# Settings are read from the environment on import, so these are set
+# before anything from the app is imported.
+_ENVIRONMENT = {
+    "SECRET": "benchmark",
+    "ACCESS_TOKEN_EXPIRE_SECONDS": "3600",
+    "MAX_FILE_SIZE_MB": "50",
+    "CELERY_BROKER_URI": "memory://",
+    "CELERY_RESULT_BACKEND": "cache+memory://",
+    "SMTP_HOST": "",
+    "SMTP_PORT": "587",
+    "SMTP_USER": "",
+    "SMTP_PASSWORD": "",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_USER": "benchmark",
+    "DB_PASSWORD": "benchmark",
+    "DB_NAME": "benchmark",
+    "TASK_QUEUE": "postgres",
+    "IMAGE_STORAGE_BACKEND": "local",
+    "USER_CACHE_MODE": "off",
+    "IMAGE_CACHE_MODE": "memory",
+    "WORKER_METRICS_PORT": "0",
+}
+
+
+def _configure(directory: Path) -> None:
+    for name, value in _ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.environ["IMAGE_DIR_PATH"] = str(directory / "images")
+    (directory / "images").mkdir()
+
+
+def _finish(report: dict, args: argparse.Namespace) -> int:
+    baseline = load_report(args.baseline) if args.baseline else None
+    print(format_report(report, baseline))
+    if baseline is None:
+        return 0
+    regressions = compare(baseline, report, args.tolerance)
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression.name}: {regression.baseline:.6g}"
+            f" -> {regression.current:.6g} ({regression.ratio:.2f}x)",
+            file=sys.stderr,
+        )
+    return 1 if regressions else 0
+
+
+def run(args: argparse.Namespace) -> int:
+    metrics, info = {}, {}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        _configure(directory)
+        if args.suite in ("micro", "all"):
+            from benchmarks import micro
+
+            metrics.update(micro.run(quick=args.quick))
+        if args.suite in ("load", "all"):
+            from benchmarks import load
+
+            load_metrics, load_info = asyncio.run(
+                load.run(directory, args.requests, args.concurrency)
+            )
+            metrics.update(load_metrics)
+            info.update(load_info)
+    report = new_report(metrics, info)
+    if args.output:
+        save_report(report, args.output)
+    status = _finish(report, args)
+    if any(v for k, v in info.items() if k.endswith(".errors")):
+        print("Some requests failed, see the errors above", file=sys.stderr)
+        status = 1
+    return status
+
+
+def compare_reports(args: argparse.Namespace) -> int:
+    return _finish(load_report(args.report), args)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument(
+        "--suite", choices=("micro", "load", "all"), default="all"
+    )
+    run_parser.add_argument(
+        "--quick", action="store_true", help="skip the largest images"
+    )
+    run_parser.add_argument("--requests", type=int, default=200)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--output", type=Path)
+    run_parser.add_argument("--baseline", type=Path)
+    run_parser.set_defaults(handler=run)
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("report", type=Path)
+    compare_parser.set_defaults(handler=compare_reports)
+    for subparser in (run_parser, compare_parser):
+        subparser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="allowed slowdown before failing, 0.25 is 25%%",
+        )
+    args = parser.parse_args()
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Load scenarios that drive the API in-process over ASGI.
+
+The app runs against a SQLite file through aiosqlite and queues jobs in
+memory, so no Postgres, Redis or broker is needed. Jobs queued by the
+requests of a scenario are run by the job worker's ``run_job`` once the
+scenario ends.
+"""
+import asyncio
+import io
+import itertools
+import json
+import time
+from asyncio import current_task
+from collections import deque
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from functools import partial
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+from kombu.utils.json import dumps, loads
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_scoped_session,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+import app.db
+import app.common.queue
+import app.images.tasks
+from app.app import app as api
+from app.auth.manager import current_active_verified_user
+from app.common.queue import Job
+from app.common.settings import settings
+from app.images.inline import InlineEditPool
+from app.images.worker import run_job
+from app.users.models import User
+from benchmarks.micro import make_image
+from benchmarks.report import get_peak_rss_mb, get_rss_mb, percentile
+
+
+class MemoryJobQueue:
+    """Holds jobs in memory instead of the job table."""
+
+    def __init__(self) -> None:
+        self._jobs: deque[Job] = deque()
+        self._ids = itertools.count(1)
+
+    async def enqueue(
+        self, session: AsyncSession, name: str, kwargs: dict[str, Any]
+    ) -> None:
+        job = Job(
+            id_=next(self._ids),
+            name=name,
+            kwargs=loads(dumps(kwargs)),
+            attempts=1,
+            enqueued_at=datetime.now(UTC),
+        )
+        # Like a job row, the job is only visible once the request commits.
+        app.db.after_commit(session, partial(self._jobs.append, job))
+
+    async def claim(self, session: AsyncSession, limit: int) -> list[Job]:
+        return [self._jobs.popleft() for _ in range(min(limit, len(self)))]
+
+    async def extend(self, session: AsyncSession, job: Job) -> bool:
+        return True
+
+    async def complete(self, session: AsyncSession, job: Job) -> None:
+        pass
+
+    async def release(self, session: AsyncSession, job: Job) -> None:
+        self._jobs.append(job)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
+async def request(
+    method: str,
+    path: str,
+    query: str = "",
+    body: bytes = b"",
+    content_type: str | None = None,
+) -> tuple[int, bytes]:
+    """Send one request to the app and return the status and body."""
+    headers = [
+        (b"host", b"bench"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    if content_type is not None:
+        headers.append((b"content-type", content_type.encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    response_done = asyncio.Event()
+    body_sent = False
+    status = 500
+    chunks = []
+
+    async def receive() -> dict:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_done.set()
+
+    await api(scope, receive, send)
+    response_done.set()
+    return status, b"".join(chunks)
+
+
+async def drive(
+    name: str,
+    count: int,
+    concurrency: int,
+    send: Callable[[int], Awaitable[int]],
+) -> tuple[dict[str, float], dict]:
+    """Call ``send`` ``count`` times from ``concurrency`` clients.
+
+    ``send`` gets the request number and returns the response status.
+    A first round of ``concurrency`` calls is not timed, it starts the
+    edit processes and fills the caches.
+    """
+    await asyncio.gather(*(send(number) for number in range(concurrency)))
+    latencies = []
+    errors = 0
+    numbers = iter(range(count))
+
+    async def client() -> None:
+        nonlocal errors
+        for number in numbers:
+            start = time.perf_counter()
+            status = await send(number)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    metrics = {
+        f"load.{name}.p{q}": percentile(latencies, q) for q in (50, 95, 99)
+    }
+    info = {
+        f"load.{name}.requests_per_second": round(count / elapsed, 1),
+        f"load.{name}.errors": errors,
+        f"load.{name}.rss_mb": round(get_rss_mb(), 1),
+    }
+    return metrics, info
+
+
+async def drain(queue: MemoryJobQueue, executor) -> tuple[int, float]:
+    """Run queued jobs, and the jobs they queue, until none are left."""
+    jobs_run = 0
+    start = time.perf_counter()
+    while len(queue):
+        jobs = await queue.claim(None, settings.JOB_WORKER_CONCURRENCY)
+        await asyncio.gather(*(run_job(queue, job, executor) for job in jobs))
+        jobs_run += len(jobs)
+    return jobs_run, time.perf_counter() - start
+
+
+def _use_sqlite(directory: Path) -> None:
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{directory / 'bench.db'}",
+        connect_args={"timeout": 30},
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(connection, record):
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    app.db.engine = engine
+    app.db.async_session_maker = session_maker
+    app.db.scoped_factory = async_scoped_session(
+        session_maker, scopefunc=current_task
+    )
+
+
+async def _noop(*args, **kwargs) -> None:
+    pass
+
+
+async def _create_user() -> User:
+    user = User(
+        id=uuid4(),
+        email="bench@example.com",
+        username="bench",
+        hashed_password="-",
+        is_active=True,
+        is_verified=True,
+    )
+    async with app.db.async_session_maker() as session:
+        session.add(user)
+        await session.commit()
+    return user
+
+
+def _encode_png(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def run(
+    directory: Path, requests: int = 200, concurrency: int = 16
+) -> tuple[dict[str, float], dict]:
+    try:
+        import aiosqlite  # noqa: F401
+    except ImportError:
+        raise SystemExit(
+            "The load scenarios need aiosqlite from the dev dependencies:"
+            " poetry install"
+        )
+    _use_sqlite(directory)
+    await app.db.create_db_and_tables()
+    queue = MemoryJobQueue()
+    app.common.queue.job_queue = queue
+    # Status events go to Redis, which the benchmarks do without.
+    app.images.tasks.publish_status = _noop
+    user = await _create_user()
+    api.dependency_overrides[current_active_verified_user] = lambda: user
+    api.state.broadcaster = None
+    api.state.edit_pool = None
+    if settings.INLINE_EDIT_MAX_BYTES:
+        api.state.edit_pool = InlineEditPool.from_settings()
+    image_bytes = _encode_png(make_image((1024, 768), "RGB"))
+    image_ids = []
+    metrics, info = {}, {}
+
+    async def upload(number: int) -> int:
+        status, body = await request(
+            "POST",
+            "/api/me/image/raw",
+            query=f"title=bench-{number}",
+            body=image_bytes,
+        )
+        if status == 200:
+            image_ids.append(json.loads(body)["image_id"])
+        return status
+
+    async def download(number: int) -> int:
+        image_id = image_ids[number % len(image_ids)]
+        status, _ = await request("GET", f"/api/me/image/{image_id}")
+        return status
+
+    async def list_images(number: int) -> int:
+        status, _ = await request("GET", "/api/me/images", query="limit=50")
+        return status
+
+    async def edit(number: int) -> int:
+        image_id = image_ids[number % len(image_ids)]
+        pipeline = {"title": "edited", "operations": [{"action": "invert"}]}
+        status, _ = await request(
+            "POST",
+            f"/api/me/image/{image_id}/edit",
+            body=json.dumps(pipeline).encode(),
+            content_type="application/json",
+        )
+        return status
+
+    scenarios = {
+        "upload": upload,
+        "download": download,
+        "list": list_images,
+        "edit": edit,
+    }
+    jobs_run, jobs_seconds = 0, 0.0
+    executor = ThreadPoolExecutor(settings.EDIT_BATCH_WORKERS)
+    try:
+        for name, send in scenarios.items():
+            scenario_metrics, scenario_info = await drive(
+                name, requests, concurrency, send
+            )
+            metrics.update(scenario_metrics)
+            info.update(scenario_info)
+            drained, seconds = await drain(queue, executor)
+            jobs_run += drained
+            jobs_seconds += seconds
+    finally:
+        executor.shutdown()
+        if api.state.edit_pool is not None:
+            api.state.edit_pool.shutdown()
+        api.dependency_overrides.clear()
+        await app.db.engine.dispose()
+    if jobs_run:
+        metrics["load.jobs.wall_per_job"] = jobs_seconds / jobs_run
+    info["load.jobs.run"] = jobs_run
+    metrics["load.peak_rss_mb"] = get_peak_rss_mb()
+    return metrics, info
@@ -0,0 +1,79 @@
+"""Micro-benchmarks of the pixel operations and the encoders."""
+import time
+from collections.abc import Callable
+from functools import partial
+
+import PIL.Image
+
+from app.images.models import EncodeOptions, ImageFormatEnum
+from app.images.pipeline import encode_image
+from app.images.tasks import _invert_image, _rotate_image
+
+SIZES = ((256, 256), (1024, 768), (2048, 1536))
+QUICK_SIZES = SIZES[:2]
+MODES = ("L", "RGB", "RGBA")
+ENCODINGS = {
+    "png1": EncodeOptions(ImageFormatEnum.PNG, compress_level=1),
+    "png6": EncodeOptions(ImageFormatEnum.PNG, compress_level=6),
+    "jpeg75": EncodeOptions(ImageFormatEnum.JPEG, quality=75),
+    "jpeg90": EncodeOptions(ImageFormatEnum.JPEG, quality=90),
+    "webp80": EncodeOptions(ImageFormatEnum.WEBP, quality=80),
+}
+
+
+def make_image(size: tuple[int, int], mode: str) -> PIL.Image.Image:
+    """A deterministic image with enough detail to keep encoders busy."""
+    detail = PIL.Image.effect_mandelbrot(size, (-2.0, -1.2, 0.8, 1.2), 64)
+    across = PIL.Image.linear_gradient("L").resize(size)
+    down = (
+        PIL.Image.linear_gradient("L")
+        .transpose(PIL.Image.Transpose.ROTATE_90)
+        .resize(size)
+    )
+    alpha = across.transpose(PIL.Image.Transpose.FLIP_LEFT_RIGHT)
+    bands = (detail, across, down, alpha)
+    return PIL.Image.merge(mode, bands[:len(mode)])
+
+
+def _time(func: Callable[[], object], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def measure(
+    func: Callable[[], object], repeat: int = 5, min_run: float = 0.05
+) -> float:
+    """Best seconds per call over ``repeat`` runs.
+
+    Each run loops long enough to last ``min_run`` seconds, so timer
+    resolution does not matter for fast operations.
+    """
+    number = 1
+    while (elapsed := _time(func, number)) < min_run:
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        best = min(best, _time(func, number) / number)
+    return best
+
+
+def run(quick: bool = False) -> dict[str, float]:
+    metrics = {}
+    for width, height in QUICK_SIZES if quick else SIZES:
+        for mode in MODES:
+            image = make_image((width, height), mode)
+            label = f"{mode}.{width}x{height}"
+            metrics[f"micro.invert.{label}"] = measure(
+                partial(_invert_image, image)
+            )
+            for angle in (90, 180):
+                metrics[f"micro.rotate{angle}.{label}"] = measure(
+                    partial(_rotate_image, image, angle)
+                )
+            for name, encoding in ENCODINGS.items():
+                metrics[f"micro.encode_{name}.{label}"] = measure(
+                    partial(encode_image, image, encoding)
+                )
+    return metrics
@@ -0,0 +1,116 @@
+"""Percentiles, memory use and the JSON reports runs are compared by."""
+import json
+import math
+import os
+import platform
+import resource
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+import PIL
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """Nearest-rank percentile of ``samples``, ``q`` from 0 to 100."""
+    if not samples:
+        raise ValueError("No samples")
+    ordered = sorted(samples)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def get_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def get_rss_mb() -> float:
+    """Current resident set size, or the peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_mb()
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def new_report(metrics: dict[str, float], info: dict) -> dict:
+    """A report of ``metrics``, all costs where lower is better.
+
+    ``info`` holds figures that are printed but never compared, like
+    throughput and error counts.
+    """
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "metrics": metrics,
+        "info": info,
+    }
+
+
+def load_report(path: Path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report: dict, path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline
+
+
+def compare(
+    baseline: dict, current: dict, tolerance: float
+) -> list[Regression]:
+    """Metrics more than ``tolerance`` worse than in ``baseline``.
+
+    Metrics missing from either report are skipped, so a quick run can
+    be compared to a full baseline.
+    """
+    regressions = []
+    for name, value in sorted(current["metrics"].items()):
+        old = baseline["metrics"].get(name)
+        if not old or old <= 0:
+            continue
+        if value > old * (1 + tolerance):
+            regressions.append(Regression(name, old, value))
+    return regressions
+
+
+def format_report(report: dict, baseline: dict | None = None) -> str:
+    lines = []
+    old_metrics = baseline["metrics"] if baseline is not None else {}
+    width = max(map(len, report["metrics"]), default=0)
+    for name, value in sorted(report["metrics"].items()):
+        line = f"{name:<{width}}  {_format_value(name, value)}"
+        if old := old_metrics.get(name):
+            line += f"  ({value / old - 1:+.1%})"
+        lines.append(line)
+    for name, value in sorted(report["info"].items()):
+        lines.append(f"{name:<{width}}  {value}")
+    return "\n".join(lines)
+
+
+def _format_value(name: str, value: float) -> str:
+    if name.endswith("_mb"):
+        return f"{value:.1f} MB"
+    if value < 1:
+        return f"{value * 1000:.3f} ms"
+    return f"{value:.3f} s"
@@ -1,24 +1,69 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from pathlib import Path
 from uuid import UUID
 
 import pytest
 
-from app.images.models import Image
+from app.images.models import EditResult, Image, ImageUpload
 
 
 @dataclass
 class FakeImageFileRepository:
     _storage: dict[UUID, bytes] = field(default_factory=dict)
+    _variants: dict[tuple[UUID, str], bytes] = field(default_factory=dict)
+    _uploads: dict[UUID, bytearray] = field(default_factory=dict)
 
     async def save(self, image: Image, image_file):
-        self._storage[image.id_] = image_file.read()
+        self._storage[image.id_] = await image_file.read()
 
     async def save_bytes(self, image: Image, image_bytes: bytes):
         self._storage[image.id_] = image_bytes
 
+    async def save_stream(self, image: Image, chunks):
+        self._storage[image.id_] = b''.join([c async for c in chunks])
+
     async def get(self, image: Image) -> bytes:
         return self._storage[image.id_]
 
+    async def get_size(self, image: Image) -> int:
+        return len(self._storage[image.id_])
+
+    def get_path(self, image: Image) -> Path:
+        return Path(str(image.id_))
+
+    def get_local_path(self, image: Image):
+        return None
+
+    async def get_download_url(self, path: Path, media_type: str):
+        return None
+
+    def get_variant_path(self, image: Image, name: str) -> Path:
+        return Path(f'{image.id_}.{name}')
+
+    async def has_variant(self, image: Image, name: str) -> bool:
+        return (image.id_, name) in self._variants
+
+    async def save_variant(self, image: Image, name: str, image_bytes):
+        self._variants[(image.id_, name)] = image_bytes
+
+    async def create_upload(self, upload: ImageUpload):
+        self._uploads[upload.id_] = bytearray(upload.length)
+
+    async def write_upload(self, upload_id: UUID, offset: int, chunks):
+        data = b''.join([c async for c in chunks])
+        self._uploads[upload_id][offset:offset + len(data)] = data
+        return len(data)
+
+    async def read_upload(self, upload_id: UUID, size: int) -> bytes:
+        return bytes(self._uploads[upload_id][:size])
+
+    async def finalize_upload(self, upload_id: UUID, image: Image):
+        self._storage[image.id_] = bytes(self._uploads.pop(upload_id))
+        image.size = len(self._storage[image.id_])
+
+    async def delete_upload(self, upload_id: UUID):
+        self._uploads.pop(upload_id, None)
+
 
 @dataclass
 class FakeImageRepository:
@@ -26,28 +71,132 @@ class FakeImageRepository:
     file_repository: FakeImageFileRepository = field(
         default_factory=FakeImageFileRepository
     )
+    _edit_results: dict[tuple[str, str], EditResult] = field(
+        default_factory=dict
+    )
 
     async def get_meta(self, session, id_):
         return self._storage.get(id_)
 
+    async def get_meta_many(self, session, ids):
+        return [self._storage[id_] for id_ in ids if id_ in self._storage]
+
     async def create_meta(self, session, image):
         self._storage[image.id_] = image
 
+    async def create_meta_many(self, session, images):
+        for image in images:
+            self._storage[image.id_] = image
+
+    async def get_meta_list(
+        self, session, owner_id, limit=None, after=None, filters=None
+    ):
+        images = sorted(
+            (i for i in self._storage.values() if i.owner_id == owner_id),
+            key=lambda i: (i.created_at, i.id_),
+            reverse=True,
+        )
+        if after is not None:
+            images = [
+                i for i in images
+                if (i.created_at, i.id_) < (after.created_at, after.id_)
+            ]
+        if filters is not None and filters.status is not None:
+            images = [i for i in images if i.status == filters.status]
+        return images[:limit]
+
+    async def update_status(
+        self, session, id_, status, digest=None, size=None
+    ):
+        self._storage[id_].status = status
+
+    async def update_status_many(self, session, images, status):
+        for image in images:
+            image.status = status
+            self._storage[image.id_] = image
+
+    async def get_edit_result(self, session, source_digest, key):
+        return self._edit_results.get((source_digest, key))
+
+    async def put_edit_result(self, session, result, max_bytes):
+        self._edit_results[(result.source_digest, result.key)] = result
+
+
+@dataclass
+class FakeUploadRepository:
+    file_repository: FakeImageFileRepository
+    _storage: dict[UUID, ImageUpload] = field(default_factory=dict)
+
+    async def create(self, session, upload):
+        self._storage[upload.id_] = replace(upload)
+
+    async def get(self, session, id_):
+        upload = self._storage.get(id_)
+        return None if upload is None else replace(upload)
+
+    async def advance(self, session, id_, offset, written):
+        upload = self._storage[id_]
+        if upload.offset != offset:
+            return False
+        upload.offset += written
+        return True
+
+    async def delete(self, session, id_):
+        del self._storage[id_]
+
+    async def delete_stale(self, session, before):
+        ids = [
+            id_ for id_, upload in self._storage.items()
+            if upload.updated_at < before
+        ]
+        for id_ in ids:
+            del self._storage[id_]
+            await self.file_repository.delete_upload(id_)
+        return ids
+
 
 @dataclass
 class FakeImageFile:
     _bytes: bytes
     size: int
     content_type: str
-    
-    def read(self):
-        return self._bytes
+    _position: int = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        end = len(self._bytes) if size < 0 else self._position + size
+        chunk = self._bytes[self._position:end]
+        self._position += len(chunk)
+        return chunk
 
+    async def seek(self, offset: int) -> None:
+        self._position = offset
 
+
+@dataclass
 class FakeSession:
-    pass
+    info: dict = field(default_factory=dict)
+    commits: int = 0
+
+    async def commit(self):
+        self.commits += 1
+
+    async def close(self):
+        pass
+
+
+@dataclass
+class FakeTask:
+    calls: list[dict] = field(default_factory=list)
+
+    def delay(self, **kwargs):
+        self.calls.append(kwargs)
 
 
 @pytest.fixture
 def image_repository():
     return FakeImageRepository()
+
+
+@pytest.fixture
+def upload_repository(image_repository):
+    return FakeUploadRepository(image_repository.file_repository)
@@ -0,0 +1,53 @@
+from uuid import uuid4
+
+import pytest
+from fastapi_users.db import SQLAlchemyUserDatabase
+from sqlalchemy import inspect
+
+from app.auth.manager import CachedUserDatabase
+from app.common.cache import MemoryCache
+from app.users.models import User
+from tests.conftest import FakeSession
+
+
+@pytest.mark.asyncio
+async def test_cached_user_database(monkeypatch):
+    user = User(
+        id=uuid4(),
+        email='user@example.com',
+        username='user',
+        hashed_password='hash',
+        is_active=True,
+        is_superuser=False,
+        is_verified=True,
+    )
+    calls = []
+
+    async def get(self, id):
+        calls.append(id)
+        return user
+
+    async def update(self, user, update_dict):
+        for key, value in update_dict.items():
+            setattr(user, key, value)
+        return user
+
+    monkeypatch.setattr(SQLAlchemyUserDatabase, 'get', get)
+    monkeypatch.setattr(SQLAlchemyUserDatabase, 'update', update)
+    user_db = CachedUserDatabase(FakeSession(), MemoryCache(60, 10))
+
+    assert await user_db.get(user.id) is user
+    cached_user = await user_db.get(user.id)
+    assert calls == [user.id]
+    assert cached_user is not user
+    assert cached_user.email == user.email
+    assert inspect(cached_user).detached
+    assert 'hashed_password' in inspect(cached_user).unloaded
+
+    await user_db.update(user, {'is_active': False})
+    assert (await user_db.get(user.id)).is_active is False
+    assert calls == [user.id, user.id]
+
+    user_db.use_cache = False
+    assert await user_db.get(user.id) is user
+    assert calls == [user.id, user.id, user.id]
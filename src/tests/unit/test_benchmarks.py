@@ -0,0 +1,31 @@
+import pytest
+
+from benchmarks.report import compare, new_report, percentile
+
+
+def test_percentile():
+    samples = [float(n) for n in range(100, 0, -1)]
+
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 95) == 95.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile(samples, 100) == 100.0
+    assert percentile([0.5], 99) == 0.5
+    with pytest.raises(ValueError):
+        percentile([], 50)
+
+
+def test_compare_reports():
+    baseline = new_report(
+        {'invert': 1.0, 'encode': 2.0, 'removed': 1.0, 'zero': 0.0}, {}
+    )
+    current = new_report(
+        {'invert': 1.2, 'encode': 2.6, 'added': 5.0, 'zero': 1.0},
+        {'load.list.errors': 0},
+    )
+
+    regressions = compare(baseline, current, tolerance=0.25)
+
+    assert [r.name for r in regressions] == ['encode']
+    assert regressions[0].ratio == pytest.approx(1.3)
+    assert compare(baseline, current, tolerance=0.5) == []
@@ -0,0 +1,28 @@
+import pytest
+
+from app.common import cache
+from app.common.cache import MemoryCache
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_expires(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now)
+    memory_cache = MemoryCache(ttl=10, max_size=10)
+    await memory_cache.set('a', 1)
+    assert await memory_cache.get('a') == 1
+    now = 110.0
+    assert await memory_cache.get('a') is None
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_evicts_least_recently_used():
+    memory_cache = MemoryCache(ttl=10, max_size=2)
+    await memory_cache.set('a', 1)
+    await memory_cache.set('b', 2)
+    await memory_cache.get('a')
+    await memory_cache.set('c', 3)
+    assert await memory_cache.get('a') == 1
+    assert await memory_cache.get('b') is None
+    await memory_cache.delete('a')
+    assert await memory_cache.get('a') is None
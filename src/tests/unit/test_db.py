@@ -0,0 +1,22 @@
+import pytest
+
+from app.db import after_commit, commit
+from tests.conftest import FakeSession
+
+
+@pytest.mark.asyncio
+async def test_after_commit():
+    session = FakeSession()
+    calls = []
+
+    async def send():
+        calls.append(('async', session.commits))
+
+    after_commit(session, lambda: calls.append(('sync', session.commits)))
+    after_commit(session, send)
+    assert calls == []
+
+    await commit(session)
+    assert calls == [('sync', 1), ('async', 1)]
+    await commit(session)
+    assert len(calls) == 2
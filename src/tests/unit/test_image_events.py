@@ -0,0 +1,90 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+import redis.asyncio as redis
+
+from app.images import events
+from app.images.events import (
+    StatusBroadcaster,
+    dump_event,
+    format_sse,
+    load_event,
+)
+from app.images.models import ImageStatusEnum, ImageStatusEvent
+
+
+def test_dump_load_event():
+    event = ImageStatusEvent(uuid4(), uuid4(), ImageStatusEnum.DONE)
+    assert load_event(dump_event(event)) == event
+    assert load_event(dump_event(event).encode()) == event
+
+
+def test_format_sse():
+    event = ImageStatusEvent(uuid4(), uuid4(), ImageStatusEnum.DONE)
+    assert format_sse(event) == (
+        'event: status\n'
+        f'data: {{"id": "{event.image_id}", "status": "done"}}\n\n'
+    )
+
+
+@pytest.mark.asyncio
+async def test_broadcaster():
+    broadcaster = StatusBroadcaster(max_queued=1)
+    owner_id = uuid4()
+    event = ImageStatusEvent(uuid4(), owner_id, ImageStatusEnum.DONE)
+    other_event = ImageStatusEvent(uuid4(), uuid4(), ImageStatusEnum.DONE)
+
+    async with broadcaster.subscribe(owner_id) as first:
+        async with broadcaster.subscribe(owner_id) as second:
+            broadcaster.deliver(event)
+            broadcaster.deliver(other_event)
+            broadcaster.deliver(event)
+            assert first.qsize() == second.qsize() == 1
+            assert first.get_nowait() == second.get_nowait() == event
+        broadcaster.deliver(event)
+        assert first.get_nowait() == event
+    assert broadcaster._subscribers == {}
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_run_survives_errors(monkeypatch):
+    broadcaster = StatusBroadcaster(max_queued=10)
+    owner_id = uuid4()
+    event = ImageStatusEvent(uuid4(), owner_id, ImageStatusEnum.DONE)
+    messages = [
+        redis.TimeoutError(),
+        {'data': b'not json'},
+        {'data': b'{"image_id": "x"}'},
+        {'data': dump_event(event)},
+    ]
+
+    class FakePubSub:
+        async def subscribe(self, channel):
+            pass
+
+        async def listen(self):
+            while messages:
+                message = messages.pop(0)
+                if isinstance(message, Exception):
+                    raise message
+                yield message
+            await asyncio.Event().wait()
+
+        async def aclose(self):
+            pass
+
+    class FakeClient:
+        def pubsub(self, ignore_subscribe_messages):
+            return FakePubSub()
+
+    monkeypatch.setattr(events, '_get_client', FakeClient)
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, 'sleep', lambda seconds: sleep(0))
+
+    async with broadcaster.subscribe(owner_id) as queue:
+        task = asyncio.create_task(broadcaster.run())
+        try:
+            assert await asyncio.wait_for(queue.get(), 1) == event
+        finally:
+            task.cancel()
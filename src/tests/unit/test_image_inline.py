@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.images.inline import InlineEditPool
+from app.images.models import EncodeOptions
+
+
+class BrokenExecutor(Executor):
+    def submit(self, fn, /, *args, **kwargs):
+        raise BrokenProcessPool()
+
+
+@pytest.mark.asyncio
+async def test_render_replaces_broken_executor(monkeypatch):
+    monkeypatch.setattr(
+        'app.images.inline._render_edit_timed',
+        lambda source, operations, encoding: (source, {}),
+    )
+    executors = []
+
+    def new_executor():
+        executors.append(ThreadPoolExecutor(1))
+        return executors[-1]
+
+    pool = InlineEditPool(
+        BrokenExecutor(), max_pending=1, new_executor=new_executor
+    )
+    with pytest.raises(BrokenProcessPool):
+        await pool.render(b'x', [], EncodeOptions())
+    assert len(executors) == 1
+
+    assert await pool.render(b'x', [], EncodeOptions()) == b'x'
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_render_timeout(monkeypatch):
+    def render(source, operations, encoding):
+        time.sleep(0.2)
+        return source, {}
+
+    monkeypatch.setattr('app.images.inline._render_edit_timed', render)
+    executors = [ThreadPoolExecutor(1)]
+
+    def new_executor():
+        executors.append(ThreadPoolExecutor(1))
+        return executors[-1]
+
+    pool = InlineEditPool(
+        executors[0], max_pending=1, timeout=0.05, new_executor=new_executor
+    )
+    with pytest.raises(TimeoutError):
+        await pool.render(b'x', [], EncodeOptions())
+    assert len(executors) == 2
+    assert pool._free_slots == 1
+    pool.shutdown()
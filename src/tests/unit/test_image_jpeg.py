@@ -0,0 +1,71 @@
+import io
+import shutil
+
+import PIL.Image
+import PIL.ImageOps
+import pytest
+
+from app.common.settings import settings
+from app.images import jpeg
+
+Transpose = PIL.Image.Transpose
+
+
+def _jpeg(size=(32, 16), exif=None) -> bytes:
+    image = PIL.Image.new('RGB', size)
+    image.paste((255, 0, 0), (0, 0, size[0] // 2, size[1] // 2))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', **({'exif': exif} if exif else {}))
+    return buffer.getvalue()
+
+
+def _displayed(data: bytes) -> PIL.Image.Image:
+    return PIL.ImageOps.exif_transpose(PIL.Image.open(io.BytesIO(data)))
+
+
+@pytest.mark.parametrize('method', list(jpeg._JPEGTRAN_ARGS))
+def test_rotate_by_orientation(method):
+    data = _jpeg()
+    rotated = jpeg.rotate_by_orientation(data, method)
+    assert rotated[-100:] == data[-100:]
+    expected = PIL.Image.open(io.BytesIO(data)).transpose(method)
+    assert _displayed(rotated).tobytes() == expected.tobytes()
+
+    twice = jpeg.rotate_by_orientation(rotated, method)
+    assert len(twice) == len(rotated)
+    assert _displayed(twice).tobytes() == expected.transpose(
+        method
+    ).tobytes()
+
+
+def test_rotate_by_orientation_existing_exif():
+    exif = PIL.Image.Exif()
+    exif[0x0112] = 6
+    data = _jpeg(exif=exif.tobytes())
+    assert jpeg.get_orientation(data) == 6
+    rotated = jpeg.rotate_by_orientation(data, Transpose.ROTATE_90)
+    assert jpeg.get_orientation(rotated) == 1
+
+    exif = PIL.Image.Exif()
+    exif[0x010F] = 'camera'
+    data = _jpeg(exif=exif.tobytes())
+    assert jpeg.rotate_by_orientation(data, Transpose.ROTATE_90) is None
+
+
+@pytest.mark.skipif(shutil.which('jpegtran') is None, reason='no jpegtran')
+def test_transpose_lossless():
+    data = _jpeg()
+    rotated = jpeg.transpose_lossless(data, Transpose.ROTATE_90)
+    assert PIL.Image.open(io.BytesIO(rotated)).size == (16, 32)
+    odd_size = _jpeg((33, 17))
+    assert jpeg.transpose_lossless(odd_size, Transpose.ROTATE_90) is None
+
+
+def test_transpose_lossless_timeout(tmp_path, monkeypatch):
+    jpegtran = tmp_path / 'jpegtran'
+    jpegtran.write_text('#!/bin/sh\nexec sleep 5\n')
+    jpegtran.chmod(0o755)
+    monkeypatch.setattr(settings, 'JPEGTRAN_PATH', str(jpegtran))
+    monkeypatch.setattr(settings, 'JPEGTRAN_TIMEOUT', 0.1)
+
+    assert jpeg.transpose_lossless(_jpeg(), Transpose.ROTATE_90) is None
@@ -0,0 +1,261 @@
+import asyncio
+import io
+import itertools
+from uuid import uuid4
+
+import PIL.Image
+import pytest
+
+from app.common.settings import settings
+from app.images.exceptions import ImageTooManyPixelsException
+from app.images.models import (
+    EditOperation,
+    EncodeOptions,
+    Image,
+    ImageEditActionEnum,
+    ImageFormatEnum,
+)
+from app.images.pipeline import (
+    check_pipeline_pixels,
+    dump_operations,
+    get_sizes,
+    load_operations,
+    normalize_operations,
+    open_image,
+    read_metadata,
+)
+from app.images.tasks import (
+    PixelBudget,
+    _apply_operation,
+    _get_draft_size,
+    _render,
+    _render_edit,
+    _render_edit_timed,
+)
+
+Action = ImageEditActionEnum
+
+TRANSPOSES = [
+    EditOperation(Action.ROTATE90),
+    EditOperation(Action.ROTATE, angle=180),
+    EditOperation(Action.ROTATE, angle=-90),
+    EditOperation(Action.FLIP_HORIZONTAL),
+    EditOperation(Action.FLIP_VERTICAL),
+    EditOperation(Action.TRANSPOSE),
+    EditOperation(Action.TRANSVERSE),
+]
+
+
+def _image() -> PIL.Image.Image:
+    image = PIL.Image.new('RGB', (4, 3))
+    image.putdata([(i * 20, i * 10, 255 - i * 20) for i in range(12)])
+    return image
+
+
+def _apply(image, operations):
+    for operation in operations:
+        image = _apply_operation(image, operation)
+    return image
+
+
+@pytest.mark.parametrize(
+    'operations', itertools.product(TRANSPOSES, repeat=2)
+)
+def test_normalize_transposes(operations):
+    normalized = normalize_operations(list(operations))
+    assert len(normalized) <= 1
+    assert _apply(_image(), normalized) == _apply(_image(), operations)
+
+
+def test_normalize_operations():
+    assert normalize_operations([EditOperation(Action.ROTATE90)] * 4) == []
+    assert normalize_operations([EditOperation(Action.INVERT)] * 2) == []
+    assert normalize_operations(
+        [EditOperation(Action.GRAYSCALE)] * 3
+    ) == [EditOperation(Action.GRAYSCALE)]
+
+    crops = [
+        EditOperation(Action.CROP, box=(1, 1, 4, 3)),
+        EditOperation(Action.CROP, box=(1, 0, 2, 1)),
+    ]
+    normalized = normalize_operations(crops)
+    assert normalized == [EditOperation(Action.CROP, box=(2, 1, 3, 2))]
+    assert _apply(_image(), normalized) == _apply(_image(), crops)
+
+    overflow = [
+        EditOperation(Action.CROP, box=(0, 0, 2, 2)),
+        EditOperation(Action.CROP, box=(0, 0, 3, 3)),
+    ]
+    assert normalize_operations(overflow) == overflow
+
+
+def test_render_edit():
+    buffer = io.BytesIO()
+    _image().save(buffer, format='PNG')
+    operations = load_operations(dump_operations([
+        EditOperation(Action.ROTATE, angle=270),
+        EditOperation(Action.RESIZE, width=6),
+        EditOperation(Action.GRAYSCALE),
+    ]))
+    edited_bytes = _render_edit(
+        buffer.getvalue(), operations, EncodeOptions(ImageFormatEnum.PNG)
+    )
+    edited = PIL.Image.open(io.BytesIO(edited_bytes))
+    assert edited.size == (6, 8)
+    assert edited.mode == 'L'
+
+    timed_bytes, timings = _render_edit_timed(
+        buffer.getvalue(), operations, EncodeOptions(ImageFormatEnum.PNG)
+    )
+    assert timed_bytes == edited_bytes
+    assert list(timings) == ['decode', 'transform', 'encode']
+
+
+@pytest.mark.parametrize('format', list(ImageFormatEnum))
+def test_render_edit_encoding(format):
+    buffer = io.BytesIO()
+    _image().convert('RGBA').save(buffer, format='PNG')
+    edited_bytes = _render_edit(
+        buffer.getvalue(),
+        [EditOperation(Action.INVERT)],
+        EncodeOptions(format, quality=50, compress_level=1),
+    )
+    edited = PIL.Image.open(io.BytesIO(edited_bytes))
+    assert edited.format == format.upper()
+    assert ImageFormatEnum.from_content_type(format.content_type) == format
+
+
+def test_open_image_checks_pixels(monkeypatch, tmp_path):
+    path = tmp_path / 'image.png'
+    _image().save(path)
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 11)
+
+    with pytest.raises(ImageTooManyPixelsException) as e:
+        open_image(path)
+    assert e.value.pixels == 12
+
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 12)
+    assert open_image(path.read_bytes()).size == (4, 3)
+
+
+
+def test_pipeline_sizes(monkeypatch):
+    image = _image()
+    operations = [
+        EditOperation(Action.ROTATE90),
+        EditOperation(Action.RESIZE, width=30),
+        EditOperation(Action.CROP, box=(0, 0, 20, 50)),
+        EditOperation(Action.GRAYSCALE),
+    ]
+
+    sizes = get_sizes(image.size, operations)
+    assert sizes[1:] == [
+        _apply(image, operations[:n]).size for n in range(1, 5)
+    ]
+    assert sizes == [(4, 3), (3, 4), (30, 40), (20, 50), (20, 50)]
+
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 1200)
+    assert check_pipeline_pixels(image.size, operations) == 1200
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 1199)
+    with pytest.raises(ImageTooManyPixelsException) as e:
+        check_pipeline_pixels(image.size, operations)
+    assert e.value.pixels == 1200
+
+
+@pytest.mark.parametrize('format', ['JPEG', 'PNG', 'WEBP'])
+def test_read_metadata(format):
+    exif = PIL.Image.Exif()
+    exif[0x0112] = 6
+    exif[0x010F] = 'Canon'
+    buffer = io.BytesIO()
+    PIL.Image.new('RGB', (40, 30)).save(buffer, format, exif=exif)
+    image = Image(title='', owner_id=uuid4())
+
+    assert read_metadata(image, buffer.getvalue()[:10]) is False
+    assert image.width is None
+    assert read_metadata(image, buffer.getvalue()) is True
+    assert (image.width, image.height) == (30, 40)
+    assert image.exif == {'Orientation': 6, 'Make': 'Canon'}
+
+
+def test_read_metadata_webp_head(monkeypatch):
+    buffer = io.BytesIO()
+    PIL.Image.new('RGB', (40, 30)).save(buffer, 'WEBP')
+    image = Image(title='', owner_id=uuid4())
+
+    assert read_metadata(image, buffer.getvalue()[:30]) is True
+    assert (image.width, image.height) == (40, 30)
+
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 1000)
+    with pytest.raises(ImageTooManyPixelsException):
+        read_metadata(image, buffer.getvalue()[:30])
+
+
+def test_render_edit_draft(tmp_path):
+    # Stored landscape, shown portrait.
+    exif = PIL.Image.Exif()
+    exif[0x0112] = 6
+    path = tmp_path / 'image.jpg'
+    PIL.Image.new('RGB', (1600, 1200), 'red').save(path, exif=exif)
+    operations = [EditOperation(Action.RESIZE, width=100)]
+
+    assert _get_draft_size(PIL.Image.open(path), operations) == (133, 133)
+    assert _get_draft_size(
+        PIL.Image.open(path), [EditOperation(Action.INVERT), *operations]
+    ) is None
+    edited_bytes = _render_edit(
+        path, operations, EncodeOptions(ImageFormatEnum.PNG)
+    )
+    assert PIL.Image.open(io.BytesIO(edited_bytes)).size == (100, 133)
+    assert edited_bytes == _render_edit(
+        path.read_bytes(), operations, EncodeOptions(ImageFormatEnum.PNG)
+    )
+
+
+@pytest.mark.asyncio
+async def test_pixel_budget():
+    budget = PixelBudget(100)
+    events = []
+
+    async def render(name, pixels):
+        async with budget.reserve(pixels):
+            events.append(f'start {name}')
+            await asyncio.sleep(0)
+            events.append(f'end {name}')
+
+    await asyncio.gather(render('a', 60), render('b', 60), render('c', 500))
+    assert events == [
+        'start a', 'end a', 'start b', 'end b', 'start c', 'end c'
+    ]
+
+    events.clear()
+    await asyncio.gather(render('a', 60), render('b', 40))
+    assert events == ['start a', 'start b', 'end a', 'end b']
+
+
+@pytest.mark.asyncio
+async def test_render_reserves_largest_step(monkeypatch):
+    reserved = []
+
+    class Budget(PixelBudget):
+        def reserve(self, pixels):
+            reserved.append(pixels)
+            return super().reserve(pixels)
+
+    monkeypatch.setattr('app.images.tasks.pixel_budget', Budget(0))
+    buffer = io.BytesIO()
+    _image().save(buffer, 'PNG')
+    operations = [
+        EditOperation(Action.RESIZE, width=40),
+        EditOperation(Action.CROP, box=(0, 0, 2, 2)),
+    ]
+    encoding = EncodeOptions(ImageFormatEnum.PNG)
+
+    edited = await _render(None, buffer.getvalue(), operations, encoding)
+    assert PIL.Image.open(io.BytesIO(edited)).size == (2, 2)
+    assert reserved == [1200]
+
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 1199)
+    with pytest.raises(ImageTooManyPixelsException):
+        await _render(None, buffer.getvalue(), operations, encoding)
+    assert reserved == [1200]
@@ -0,0 +1,70 @@
+import PIL.Image
+import PIL.ImageOps
+import pytest
+
+from app.images import pixels
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+def test_invert_matches_image_ops(mode):
+    image = PIL.Image.linear_gradient('L').convert(mode)
+
+    inverted = pixels.invert(image)
+
+    assert inverted.mode == mode
+    assert inverted.tobytes() == PIL.ImageOps.invert(image).tobytes()
+
+
+@pytest.mark.parametrize(
+    'mode, color, expected',
+    [
+        ('RGBA', (10, 20, 30, 40), (245, 235, 225, 40)),
+        ('LA', (10, 40), (245, 40)),
+        ('CMYK', (10, 20, 30, 40), (245, 235, 225, 215)),
+    ],
+)
+def test_invert_bands(mode, color, expected):
+    image = PIL.Image.new(mode, (2, 2), color)
+
+    assert pixels.invert(image).getpixel((0, 0)) == expected
+
+
+def test_invert_palette():
+    image = PIL.Image.new('P', (2, 2), 1)
+    image.putpalette([0, 0, 0, 10, 20, 30])
+    image.info['transparency'] = 0
+
+    inverted = pixels.invert(image)
+
+    assert inverted.tobytes() == image.tobytes()
+    assert inverted.getpalette()[3:6] == [245, 235, 225]
+    assert inverted.info['transparency'] == 0
+    assert image.getpalette()[3:6] == [10, 20, 30]
+
+
+def test_invert_rgba_palette():
+    image = PIL.Image.new('RGBA', (2, 2), (10, 20, 30, 40)).convert('P')
+
+    inverted = pixels.invert(image)
+
+    assert inverted.convert('RGBA').getpixel((0, 0)) == (245, 235, 225, 40)
+
+
+def test_invert_16_bit():
+    image = PIL.Image.new('I;16', (2, 2), 1000)
+
+    inverted = pixels.invert(image)
+
+    assert inverted.mode == 'I;16'
+    assert inverted.getpixel((0, 0)) == 64535
+
+
+@pytest.mark.parametrize(
+    'mode, value, maximum', [('L', 200, 255), ('I;16', 40000, 65535)]
+)
+def test_linear_clamps(mode, value, maximum):
+    image = PIL.Image.new(mode, (2, 2), value)
+
+    assert pixels.linear(image, 2, 0).getpixel((0, 0)) == maximum
+    assert pixels.linear(image, 1, -1).getpixel((0, 0)) == 0
+    assert pixels.linear(image, 0.5, 0).getpixel((0, 0)) == value // 2
@@ -0,0 +1,208 @@
+import io
+from uuid import uuid4
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import db
+from app.common.cache import CacheStats, MemoryCache
+from app.common.settings import settings
+from app.images.models import (
+    Image,
+    ImageFilter,
+    ImageFormatEnum,
+    ImageStatusEnum,
+    ImageUpload,
+)
+from app.images.repositories import (
+    BlobTable,
+    CachedImageRepository,
+    ContentAddressedImageFileRepository,
+    ImageFileRepository,
+    ImageRepository,
+    _get_filter_clauses,
+)
+from tests.conftest import FakeSession
+
+
+@pytest.mark.asyncio
+async def test_content_addressed_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGE_DIR_PATH', tmp_path)
+    repository = ContentAddressedImageFileRepository()
+
+    img1 = Image(title='', owner_id=uuid4())
+    await repository.save(img1, UploadFile(io.BytesIO(b'x10')))
+    path = repository.get_path(img1)
+    assert path.read_bytes() == b'x10'
+    assert path.parent.parent.parent == tmp_path / 'blobs'
+    assert img1.size == 3
+
+    img2 = Image(title='', owner_id=uuid4())
+    await repository.save_bytes(img2, b'x10')
+    assert img2.digest == img1.digest
+    assert repository.get_path(img2) == path
+    assert await repository.get(img2) == b'x10'
+    assert len(list(path.parent.iterdir())) == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_image_repository(image_repository):
+    stats = CacheStats()
+    repository = CachedImageRepository(
+        image_repository, MemoryCache(ttl=60, max_size=10), stats
+    )
+    session = FakeSession()
+    img = Image(title='a', owner_id=uuid4())
+    await repository.create_meta(session, img)
+
+    assert await repository.get_meta(session, img.id_) == img
+    del image_repository._storage[img.id_]
+    cached_img = await repository.get_meta(session, img.id_)
+    assert cached_img == img
+    assert cached_img is not img
+    assert (stats.hits, stats.misses) == (1, 1)
+
+    missing_id = uuid4()
+    assert await repository.get_meta(session, missing_id) is None
+    assert await repository.get_meta(session, missing_id) is None
+    assert (stats.hits, stats.misses) == (2, 2)
+    missing_img = Image(title='b', owner_id=uuid4(), id_=missing_id)
+    await repository.create_meta(session, missing_img)
+    assert await repository.get_meta(session, missing_id) == missing_img
+
+    processing_img = Image(
+        title='c', owner_id=uuid4(), status=ImageStatusEnum.PROCESSING
+    )
+    await repository.create_meta(session, processing_img)
+    await repository.get_meta(session, processing_img.id_)
+    await repository.update_status(
+        session, processing_img.id_, ImageStatusEnum.DONE
+    )
+    images = await repository.get_meta_many(
+        session, [img.id_, processing_img.id_]
+    )
+    assert [i.status for i in images] == [ImageStatusEnum.DONE] * 2
+
+
+async def iter_chunks(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_save_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGE_DIR_PATH', tmp_path)
+    for repository in (
+        ImageFileRepository(), ContentAddressedImageFileRepository()
+    ):
+        img1 = Image(title='', owner_id=uuid4())
+        await repository.save_stream(img1, iter_chunks([b'x1', b'0']))
+        assert await repository.get(img1) == b'x10'
+        assert img1.size == 3
+
+        img2 = Image(title='', owner_id=uuid4())
+        with pytest.raises(OSError):
+            await repository.save_stream(
+                img2, iter_chunks([b'x1', OSError()])
+            )
+        assert not list(tmp_path.rglob('*.tmp'))
+        assert not repository.get_path(img2).exists()
+
+    img3 = Image(title='', owner_id=uuid4())
+    await repository.save_stream(img3, iter_chunks([b'x10']))
+    assert img3.digest == img1.digest
+    assert len(list(repository.get_path(img1).parent.iterdir())) == 1
+
+
+@pytest.mark.asyncio
+async def test_upload_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGE_DIR_PATH', tmp_path)
+    for repository in (
+        ImageFileRepository(), ContentAddressedImageFileRepository()
+    ):
+        upload = ImageUpload(owner_id=uuid4(), title='', length=6)
+        await repository.create_upload(upload)
+        path = repository.get_upload_path(upload.id_)
+        assert path.stat().st_size == 6
+
+        written = await repository.write_upload(
+            upload.id_, 3, iter_chunks([b'4', b'56'])
+        )
+        assert written == 3
+        await repository.write_upload(upload.id_, 0, iter_chunks([b'123']))
+        assert await repository.read_upload(upload.id_, 2) == b'12'
+
+        image = Image(title='', owner_id=upload.owner_id)
+        await repository.finalize_upload(upload.id_, image)
+        assert await repository.get(image) == b'123456'
+        assert image.size == 6
+        assert not path.exists()
+
+        await repository.delete_upload(upload.id_)
+
+
+def test_get_filter_clauses():
+    filters = ImageFilter(
+        format=ImageFormatEnum.WEBP, min_width=100, max_height=50, min_size=1
+    )
+
+    clauses = [
+        str(c.compile(compile_kwargs={'literal_binds': True}))
+        for c in _get_filter_clauses(filters)
+    ]
+
+    assert clauses == [
+        "image.content_type = 'image/webp'",
+        'image.width >= 100',
+        'image.height <= 50',
+        'image.size >= 1',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_collect_blob(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGE_DIR_PATH', tmp_path)
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/db')
+    async with engine.begin() as conn:
+        await conn.run_sync(
+            db.Base.metadata.create_all, tables=[BlobTable.__table__]
+        )
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    monkeypatch.setattr(db, 'async_session_maker', session_maker)
+    repository = ImageRepository(ContentAddressedImageFileRepository())
+    image = Image(title='', owner_id=uuid4())
+    await repository.file_repository.save_bytes(image, b'x10')
+    path = repository.file_repository.get_path(image)
+
+    async with session_maker() as session:
+        await repository._add_blob_ref(session, image.digest, image.size)
+        await session.commit()
+    await repository._collect_blob(image.digest)
+    assert path.exists()
+
+    async with session_maker() as session:
+        assert await repository._release_blobs(
+            session, [image.digest]
+        ) == [image.digest]
+        await session.commit()
+    await repository._collect_blob(image.digest)
+    assert not path.exists()
+    async with session_maker() as session:
+        assert (await session.execute(select(BlobTable))).all() == []
+
+        with pytest.raises(FileNotFoundError):
+            await repository._add_blob_ref(session, image.digest, image.size)
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_flat_repository_has_no_blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGE_DIR_PATH', tmp_path)
+    repository = ImageFileRepository()
+
+    assert not await repository.has_blob('0' * 64)
+    await repository.delete_blob('0' * 64)
@@ -0,0 +1,82 @@
+import pytest
+
+from app.images.responses import ImageFileResponse, parse_range
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=95-200', 100) == (95, 99)
+    assert parse_range('bytes=0-1,5-6', 100) is None
+    assert parse_range('items=0-1', 100) is None
+    with pytest.raises(ValueError):
+        parse_range('bytes=100-', 100)
+    with pytest.raises(ValueError):
+        parse_range('bytes=5-1', 100)
+
+
+async def _call(response, headers=None, extensions=None):
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'headers': [
+            (k.encode(), v.encode()) for k, v in (headers or {}).items()
+        ],
+        'extensions': extensions or {},
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        messages.append(message)
+
+    await response(scope, receive, send)
+    start, *body = messages
+    return start, body
+
+
+@pytest.mark.asyncio
+async def test_image_file_response(tmp_path):
+    path = tmp_path / 'image'
+    path.write_bytes(bytes(range(100)))
+
+    start, body = await _call(
+        ImageFileResponse(path, media_type='image/png', chunk_size=30)
+    )
+    headers = dict(start['headers'])
+    assert start['status'] == 200
+    assert headers[b'accept-ranges'] == b'bytes'
+    assert len(body) == 4
+    assert b''.join(m['body'] for m in body) == bytes(range(100))
+
+    etag = headers[b'etag'].decode()
+    start, body = await _call(
+        ImageFileResponse(path), headers={'if-none-match': etag}
+    )
+    assert start['status'] == 304
+    assert body[0]['body'] == b''
+
+    start, body = await _call(
+        ImageFileResponse(path), headers={'range': 'bytes=10-19'}
+    )
+    headers = dict(start['headers'])
+    assert start['status'] == 206
+    assert headers[b'content-range'] == b'bytes 10-19/100'
+    assert body[0]['body'] == bytes(range(10, 20))
+
+    start, _ = await _call(
+        ImageFileResponse(path), headers={'range': 'bytes=200-'}
+    )
+    assert start['status'] == 416
+
+    start, body = await _call(
+        ImageFileResponse(path, etag='abc'),
+        headers={'range': 'bytes=0-9'},
+        extensions={'http.response.zerocopysend': {}},
+    )
+    assert dict(start['headers'])[b'etag'] == b'"abc"'
+    assert body[0]['type'] == 'http.response.zerocopysend'
+    assert body[0]['offset'] == 0 and body[0]['count'] == 10
@@ -0,0 +1,262 @@
+import io
+from dataclasses import dataclass, field
+from uuid import uuid4
+
+import pytest
+from fastapi import UploadFile
+
+from app.common.settings import settings
+from app.images import s3
+from app.images.models import Image, ImageUpload
+from app.images.s3 import (
+    ClientError,
+    ContentAddressedS3ImageFileRepository,
+    S3ImageFileRepository,
+)
+
+
+@dataclass
+class FakeBody:
+    data: bytes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def read(self):
+        return self.data
+
+
+@dataclass
+class FakeS3Client:
+    """In-memory stand-in for the calls the repositories make."""
+
+    objects: dict[str, bytes] = field(default_factory=dict)
+    multipart: dict[str, dict[int, bytes]] = field(default_factory=dict)
+    calls: list[str] = field(default_factory=list)
+
+    def _get(self, key):
+        if key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return self.objects[key]
+
+    async def put_object(self, Bucket, Key, Body):
+        self.calls.append('put_object')
+        self.objects[Key] = Body
+
+    async def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ContentLength': len(self.objects[Key])}
+
+    async def get_object(self, Bucket, Key, Range):
+        self.calls.append('get_object')
+        data = self._get(Key)
+        start, _, end = Range.removeprefix('bytes=').partition('-')
+        start, end = int(start), min(int(end), len(data) - 1)
+        return {
+            'Body': FakeBody(data[start:end + 1]),
+            'ContentRange': f'bytes {start}-{end}/{len(data)}',
+        }
+
+    async def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self._get(CopySource['Key'])
+
+    async def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    async def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            self.objects.pop(item['Key'], None)
+
+    async def list_objects_v2(self, Bucket, Prefix):
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        return {
+            'Contents': [
+                {'Key': key, 'Size': len(self.objects[key])} for key in keys
+            ],
+            'IsTruncated': False,
+        }
+
+    async def create_multipart_upload(self, Bucket, Key):
+        upload_id = str(uuid4())
+        self.multipart[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.multipart[UploadId][PartNumber] = Body
+        return {'ETag': str(PartNumber)}
+
+    async def complete_multipart_upload(
+        self, Bucket, Key, UploadId, MultipartUpload
+    ):
+        parts = self.multipart.pop(UploadId)
+        self.objects[Key] = b''.join(
+            parts[int(part['ETag'])] for part in MultipartUpload['Parts']
+        )
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.multipart[UploadId]
+
+    async def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f'https://s3.test/{Params["Bucket"]}/{Params["Key"]}'
+
+
+async def iter_chunks(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeS3Client()
+
+    async def get_client():
+        return client
+
+    monkeypatch.setattr(s3, 'get_client', get_client)
+    monkeypatch.setattr(settings, 'S3_PART_SIZE', 4)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_multipart_put_and_ranged_get(client):
+    repository = S3ImageFileRepository()
+    image = Image(title='', owner_id=uuid4())
+
+    await repository.save_stream(image, iter_chunks([b'abc', b'defghij']))
+    assert image.size == 10
+    assert client.calls.count('upload_part') == 3
+    assert await repository.get(image) == b'abcdefghij'
+    assert client.calls.count('get_object') == 3
+    assert await repository.get_size(image) == 10
+
+    await repository.save_bytes(image, b'xy')
+    assert 'put_object' in client.calls
+    assert await repository.get(image) == b'xy'
+
+    with pytest.raises(ValueError):
+        await repository.save_stream(
+            image, iter_chunks([b'12345678', ValueError()])
+        )
+    assert not client.multipart
+
+    assert not await repository.has_variant(image, 'w128.webp')
+    await repository.save_variant(image, 'w128.webp', b'v')
+    assert await repository.has_variant(image, 'w128.webp')
+    url = await repository.get_download_url(
+        repository.get_path(image), 'image/png'
+    )
+    assert url == f'https://s3.test/{settings.S3_BUCKET}/{image.id_}'
+
+
+@pytest.mark.asyncio
+async def test_content_addressed_s3(client):
+    repository = ContentAddressedS3ImageFileRepository()
+    img1 = Image(title='', owner_id=uuid4())
+    await repository.save_stream(img1, iter_chunks([b'x10']))
+    img2 = Image(title='', owner_id=uuid4())
+    await repository.save(img2, UploadFile(io.BytesIO(b'x10')))
+    img3 = Image(title='', owner_id=uuid4())
+    await repository.save_bytes(img3, b'x10')
+
+    assert img1.digest == img2.digest == img3.digest
+    assert str(repository.get_path(img1)).startswith('blobs/')
+    assert list(client.objects) == [str(repository.get_path(img1))]
+
+    await repository.save_variant(img1, 'w128.webp', b'v')
+    await repository.delete_blob(img1.digest)
+    assert not client.objects
+
+
+@pytest.mark.asyncio
+async def test_s3_upload(client):
+    repository = S3ImageFileRepository()
+    upload = ImageUpload(owner_id=uuid4(), title='', length=8)
+    await repository.create_upload(upload)
+
+    await repository.write_upload(upload.id_, 0, iter_chunks([b'12345']))
+    # A retried write overlapping the part that is already stored.
+    await repository.write_upload(upload.id_, 3, iter_chunks([b'45678']))
+    assert await repository.read_upload(upload.id_, 2) == b'12'
+
+    image = Image(title='', owner_id=upload.owner_id)
+    await repository.finalize_upload(upload.id_, image)
+    assert await repository.get(image) == b'12345678'
+    assert image.size == 8
+    assert list(client.objects) == [str(image.id_)]
+
+
+@pytest.fixture
+def moto_s3(monkeypatch):
+    """A real S3 API served by moto, when it is installed."""
+    moto_server = pytest.importorskip('moto.server')
+    pytest.importorskip('aiobotocore')
+    server = moto_server.ThreadedMotoServer('127.0.0.1', 0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    monkeypatch.setattr(settings, 'S3_ENDPOINT_URL', f'http://{host}:{port}')
+    monkeypatch.setattr(settings, 'S3_REGION', 'us-east-1')
+    monkeypatch.setattr(settings, 'S3_ACCESS_KEY_ID', 'test')
+    monkeypatch.setattr(settings, 'S3_SECRET_ACCESS_KEY', 'test')
+    # Moto keeps its state for the whole process.
+    monkeypatch.setattr(settings, 'S3_BUCKET', f'test-{uuid4().hex}')
+    # The smallest part S3 accepts.
+    monkeypatch.setattr(settings, 'S3_PART_SIZE', 5 * 1024 * 1024)
+    yield
+    server.stop()
+
+
+@pytest.mark.asyncio
+async def test_moto_multipart_and_ranged_get(moto_s3):
+    client = await s3.get_client()
+    try:
+        await client.create_bucket(Bucket=settings.S3_BUCKET)
+        repository = S3ImageFileRepository()
+        image = Image(title='', owner_id=uuid4())
+        data = bytes(range(256)) * (11 * 4096)
+        chunks = [data[i:i + 1024 * 1024] for i in range(0, len(data), 2**20)]
+
+        await repository.save_stream(image, iter_chunks(chunks))
+        head = await client.head_object(
+            Bucket=settings.S3_BUCKET, Key=str(image.id_)
+        )
+        assert head['ETag'].strip('"').endswith('-3')
+        assert await repository.get(image) == data
+        assert await repository.get_size(image) == len(data)
+
+        with pytest.raises(ValueError):
+            await repository.save_stream(
+                image, iter_chunks([data, ValueError()])
+            )
+        uploads = await client.list_multipart_uploads(
+            Bucket=settings.S3_BUCKET
+        )
+        assert not uploads.get('Uploads')
+    finally:
+        await s3.close_client()
+
+
+@pytest.mark.asyncio
+async def test_moto_content_addressed_stream(moto_s3):
+    client = await s3.get_client()
+    try:
+        await client.create_bucket(Bucket=settings.S3_BUCKET)
+        repository = ContentAddressedS3ImageFileRepository()
+        img1 = Image(title='', owner_id=uuid4())
+        img2 = Image(title='', owner_id=uuid4())
+
+        await repository.save_stream(img1, iter_chunks([b'x', b'10']))
+        await repository.save_stream(img2, iter_chunks([b'x10']))
+
+        assert img1.digest == img2.digest
+        assert await repository.get(img2) == b'x10'
+        keys = [item['Key'] async for item in repository._list('')]
+        assert keys == [str(repository.get_path(img1))]
+    finally:
+        await s3.close_client()
@@ -1,21 +1,59 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
 from uuid import uuid4
+
+import PIL.Image
 import pytest
 
 from app.common.settings import settings
+from app.db import commit
 from app.images.services import (
     get_image_meta,
     get_image_file,
+    get_image_path,
+    get_image_variant_path,
     create_image,
+    create_images,
+    edit_image,
+    edit_images,
+    get_image_list,
+    ingest_image,
+    stream_image_events,
+    create_upload,
+    get_upload,
+    write_upload,
+)
+from app.images.models import (
+    EditOperation,
+    EditResult,
+    EncodeOptions,
+    Image,
+    ImageFilter,
+    ImageEditActionEnum,
+    ImageFormatEnum,
+    ImageStatusEnum,
+    ImageStatusEvent,
 )
-from app.images.models import Image, ImageStatusEnum
+from app.images.pipeline import dump_operations, get_edit_key
 from app.images.exceptions import (
     ImageNotFoundException,
     UserIsNotOwnerException,
     ImageIsStillProcessingException,
+    ImageProcessingFailedException,
     InvalidFileException,
-    ImageTooBigException
+    ImageTooBigException,
+    ImageTooManyPixelsException,
+    InvalidCursorException,
+    TooManyFilesException,
+    UploadLengthExceededException,
+    UploadNotFoundException,
+    UploadOffsetMismatchException,
 )
-from tests.conftest import FakeSession, FakeImageFile
+from app.images.events import StatusBroadcaster
+from app.images.inline import InlineEditPool
+from tests.conftest import FakeSession, FakeImageFile, FakeTask
 
 
 @pytest.mark.asyncio
@@ -50,6 +88,44 @@ async def test_get_image_meta(image_repository):
         )
 
 
+@pytest.mark.asyncio
+async def test_get_image_list(image_repository):
+    owner_id = uuid4()
+    images = [Image(title=str(i), owner_id=owner_id) for i in range(5)]
+    images[0].status = ImageStatusEnum.PROCESSING
+    for img in images:
+        image_repository._storage[img.id_] = img
+    image_repository._storage[uuid4()] = Image(title='', owner_id=uuid4())
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = await get_image_list(
+            image_repository, FakeSession(), owner_id, limit=2, cursor=cursor
+        )
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert len(seen) == 5
+    assert [i.created_at for i in seen] == sorted(
+        (i.created_at for i in images), reverse=True
+    )
+
+    page, cursor = await get_image_list(
+        image_repository,
+        FakeSession(),
+        owner_id,
+        limit=10,
+        filters=ImageFilter(status=ImageStatusEnum.PROCESSING),
+    )
+    assert page == [images[0]] and cursor is None
+
+    with pytest.raises(InvalidCursorException):
+        await get_image_list(
+            image_repository, FakeSession(), owner_id, limit=2, cursor='x'
+        )
+
+
 @pytest.mark.asyncio
 async def test_get_image_file(image_repository):
     img = Image(title='', owner_id=uuid4())
@@ -64,23 +140,69 @@ async def test_get_image_file(image_repository):
 
 
 @pytest.mark.asyncio
-async def test_create_image_file(image_repository):
+async def test_get_image_path(image_repository):
+    img = Image(title='', owner_id=uuid4())
+    path = await get_image_path(image_repository.file_repository, img)
+    assert path.name == str(img.id_)
+    img.status = ImageStatusEnum.PROCESSING
+    with pytest.raises(ImageIsStillProcessingException):
+        await get_image_path(image_repository.file_repository, img)
+    img.status = ImageStatusEnum.FAILED
+    with pytest.raises(ImageProcessingFailedException):
+        await get_image_path(image_repository.file_repository, img)
+
+
+@pytest.mark.asyncio
+async def test_get_image_variant_path(image_repository):
+    buffer = io.BytesIO()
+    PIL.Image.new('RGB', (400, 200)).save(buffer, format='PNG')
+    img = Image(title='', owner_id=uuid4())
+    file_repository = image_repository.file_repository
+    file_repository._storage[img.id_] = buffer.getvalue()
+
+    path, format = await get_image_variant_path(
+        file_repository, img, 200, None
+    )
+    assert format == ImageFormatEnum.PNG
+    assert path.name == f'{img.id_}.w256.png'
+    variant = file_repository._variants[(img.id_, 'w256.png')]
+    assert PIL.Image.open(io.BytesIO(variant)).size == (256, 128)
+
+    path, format = await get_image_variant_path(
+        file_repository, img, 5000, ImageFormatEnum.WEBP
+    )
+    assert path.name == f'{img.id_}.full.webp'
+    variant = file_repository._variants[(img.id_, 'full.webp')]
+    assert PIL.Image.open(io.BytesIO(variant)).size == (400, 200)
+
+    img.status = ImageStatusEnum.PROCESSING
+    with pytest.raises(ImageIsStillProcessingException):
+        await get_image_variant_path(file_repository, img, 200, None)
+
+
+@pytest.mark.asyncio
+async def test_create_image_file(image_repository, monkeypatch):
+    session = FakeSession()
+    task = FakeTask()
+    monkeypatch.setattr('app.images.services.generate_variants_task', task)
     file = FakeImageFile(
         _bytes=b'x10', size=10, content_type='image/png'
     )
     owner_id = uuid4()
     img_id = await create_image(
-        image_repository, FakeSession, file=file, title='', owner_id=owner_id
+        image_repository, session, file=file, title='', owner_id=owner_id
     )
     img = image_repository._storage[img_id]
     assert img.owner_id == owner_id
     assert img.title == ''
     assert file._bytes == image_repository.file_repository._storage[img_id]
+    await commit(session)
+    assert task.calls == [{'image_id': img_id}]
 
     with pytest.raises(InvalidFileException):
         await create_image(
             image_repository,
-            FakeSession,
+            session,
             file=None,
             title='',
             owner_id=uuid4()
@@ -92,7 +214,7 @@ async def test_create_image_file(image_repository):
     with pytest.raises(InvalidFileException):
         await create_image(
             image_repository,
-            FakeSession,
+            session,
             file=file,
             title='',
             owner_id=uuid4()
@@ -104,7 +226,7 @@ async def test_create_image_file(image_repository):
     with pytest.raises(InvalidFileException):
         await create_image(
             image_repository,
-            FakeSession,
+            session,
             file=file,
             title='',
             owner_id=uuid4()
@@ -118,8 +240,569 @@ async def test_create_image_file(image_repository):
     with pytest.raises(ImageTooBigException):
         img = await create_image(
             image_repository,
-            FakeSession,
+            session,
             file=file,
             title='',
             owner_id=uuid4()
         )
+
+
+@pytest.mark.asyncio
+async def test_create_images(image_repository, monkeypatch):
+    session = FakeSession()
+    task = FakeTask()
+    monkeypatch.setattr('app.images.services.generate_variants_task', task)
+    files = [
+        FakeImageFile(_bytes=b'x10', size=3, content_type='image/png'),
+        FakeImageFile(_bytes=b'x10', size=3, content_type='video/mp4'),
+        FakeImageFile(
+            _bytes=b'x10',
+            size=settings.MAX_FILE_SIZE_MB * 1024 * 1024 + 1,
+            content_type='image/png',
+        ),
+        FakeImageFile(_bytes=b'x11', size=3, content_type='image/jpeg'),
+    ]
+    owner_id = uuid4()
+    results = await create_images(
+        image_repository,
+        session,
+        files=files,
+        titles=['a', 'b', 'c', 'd'],
+        owner_id=owner_id,
+    )
+    assert [r.index for r in results] == [0, 1, 2, 3]
+    assert results[1].error == InvalidFileException().message
+    assert results[2].error == ImageTooBigException().message
+    file_storage = image_repository.file_repository._storage
+    for result, file in zip([results[0], results[3]], [files[0], files[3]]):
+        assert result.error is None
+        assert image_repository._storage[result.image_id].owner_id == owner_id
+        assert file_storage[result.image_id] == file._bytes
+    await commit(session)
+    assert len(task.calls) == 2
+
+    async def read_metadata(image, file):
+        if file is files[3]:
+            raise RuntimeError()
+
+    monkeypatch.setattr(
+        'app.images.services._read_file_metadata', read_metadata
+    )
+    results = await create_images(
+        image_repository,
+        session,
+        files=[files[0], files[3]],
+        titles=['a', 'd'],
+        owner_id=owner_id,
+    )
+    assert results[0].image_id in file_storage
+    assert results[1].error == 'File could not be saved'
+
+    monkeypatch.setattr(settings, 'UPLOAD_BATCH_MAX_FILES', 3)
+    with pytest.raises(TooManyFilesException):
+        await create_images(
+            image_repository,
+            session,
+            files=files,
+            titles=['a', 'b', 'c', 'd'],
+            owner_id=owner_id,
+        )
+
+
+@pytest.mark.asyncio
+async def test_edit_image(image_repository, monkeypatch):
+    session = FakeSession()
+    task = FakeTask()
+    monkeypatch.setattr('app.images.services.edit_image_task', task)
+    img = Image(title='', owner_id=uuid4(), digest='a' * 64, size=3)
+    operations = [EditOperation(ImageEditActionEnum.INVERT)]
+
+    new_img = await edit_image(
+        image_repository,
+        session,
+        image=img,
+        owner_id=img.owner_id,
+        new_title='new',
+        operations=operations,
+    )
+    encoding = EncodeOptions(ImageFormatEnum.PNG)
+    assert new_img.status == ImageStatusEnum.PROCESSING
+    assert image_repository._storage[new_img.id_] == new_img
+    assert task.calls == []
+    await commit(session)
+    assert task.calls == [
+        {
+            'orig_id': img.id_,
+            'new_id': new_img.id_,
+            'operations': dump_operations(operations),
+            'encoding': asdict(encoding),
+        }
+    ]
+
+    key = get_edit_key(operations, encoding)
+    image_repository._edit_results[(img.digest, key)] = EditResult(
+        source_digest=img.digest,
+        key=key,
+        digest='b' * 64,
+        size=5,
+        width=3,
+        height=2,
+    )
+    cached_img = await edit_image(
+        image_repository,
+        session,
+        image=img,
+        owner_id=img.owner_id,
+        new_title='new',
+        operations=operations,
+    )
+    assert cached_img.status == ImageStatusEnum.DONE
+    assert cached_img.digest == 'b' * 64
+    assert (cached_img.width, cached_img.height) == (3, 2)
+    await commit(session)
+    assert len(task.calls) == 1
+
+    same_img = await edit_image(
+        image_repository,
+        session,
+        image=img,
+        owner_id=img.owner_id,
+        new_title='new',
+        operations=operations * 2,
+    )
+    assert same_img.status == ImageStatusEnum.DONE
+    assert same_img.digest == img.digest
+    await commit(session)
+    assert len(task.calls) == 1
+
+    jpeg_img = await edit_image(
+        image_repository,
+        session,
+        image=img,
+        owner_id=img.owner_id,
+        new_title='new',
+        operations=[],
+        encoding=EncodeOptions(ImageFormatEnum.JPEG, quality=70),
+    )
+    assert jpeg_img.status == ImageStatusEnum.PROCESSING
+    assert jpeg_img.content_type == 'image/jpeg'
+    await commit(session)
+    assert task.calls[-1]['encoding']['format'] == ImageFormatEnum.JPEG
+
+
+@pytest.mark.asyncio
+async def test_edit_images(image_repository, monkeypatch):
+    session = FakeSession()
+    task = FakeTask()
+    monkeypatch.setattr('app.images.services.edit_images_task', task)
+    owner_id = uuid4()
+    img = Image(title='a', owner_id=owner_id, content_type='image/jpeg')
+    cached_img = Image(title='b', owner_id=owner_id, digest='a' * 64)
+    processing_img = Image(
+        title='c', owner_id=owner_id, status=ImageStatusEnum.PROCESSING
+    )
+    other_img = Image(title='d', owner_id=uuid4())
+    for i in (img, cached_img, processing_img, other_img):
+        image_repository._storage[i.id_] = i
+    operations = [EditOperation(ImageEditActionEnum.INVERT)]
+    key = get_edit_key(operations, EncodeOptions(ImageFormatEnum.PNG))
+    image_repository._edit_results[(cached_img.digest, key)] = EditResult(
+        source_digest=cached_img.digest, key=key, digest='b' * 64, size=5
+    )
+    missing_id = uuid4()
+
+    results = await edit_images(
+        image_repository,
+        session,
+        image_ids=[
+            img.id_, cached_img.id_, processing_img.id_, other_img.id_,
+            missing_id,
+        ],
+        owner_id=owner_id,
+        operations=operations,
+    )
+    assert [r.index for r in results] == [0, 1, 2, 3, 4]
+    assert results[2].error == ImageIsStillProcessingException().message
+    assert results[3].error == UserIsNotOwnerException().message
+    assert results[4].error == ImageNotFoundException(missing_id).message
+
+    new_img = image_repository._storage[results[0].image_id]
+    assert new_img.title == 'a'
+    assert new_img.status == ImageStatusEnum.PROCESSING
+    assert new_img.content_type == 'image/jpeg'
+    new_cached_img = image_repository._storage[results[1].image_id]
+    assert new_cached_img.status == ImageStatusEnum.DONE
+    assert new_cached_img.digest == 'b' * 64
+    await commit(session)
+    assert task.calls == [
+        {
+            'items': [
+                {
+                    'orig_id': img.id_,
+                    'new_id': new_img.id_,
+                    'encoding': asdict(EncodeOptions(ImageFormatEnum.JPEG)),
+                }
+            ],
+            'operations': dump_operations(operations),
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_edit_too_many_pixels(image_repository, monkeypatch):
+    session = FakeSession()
+    edit_task, batch_task = FakeTask(), FakeTask()
+    monkeypatch.setattr('app.images.services.edit_image_task', edit_task)
+    monkeypatch.setattr('app.images.services.edit_images_task', batch_task)
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 100)
+    owner_id = uuid4()
+    img = Image(title='', owner_id=owner_id, width=5, height=5)
+    small_img = Image(title='', owner_id=owner_id, width=4, height=1)
+    for i in (img, small_img):
+        image_repository._storage[i.id_] = i
+    operations = [EditOperation(ImageEditActionEnum.RESIZE, width=20)]
+
+    with pytest.raises(ImageTooManyPixelsException) as e:
+        await edit_image(
+            image_repository,
+            session,
+            image=img,
+            owner_id=owner_id,
+            new_title='new',
+            operations=operations,
+        )
+    assert e.value.pixels == 400
+
+    results = await edit_images(
+        image_repository,
+        session,
+        image_ids=[img.id_, small_img.id_],
+        owner_id=owner_id,
+        operations=operations,
+    )
+    assert results[0].error == ImageTooManyPixelsException(400).message
+    assert results[1].error is None
+    await commit(session)
+    assert edit_task.calls == []
+    assert [
+        item['orig_id'] for item in batch_task.calls[0]['items']
+    ] == [small_img.id_]
+
+
+@pytest.mark.asyncio
+async def test_edit_image_inline(image_repository, monkeypatch):
+    session = FakeSession()
+    edit_task, variants_task = FakeTask(), FakeTask()
+    monkeypatch.setattr('app.images.services.edit_image_task', edit_task)
+    monkeypatch.setattr(
+        'app.images.services.generate_variants_task', variants_task
+    )
+    img = Image(title='', owner_id=uuid4())
+    buffer = io.BytesIO()
+    PIL.Image.new('RGB', (4, 4), 'white').save(buffer, 'PNG')
+    image_repository.file_repository._storage[img.id_] = buffer.getvalue()
+    operations = [EditOperation(ImageEditActionEnum.INVERT)]
+
+    with ThreadPoolExecutor(1) as executor:
+        new_img = await edit_image(
+            image_repository,
+            session,
+            image=img,
+            owner_id=img.owner_id,
+            new_title='new',
+            operations=operations,
+            edit_pool=InlineEditPool(executor, max_pending=1),
+        )
+        assert new_img.status == ImageStatusEnum.DONE
+        edited = image_repository.file_repository._storage[new_img.id_]
+        assert PIL.Image.open(io.BytesIO(edited)).getpixel((0, 0)) == (
+            0, 0, 0
+        )
+        await commit(session)
+        assert edit_task.calls == []
+        assert variants_task.calls == [{'image_id': new_img.id_}]
+
+        queued_img = await edit_image(
+            image_repository,
+            session,
+            image=img,
+            owner_id=img.owner_id,
+            new_title='new',
+            operations=operations,
+            edit_pool=InlineEditPool(executor, max_pending=0),
+        )
+        assert queued_img.status == ImageStatusEnum.PROCESSING
+        await commit(session)
+        assert edit_task.calls[0]['new_id'] == queued_img.id_
+
+        monkeypatch.setattr(settings, 'INLINE_EDIT_MAX_BYTES', 1)
+        big_img = await edit_image(
+            image_repository,
+            session,
+            image=img,
+            owner_id=img.owner_id,
+            new_title='new',
+            operations=operations,
+            edit_pool=InlineEditPool(executor, max_pending=1),
+        )
+        assert big_img.status == ImageStatusEnum.PROCESSING
+
+
+@pytest.mark.asyncio
+async def test_edit_image_inline_errors(image_repository, monkeypatch):
+    session = FakeSession()
+    edit_task = FakeTask()
+    monkeypatch.setattr('app.images.services.edit_image_task', edit_task)
+    img = Image(title='', owner_id=uuid4())
+    image_repository.file_repository._storage[img.id_] = b'not an image'
+    operations = [EditOperation(ImageEditActionEnum.INVERT)]
+
+    async def edit(executor):
+        return await edit_image(
+            image_repository,
+            session,
+            image=img,
+            owner_id=img.owner_id,
+            new_title='new',
+            operations=operations,
+            edit_pool=InlineEditPool(executor, max_pending=1),
+        )
+
+    with ThreadPoolExecutor(1) as executor:
+        failed_img = await edit(executor)
+        assert failed_img.status == ImageStatusEnum.FAILED
+
+        monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 1)
+        buffer = io.BytesIO()
+        PIL.Image.new('RGB', (4, 4), 'white').save(buffer, 'PNG')
+        image_repository.file_repository._storage[img.id_] = (
+            buffer.getvalue()
+        )
+        with pytest.raises(ImageTooManyPixelsException):
+            await edit(executor)
+
+    async def render(self, *args):
+        raise BrokenProcessPool()
+
+    monkeypatch.setattr(InlineEditPool, 'render', render)
+    queued_img = await edit(None)
+    assert queued_img.status == ImageStatusEnum.PROCESSING
+    await commit(session)
+    assert [c['new_id'] for c in edit_task.calls] == [queued_img.id_]
+
+
+@pytest.mark.asyncio
+async def test_stream_image_events(image_repository):
+    owner_id = uuid4()
+    img = Image(
+        title='', owner_id=owner_id, status=ImageStatusEnum.PROCESSING
+    )
+    other_img = Image(title='', owner_id=uuid4())
+    for i in (img, other_img):
+        image_repository._storage[i.id_] = i
+    broadcaster = StatusBroadcaster(max_queued=10)
+
+    events = stream_image_events(
+        image_repository,
+        FakeSession(),
+        broadcaster,
+        owner_id=owner_id,
+        image_ids=[img.id_, other_img.id_],
+    )
+    first = await anext(events)
+    assert f'"id": "{img.id_}", "status": "processing"' in first
+
+    broadcaster.deliver(
+        ImageStatusEvent(img.id_, owner_id, ImageStatusEnum.DONE)
+    )
+    second = await anext(events)
+    assert f'"id": "{img.id_}", "status": "done"' in second
+    await events.aclose()
+    assert broadcaster._subscribers == {}
+
+
+async def iter_chunks(chunks, consumed=None):
+    for chunk in chunks:
+        if consumed is not None:
+            consumed.append(chunk)
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_ingest_image(image_repository, monkeypatch):
+    monkeypatch.setattr(
+        'app.images.services.generate_variants_task', FakeTask()
+    )
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 20
+    img_id = await ingest_image(
+        image_repository,
+        FakeSession(),
+        chunks=iter_chunks([png[:3], png[3:10], png[10:]]),
+        title='a',
+        owner_id=uuid4(),
+    )
+    assert image_repository.file_repository._storage[img_id] == png
+    assert image_repository._storage[img_id].content_type == 'image/png'
+
+    with pytest.raises(InvalidFileException):
+        await ingest_image(
+            image_repository,
+            FakeSession(),
+            chunks=iter_chunks([b'GIF89a' + b'\x00' * 20]),
+            title='a',
+            owner_id=uuid4(),
+        )
+    with pytest.raises(InvalidFileException):
+        await ingest_image(
+            image_repository,
+            FakeSession(),
+            chunks=iter_chunks([]),
+            title='a',
+            owner_id=uuid4(),
+        )
+
+    monkeypatch.setattr(settings, 'MAX_FILE_SIZE_MB', 1)
+    consumed = []
+    chunks = [png, *[b'\x00' * 512 * 1024] * 4]
+    with pytest.raises(ImageTooBigException):
+        await ingest_image(
+            image_repository,
+            FakeSession(),
+            chunks=iter_chunks(chunks, consumed),
+            title='a',
+            owner_id=uuid4(),
+        )
+    assert len(consumed) == 3
+    with pytest.raises(ImageTooBigException):
+        await ingest_image(
+            image_repository,
+            FakeSession(),
+            chunks=iter_chunks(chunks),
+            title='a',
+            owner_id=uuid4(),
+            content_length=2 * 1024 * 1024,
+        )
+
+
+@pytest.mark.asyncio
+async def test_ingest_image_metadata(image_repository, monkeypatch):
+    monkeypatch.setattr(
+        'app.images.services.generate_variants_task', FakeTask()
+    )
+    buffer = io.BytesIO()
+    PIL.Image.new('RGB', (40, 30)).save(buffer, 'PNG')
+    png = buffer.getvalue()
+    img_id = await ingest_image(
+        image_repository,
+        FakeSession(),
+        chunks=iter_chunks([png[:10], png[10:]]),
+        title='a',
+        owner_id=uuid4(),
+    )
+    image = image_repository._storage[img_id]
+    assert (image.width, image.height, image.exif) == (40, 30, None)
+
+    monkeypatch.setattr(settings, 'IMAGE_MAX_PIXELS', 1000)
+    with pytest.raises(ImageTooManyPixelsException):
+        await ingest_image(
+            image_repository,
+            FakeSession(),
+            chunks=iter_chunks([png]),
+            title='a',
+            owner_id=uuid4(),
+        )
+
+
+@pytest.mark.asyncio
+async def test_resumable_upload(
+    image_repository, upload_repository, monkeypatch
+):
+    task = FakeTask()
+    monkeypatch.setattr('app.images.services.generate_variants_task', task)
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 20
+    owner_id = uuid4()
+    upload = await create_upload(
+        upload_repository, FakeSession(), 'a', len(png), owner_id
+    )
+
+    upload = await write_upload(
+        image_repository,
+        upload_repository,
+        FakeSession(),
+        upload.id_,
+        owner_id,
+        offset=0,
+        chunks=iter_chunks([png[:5], png[5:15]]),
+    )
+    assert upload.offset == 15
+    assert upload.image_id is None
+    with pytest.raises(UploadOffsetMismatchException):
+        await write_upload(
+            image_repository,
+            upload_repository,
+            FakeSession(),
+            upload.id_,
+            owner_id,
+            offset=0,
+            chunks=iter_chunks([png]),
+        )
+    with pytest.raises(UploadLengthExceededException):
+        await write_upload(
+            image_repository,
+            upload_repository,
+            FakeSession(),
+            upload.id_,
+            owner_id,
+            offset=15,
+            chunks=iter_chunks([png[15:], b'\x00']),
+        )
+    with pytest.raises(UserIsNotOwnerException):
+        await get_upload(upload_repository, FakeSession(), upload.id_, uuid4())
+
+    session = FakeSession()
+    upload = await write_upload(
+        image_repository,
+        upload_repository,
+        session,
+        upload.id_,
+        owner_id,
+        offset=15,
+        chunks=iter_chunks([png[15:]]),
+    )
+    await commit(session)
+    image = image_repository._storage[upload.image_id]
+    assert image.content_type == 'image/png'
+    assert image.size == len(png)
+    assert image_repository.file_repository._storage[image.id_] == png
+    assert task.calls == [{'image_id': image.id_}]
+    with pytest.raises(UploadNotFoundException):
+        await get_upload(
+            upload_repository, FakeSession(), upload.id_, owner_id
+        )
+
+
+@pytest.mark.asyncio
+async def test_resumable_upload_rejects_invalid_file(
+    image_repository, upload_repository, monkeypatch
+):
+    owner_id = uuid4()
+    upload = await create_upload(
+        upload_repository, FakeSession(), 'a', 100, owner_id
+    )
+    with pytest.raises(InvalidFileException):
+        await write_upload(
+            image_repository,
+            upload_repository,
+            FakeSession(),
+            upload.id_,
+            owner_id,
+            offset=0,
+            chunks=iter_chunks([b'GIF89a' + b'\x00' * 20]),
+        )
+    assert upload_repository._storage[upload.id_].offset == 0
+
+    monkeypatch.setattr(settings, 'MAX_FILE_SIZE_MB', 1)
+    with pytest.raises(ImageTooBigException):
+        await create_upload(
+            upload_repository, FakeSession(), 'a', 2 * 1024 * 1024, owner_id
+        )
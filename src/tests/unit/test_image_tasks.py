@@ -0,0 +1,88 @@
+import io
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from uuid import uuid4
+
+import PIL.Image
+import pytest
+
+from app.common.settings import settings
+from app.images import tasks
+from app.images.models import (
+    EditOperation,
+    EncodeOptions,
+    Image,
+    ImageEditActionEnum,
+    ImageFormatEnum,
+    ImageStatusEnum,
+)
+from app.images.pipeline import dump_operations
+from tests.conftest import FakeImageRepository, FakeSession, FakeTask
+
+
+@pytest.fixture
+def task_env(monkeypatch):
+    repository = FakeImageRepository()
+    variants_task = FakeTask()
+    published = []
+
+    async def get_image_repository():
+        return repository
+
+    @asynccontextmanager
+    async def scoped_session():
+        yield FakeSession()
+
+    async def publish_status(images):
+        published.extend((i.id_, i.status) for i in images)
+
+    monkeypatch.setattr(settings, 'TASK_QUEUE', 'celery')
+    monkeypatch.setattr(tasks, 'get_image_repository', get_image_repository)
+    monkeypatch.setattr(tasks, 'scoped_session', scoped_session)
+    monkeypatch.setattr(tasks, 'publish_status', publish_status)
+    monkeypatch.setattr(tasks, 'generate_variants_task', variants_task)
+    return repository, variants_task, published
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    PIL.Image.new('RGB', (4, 4), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_edit_images_retries_only_failed_items(task_env):
+    repository, variants_task, published = task_env
+    owner_id = uuid4()
+    good = Image(title='', owner_id=owner_id)
+    bad = Image(title='', owner_id=owner_id)
+    repository.file_repository._storage[good.id_] = _png()
+    repository.file_repository._storage[bad.id_] = b'not an image'
+    new_images = [
+        Image(title='', owner_id=owner_id, status=ImageStatusEnum.PROCESSING)
+        for _ in range(2)
+    ]
+    for image in (good, bad, *new_images):
+        repository._storage[image.id_] = image
+    encoding = asdict(EncodeOptions(ImageFormatEnum.PNG))
+    items = [
+        {'orig_id': orig.id_, 'new_id': new.id_, 'encoding': encoding}
+        for orig, new in zip((good, bad), new_images)
+    ]
+    operations = dump_operations([EditOperation(ImageEditActionEnum.INVERT)])
+
+    for _ in range(2):
+        with pytest.raises(PIL.UnidentifiedImageError):
+            await tasks._edit_images(items, operations)
+        assert [i.status for i in new_images] == [
+            ImageStatusEnum.DONE, ImageStatusEnum.PROCESSING
+        ]
+        assert variants_task.calls == [{'image_id': new_images[0].id_}]
+
+    with pytest.raises(PIL.UnidentifiedImageError):
+        await tasks._fail_on_error(
+            tasks._edit_images(items, operations),
+            [str(i.id_) for i in new_images],
+        )
+    assert new_images[1].status == ImageStatusEnum.FAILED
+    assert published[-1] == (new_images[1].id_, ImageStatusEnum.FAILED)
@@ -0,0 +1,144 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+import pytest
+
+from app.common.queue import Job
+from app.common.settings import settings
+from app.images import worker
+
+
+@dataclass
+class FakeJobQueue:
+    jobs: list[Job]
+    stop: asyncio.Event
+    completed: list[int] = field(default_factory=list)
+    released: list[int] = field(default_factory=list)
+    extended: list[int] = field(default_factory=list)
+    claims: list[int] = field(default_factory=list)
+
+    async def claim(self, session, limit):
+        self.claims.append(limit)
+        if not self.jobs:
+            self.stop.set()
+        claimed, self.jobs = self.jobs[:limit], self.jobs[limit:]
+        return claimed
+
+    async def extend(self, session, job):
+        self.extended.append(job.id_)
+        return True
+
+    async def complete(self, session, job):
+        self.completed.append(job.id_)
+
+    async def release(self, session, job):
+        self.released.append(job.id_)
+
+
+@pytest.mark.asyncio
+async def test_run_worker(monkeypatch):
+    calls = []
+
+    async def handler(value, executor):
+        await asyncio.sleep(0)
+        if value == 'fail':
+            raise ValueError(value)
+        calls.append(value)
+
+    monkeypatch.setattr(worker, 'HANDLERS', {'task': handler})
+    stop = asyncio.Event()
+    jobs = [
+        Job(id_=i, name='task', kwargs={'value': value}, attempts=1)
+        for i, value in enumerate(['a', 'fail', 'b'])
+    ]
+    queue = FakeJobQueue(jobs, stop)
+
+    with ThreadPoolExecutor(1) as executor:
+        await worker.run_worker(queue, executor, 2, stop)
+
+    assert sorted(calls) == ['a', 'b']
+    assert sorted(queue.completed) == [0, 2]
+    assert max(queue.claims) == 2
+
+
+@pytest.mark.asyncio
+async def test_run_job_gives_up(monkeypatch):
+    failed = []
+
+    async def handler(new_id, executor):
+        raise ValueError(new_id)
+
+    async def fail_edits(image_ids):
+        failed.extend(image_ids)
+
+    monkeypatch.setattr(worker, 'HANDLERS', {'task': handler})
+    monkeypatch.setattr(
+        worker, 'PENDING_IMAGES', {'task': lambda kwargs: [kwargs['new_id']]}
+    )
+    monkeypatch.setattr(worker, '_fail_edits', fail_edits)
+    queue = FakeJobQueue([], asyncio.Event())
+    attempts = settings.JOB_MAX_ATTEMPTS
+
+    for attempt in range(1, attempts + 1):
+        job = Job(
+            id_=1, name='task', kwargs={'new_id': 'x'}, attempts=attempt
+        )
+        await worker.run_job(queue, job, None)
+        assert queue.completed == ([] if attempt < attempts else [1])
+
+    assert failed == ['x']
+
+    # The worker running the last attempt died, so the job was claimed
+    # once more.
+    job = Job(id_=2, name='task', kwargs={'new_id': 'y'}, attempts=4)
+    monkeypatch.setattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+    await worker.run_job(queue, job, None)
+    assert queue.completed == [1, 2]
+    assert failed == ['x', 'y']
+
+
+@pytest.mark.asyncio
+async def test_run_job_broken_pool(monkeypatch):
+    async def handler(executor):
+        raise BrokenProcessPool()
+
+    monkeypatch.setattr(worker, 'HANDLERS', {'task': handler})
+    queue = FakeJobQueue([], asyncio.Event())
+
+    await worker.run_job(
+        queue, Job(id_=1, name='task', kwargs={}, attempts=1), None
+    )
+    assert queue.released == [1]
+    assert queue.completed == []
+
+
+@pytest.mark.asyncio
+async def test_run_job_keeps_lock(monkeypatch):
+    async def handler(executor):
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(worker, 'HANDLERS', {'task': handler})
+    monkeypatch.setattr(settings, 'JOB_LOCK_SECONDS', 0.03)
+    queue = FakeJobQueue([], asyncio.Event())
+
+    await worker.run_job(
+        queue, Job(id_=1, name='task', kwargs={}, attempts=1), None
+    )
+    extended = len(queue.extended)
+    assert extended >= 2
+    await asyncio.sleep(0.03)
+    assert len(queue.extended) == extended
+    assert queue.completed == [1]
+
+
+def test_respawning_executor():
+    class BrokenExecutor(Executor):
+        def submit(self, fn, /, *args, **kwargs):
+            raise BrokenProcessPool()
+
+    executors = iter([BrokenExecutor(), ThreadPoolExecutor(1)])
+    with worker.RespawningExecutor(lambda: next(executors)) as executor:
+        assert executor.submit(pow, 2, 3).result() == 8
+        assert isinstance(executor._executor, ThreadPoolExecutor)
@@ -0,0 +1,44 @@
+import pytest
+from prometheus_client import CollectorRegistry, Histogram
+
+from app.common import middleware
+from app.common.metrics import CallbackCounter
+
+
+def test_callback_counter():
+    registry = CollectorRegistry()
+    hits = [3]
+    CallbackCounter('hits', 'Hits.', lambda: hits[0], registry)
+
+    assert registry.get_sample_value('hits_total') == 3
+    hits[0] = 5
+    assert registry.get_sample_value('hits_total') == 5
+
+
+@pytest.mark.asyncio
+async def test_metrics_middleware(monkeypatch):
+    registry = CollectorRegistry()
+    histogram = Histogram(
+        'duration', '', ('method', 'route', 'status'), registry=registry
+    )
+    monkeypatch.setattr(middleware, 'http_request_duration', histogram)
+
+    class Route:
+        path = '/image/{image_id}'
+
+    async def app(scope, receive, send):
+        scope['route'] = Route()
+        await send({'type': 'http.response.start', 'status': 404})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'headers': []}
+    await middleware.MetricsMiddleware(app)(scope, None, send)
+
+    assert len(sent) == 2
+    labels = {'method': 'GET', 'route': '/image/{image_id}', 'status': '404'}
+    assert registry.get_sample_value('duration_count', labels) == 1
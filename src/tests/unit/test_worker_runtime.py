@@ -0,0 +1,13 @@
+import asyncio
+
+from app.common.worker_runtime import run
+
+
+async def get_running_loop():
+    return asyncio.get_running_loop()
+
+
+def test_run_reuses_loop():
+    loop = run(get_running_loop())
+    assert run(get_running_loop()) is loop
+    assert not loop.is_closed()